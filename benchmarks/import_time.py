@@ -0,0 +1,95 @@
+"""
+claco の各モジュールの import にかかる時間を `python -X importtime` で計測するベンチマーク
+
+モジュールごとに新しいインタプリタを起動して計測し、次の場合は終了コード 1 で終わる。
+- 読み込んではいけない重いモジュール（asyncio など）が読み込まれた
+- import にかかった時間（中央値）が上限を超えた
+
+usage:
+    $ uv run python benchmarks/import_time.py [--runs 5] [--scale 1.0]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+# (モジュール, 上限 [ms], 読み込まれてはいけないモジュール)
+CASES: list[tuple[str, float, tuple[str, ...]]] = [
+    ("claco", 20.0, ("asyncio", "importlib.metadata", "claco.comm", "claco.receiver", "claco.sender")),
+    ("claco.wire", 40.0, ("asyncio", "random")),
+    ("claco.receiver", 80.0, ("asyncio", "importlib.metadata", "claco.sender", "claco.queue")),
+    ("claco.sender", 100.0, ("asyncio", "importlib.resources", "claco.receiver")),
+    ("claco.chat", 40.0, ("asyncio", "dotenv", "claco.comm")),
+    ("claco.recorder", 80.0, ("asyncio", "claco.receiver")),
+    ("claco.comm", 300.0, ()),
+]
+
+
+def measure(module: str) -> tuple[float, dict[str, int]]:
+    """
+    新しいインタプリタで module を import する
+
+    Args:
+        module: import するモジュール
+
+    Returns:
+        (module の累積 import 時間 [ms], 読み込まれたモジュールと累積時間 [us] の対応)
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # import time: self [us] | cumulative | imported package
+    loaded: dict[str, int] = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:") :].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue
+        loaded[fields[2].strip()] = int(fields[1])
+
+    return loaded.get(module, 0) / 1000, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="interpreter launches per module")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the budgets (for slow machines)")
+    args = parser.parse_args()
+
+    failures = []
+    for module, budget, forbidden in CASES:
+        budget *= args.scale
+        times = []
+        loaded: dict[str, int] = {}
+        for _ in range(args.runs):
+            t, loaded = measure(module)
+            times.append(t)
+        median = statistics.median(times)
+
+        pulled = [m for m in forbidden if m in loaded]
+        status = "ok"
+        if pulled:
+            status = "FAIL"
+            failures.append(f"{module}: imports {', '.join(pulled)}")
+        if median > budget:
+            status = "FAIL"
+            failures.append(f"{module}: {median:.1f}ms > budget {budget:.1f}ms")
+
+        print(f"{module:>16}: median={median:7.1f}ms min={min(times):7.1f}ms budget={budget:7.1f}ms {status}")
+
+    if failures:
+        print()
+        for failure in failures:
+            print(f"regression: {failure}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
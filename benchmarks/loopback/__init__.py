@@ -0,0 +1,117 @@
+"""
+実際のデスクトップアプリを使わずに claco 自身のオーバーヘッドを計測するためのループバック環境
+
+LoopbackSender は Sender の代わりに Communicator に渡すスタンドインで、send されると
+Sink サーバと同じ形式のデータグラムを、指定した文の数・大きさ・送信レートで送り返す。
+各文には送信時刻が埋め込まれているので、受信側で遅延を計測できる。
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+
+from claco.sender import Sender
+from claco.transport import Endpoint, Connection, is_stream, max_frame_size
+from claco.wire import FrameWriter, pack_batch, FRAME_HEADER_SIZE
+
+
+@dataclass
+class Workload:
+    # 1回の返事で送る文の数
+    sentences: int = 100
+    # 1文のバイト数
+    size: int = 64
+    # 1秒あたりに送る文の数。0 の場合は待たずに送る
+    rate: float = 0.0
+    # True の場合は sink_many と同じように複数の文をまとめて送る
+    batch: bool = False
+    # 返事の終わりを表すタグ
+    exit_tag: str = "<exit>"
+
+
+def make_sentence(index: int, size: int) -> str:
+    # 送信時刻を埋め込んだ文を作る
+    head = f"{index}:{time.perf_counter_ns()}:"
+    return head + "x" * max(0, size - len(head))
+
+
+def parse_sentence(message: str) -> tuple[int, int]:
+    # make_sentence で作った文から (index, 送信時刻 [ns]) を取り出す
+    index, sent_ns, _ = message.split(":", 2)
+    return int(index), int(sent_ns)
+
+
+class Emitter:
+    """
+    Sink サーバと同じ形式でデータグラムを送る
+    """
+
+    def __init__(self, endpoint: Endpoint, session: int | None = None):
+        # unix や tcp の場合はレシーバーがバインドするまで connect できないので、最初の送信時に connect する
+        self.endpoint = endpoint
+        self.conn = Connection(endpoint)
+        self.frame_size = max_frame_size(endpoint)
+        # tcp では取りこぼしが無いので、<exit> を繰り返し送らない
+        self.exit_repeat = 1 if is_stream(endpoint) else 3
+        self.writer = FrameWriter(session)
+        self.lock = threading.Lock()
+        # 送信スレッドが使った CPU 時間 [s]。受信側の CPU 時間から差し引くために使う
+        self.cpu_time = 0.0
+
+    def _send(self, payload: bytes, repeat: int = 1) -> None:
+        datagrams = self.writer.frames(payload, self.frame_size)
+        for data in datagrams[:-1]:
+            self.conn.send(data)
+        for _ in range(repeat):
+            self.conn.send(datagrams[-1])
+
+    def emit(self, workload: Workload) -> None:
+        t0 = time.thread_time()
+        interval = 1.0 / workload.rate if workload.rate > 0 else 0.0
+        next_time = time.perf_counter()
+
+        with self.lock:
+            if workload.batch:
+                # 送信レートは無視して、まとめて送る
+                messages = [make_sentence(i, workload.size) for i in range(workload.sentences)]
+                for data in pack_batch(messages, self.frame_size - FRAME_HEADER_SIZE):
+                    self._send(data)
+            else:
+                for i in range(workload.sentences):
+                    if interval:
+                        next_time += interval
+                        delay = next_time - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                    self._send(make_sentence(i, workload.size).encode("utf-8"))
+
+            self._send(workload.exit_tag.encode("utf-8"), repeat=self.exit_repeat)
+
+        self.cpu_time += time.thread_time() - t0
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class LoopbackSender(Sender):
+    """
+    send されると、別スレッドから Workload に従って返事のデータグラムを送り返す Sender
+    """
+
+    def __init__(self, emitter: Emitter, workload: Workload):
+        # ヘルパーは使わないので、exe_path の存在確認だけ通るようにする
+        super().__init__(exe_path=__file__)
+        self.emitter = emitter
+        self.workload = workload
+        self.sends = 0
+
+    def send(self, target: str, message: str, raw: bool = False, window_title: str | None = None):
+        self.sends += 1
+        threading.Thread(target=self.emitter.emit, args=(self.workload,), daemon=True).start()
+        return True, None
+
+    async def asend(self, target: str, message: str, raw: bool = False, window_title: str | None = None):
+        return self.send(target, message, raw, window_title)
+
+    def close(self):
+        self.emitter.close()
@@ -0,0 +1,309 @@
+"""
+ループバック環境で claco の受信経路のスループット・遅延・取りこぼし・CPU 使用量を計測する
+
+usage:
+    $ uv run python -m benchmarks.loopback [--sentences 1000] [--size 64] [--rate 0] [--batch] [--rounds 5] [--overflow block] [--rcvbuf N] [--drain] [--workers 0] [--unix PATH | --tcp] [--record DIR]
+"""
+
+import argparse
+import asyncio
+import statistics
+import threading
+import time
+from dataclasses import dataclass, field
+
+from claco.comm import Communicator, AsyncCommunicator
+from claco.queue import MessageQueue, AsyncMessageQueue, ClaudeMessageQueue, AsyncClaudeMessageQueue, OverflowPolicy
+from claco.receiver import UDPReceiver, AsyncUDPReceiver
+from claco.recorder import TranscriptRecorder
+from claco.transport import Endpoint, udp_endpoint, tcp_endpoint, unix_endpoint
+
+from . import Emitter, LoopbackSender, Workload, make_sentence, parse_sentence
+
+
+@dataclass
+class Result:
+    name: str
+    expected: int
+    elapsed: float = 0.0
+    cpu: float = 0.0
+    latencies: list[float] = field(default_factory=list)
+    indices: set[tuple[int, int]] = field(default_factory=set)
+
+    def on_message(self, message: str, round_: int = 0) -> None:
+        index, sent_ns = parse_sentence(message)
+        self.latencies.append((time.perf_counter_ns() - sent_ns) / 1000)
+        self.indices.add((round_, index))
+
+    def report(self) -> None:
+        received = len(self.indices)
+        drops = self.expected - received
+        throughput = received / self.elapsed if self.elapsed > 0 else 0.0
+        cpu_per_msg = self.cpu / received * 1e6 if received else 0.0
+        if len(self.latencies) >= 2:
+            qs = statistics.quantiles(self.latencies, n=100)
+            lat = f"p50={qs[49]:9.1f}us p95={qs[94]:9.1f}us p99={qs[98]:9.1f}us"
+        else:
+            lat = "p50=      n/a"
+        print(
+            f"{self.name:>18}: {received:7d} msgs {throughput:10.0f} msg/s {lat} "
+            f"drops={drops:<6d} cpu={cpu_per_msg:6.1f}us/msg"
+        )
+
+
+class _Clock:
+    # 経過時間と、送信スレッドの分を除いた CPU 時間を計る
+
+    def __init__(self, emitter: Emitter | None = None):
+        self.emitter = emitter
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        self.c0 = time.process_time()
+        self.e0 = self.emitter.cpu_time if self.emitter else 0.0
+        return self
+
+    def __exit__(self, *args):
+        self.elapsed = time.perf_counter() - self.t0
+        emitter_cpu = (self.emitter.cpu_time if self.emitter else 0.0) - self.e0
+        self.cpu = time.process_time() - self.c0 - emitter_cpu
+
+
+def bench_receiver(
+    endpoint: Endpoint,
+    workload: Workload,
+    rounds: int,
+    rcvbuf: int | None,
+    drain: bool,
+    workers: int = 0,
+    record: str | None = None,
+) -> Result:
+    mode = f" ({workers} workers)" if workers else " (drain)" if drain else ""
+    mode += " (record)" if record else ""
+    result = Result("UDPReceiver" + mode, workload.sentences * rounds)
+    done = threading.Event()
+    state = {"round": 0}
+
+    def callback(message, address, timestamp):
+        for msg in message.split("\x1e"):
+            if msg == workload.exit_tag:
+                done.set()
+            elif msg:
+                result.on_message(msg, state["round"])
+
+    receiver = UDPReceiver(endpoint, rcvbuf=rcvbuf, drain=drain, workers=workers)
+    receiver.register_callback(callback)
+    recorder = TranscriptRecorder(record) if record else None
+    if recorder:
+        recorder.attach(receiver)
+        recorder.start()
+    emitter = Emitter(endpoint)
+    with receiver:
+        time.sleep(0.05)
+        with _Clock(emitter) as clock:
+            for r in range(rounds):
+                state["round"] = r
+                done.clear()
+                emitter.emit(workload)
+                done.wait(timeout=5.0)
+    emitter.close()
+    if recorder:
+        # 書き込みスレッドの CPU 時間は計測に含めない
+        recorder.stop()
+
+    result.elapsed, result.cpu = clock.elapsed, clock.cpu
+    return result
+
+
+def bench_async_receiver(endpoint: Endpoint, workload: Workload, rounds: int, rcvbuf: int | None) -> Result:
+    result = Result("AsyncUDPReceiver", workload.sentences * rounds)
+
+    async def run():
+        done = asyncio.Event()
+        state = {"round": 0}
+
+        def callback(message, address, timestamp):
+            for msg in message.split("\x1e"):
+                if msg == workload.exit_tag:
+                    done.set()
+                elif msg:
+                    result.on_message(msg, state["round"])
+
+        receiver = AsyncUDPReceiver(endpoint, rcvbuf=rcvbuf)
+        receiver.register_callback(callback)
+        emitter = Emitter(endpoint)
+        async with receiver:
+            with _Clock(emitter) as clock:
+                for r in range(rounds):
+                    state["round"] = r
+                    done.clear()
+                    threading.Thread(target=emitter.emit, args=(workload,), daemon=True).start()
+                    try:
+                        await asyncio.wait_for(done.wait(), timeout=5.0)
+                    except TimeoutError:
+                        pass
+        emitter.close()
+        result.elapsed, result.cpu = clock.elapsed, clock.cpu
+
+    asyncio.run(run())
+    return result
+
+
+def bench_queue(workload: Workload, rounds: int, maxsize: int, overflow: OverflowPolicy) -> Result:
+    result = Result("MessageQueue", workload.sentences * rounds)
+    q = MessageQueue(maxsize=maxsize, overflow=overflow)
+
+    def produce():
+        for _ in range(rounds):
+            for i in range(workload.sentences):
+                q.post(make_sentence(i, workload.size))
+
+    with _Clock() as clock:
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        for r in range(rounds):
+            for _ in range(workload.sentences):
+                result.on_message(q.receive(), r)
+        producer.join()
+
+    result.elapsed, result.cpu = clock.elapsed, clock.cpu
+    return result
+
+
+def bench_async_queue(workload: Workload, rounds: int, maxsize: int, overflow: OverflowPolicy) -> Result:
+    result = Result("AsyncMessageQueue", workload.sentences * rounds)
+
+    async def run():
+        q = AsyncMessageQueue(maxsize=maxsize, overflow=overflow)
+        q.bind(asyncio.get_running_loop())
+
+        def produce():
+            # 受信スレッドからの post を模して、別スレッドから post_threadsafe する
+            for _ in range(rounds):
+                for i in range(workload.sentences):
+                    q.post_threadsafe(make_sentence(i, workload.size))
+
+        with _Clock() as clock:
+            producer = threading.Thread(target=produce, daemon=True)
+            producer.start()
+            for r in range(rounds):
+                for _ in range(workload.sentences):
+                    result.on_message(await q.receive(), r)
+            producer.join()
+        result.elapsed, result.cpu = clock.elapsed, clock.cpu
+
+    asyncio.run(run())
+    return result
+
+
+def bench_communicator(
+    endpoint: Endpoint,
+    workload: Workload,
+    rounds: int,
+    maxsize: int,
+    overflow: OverflowPolicy,
+    rcvbuf: int | None,
+    drain: bool,
+) -> Result:
+    result = Result("Communicator", workload.sentences * rounds)
+    emitter = Emitter(endpoint)
+    comm = Communicator(
+        "loopback",
+        LoopbackSender(emitter, workload),
+        UDPReceiver(endpoint, rcvbuf=rcvbuf, drain=drain),
+        ClaudeMessageQueue(maxsize=maxsize, exit_tag=workload.exit_tag, overflow=overflow),
+    )
+    with comm:
+        time.sleep(0.05)
+        with _Clock(emitter) as clock:
+            for r in range(rounds):
+                for message in comm.communicate("ping"):
+                    result.on_message(message, r)
+
+    result.elapsed, result.cpu = clock.elapsed, clock.cpu
+    return result
+
+
+def bench_async_communicator(
+    endpoint: Endpoint, workload: Workload, rounds: int, maxsize: int, overflow: OverflowPolicy, rcvbuf: int | None
+) -> Result:
+    result = Result("AsyncCommunicator", workload.sentences * rounds)
+
+    async def run():
+        emitter = Emitter(endpoint)
+        comm = AsyncCommunicator(
+            "loopback",
+            LoopbackSender(emitter, workload),
+            AsyncUDPReceiver(endpoint, rcvbuf=rcvbuf),
+            AsyncClaudeMessageQueue(maxsize=maxsize, exit_tag=workload.exit_tag, overflow=overflow),
+        )
+        async with comm:
+            with _Clock(emitter) as clock:
+                for r in range(rounds):
+                    async for message in comm.communicate("ping"):
+                        result.on_message(message, r)
+        result.elapsed, result.cpu = clock.elapsed, clock.cpu
+
+    asyncio.run(run())
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=19999, help="UDP or TCP port used for the loopback")
+    transport = parser.add_mutually_exclusive_group()
+    transport.add_argument("--unix", metavar="PATH", default=None, help="use a unix domain socket instead of UDP")
+    transport.add_argument("--tcp", action="store_true", help="use a TCP connection instead of UDP")
+    parser.add_argument("--sentences", type=int, default=1000, help="sentences per response")
+    parser.add_argument("--size", type=int, default=64, help="bytes per sentence")
+    parser.add_argument("--rate", type=float, default=0.0, help="sentences per second (0: as fast as possible)")
+    parser.add_argument("--batch", action="store_true", help="pack sentences like sink_many")
+    parser.add_argument("--rounds", type=int, default=5, help="responses per benchmark")
+    parser.add_argument("--queue-size", type=int, default=8, help="queue max size")
+    parser.add_argument(
+        "--overflow",
+        default="block",
+        choices=["block", "spill", "unbounded"],
+        help="queue overflow policy (drop policies are not benchmarked since they lose sentences)",
+    )
+    parser.add_argument("--rcvbuf", type=int, default=None, help="SO_RCVBUF of the receivers (bytes)")
+    parser.add_argument("--drain", action="store_true", help="run UDPReceiver in drain mode")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="also benchmark UDPReceiver with this many worker processes (cpu excludes the workers)",
+    )
+    parser.add_argument(
+        "--record", metavar="DIR", default=None, help="also benchmark UDPReceiver with a TranscriptRecorder into DIR"
+    )
+    args = parser.parse_args()
+    if args.unix:
+        endpoint = unix_endpoint(args.unix)
+    elif args.tcp:
+        endpoint = tcp_endpoint("127.0.0.1", args.port)
+    else:
+        endpoint = udp_endpoint("127.0.0.1", args.port)
+
+    workload = Workload(sentences=args.sentences, size=args.size, rate=args.rate, batch=args.batch)
+    print(
+        f"{workload=} {endpoint=!s} rounds={args.rounds} queue_size={args.queue_size} overflow={args.overflow} "
+        f"rcvbuf={args.rcvbuf} drain={args.drain} workers={args.workers}"
+    )
+
+    bench_receiver(endpoint, workload, args.rounds, args.rcvbuf, args.drain).report()
+    if args.workers:
+        bench_receiver(endpoint, workload, args.rounds, args.rcvbuf, args.drain, args.workers).report()
+    if args.record:
+        bench_receiver(endpoint, workload, args.rounds, args.rcvbuf, args.drain, record=args.record).report()
+    bench_async_receiver(endpoint, workload, args.rounds, args.rcvbuf).report()
+    bench_queue(workload, args.rounds, args.queue_size, args.overflow).report()
+    bench_async_queue(workload, args.rounds, args.queue_size, args.overflow).report()
+    bench_communicator(
+        endpoint, workload, args.rounds, args.queue_size, args.overflow, args.rcvbuf, args.drain
+    ).report()
+    bench_async_communicator(endpoint, workload, args.rounds, args.queue_size, args.overflow, args.rcvbuf).report()
+
+
+if __name__ == "__main__":
+    main()
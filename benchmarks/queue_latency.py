@@ -0,0 +1,80 @@
+"""
+MessageQueue の配送遅延を計測するマイクロベンチマーク
+
+以前の実装（get_nowait + 50ms sleep のポーリング）と現在の実装（Condition による待機）で
+post してから receive が戻るまでの時間の分布を比較する。
+
+usage:
+    $ uv run python benchmarks/queue_latency.py [--count 500] [--interval 0.002]
+"""
+
+import argparse
+import queue
+import random
+import statistics
+import threading
+import time
+
+from claco.queue import MessageQueue
+
+
+class PollingMessageQueue:
+    # 比較用: 以前の MessageQueue.receive の実装
+
+    def __init__(self, maxsize=1):
+        self._q = queue.Queue(maxsize=maxsize)
+
+    def post(self, message: str) -> None:
+        self._q.put(message)
+
+    def receive(self) -> str:
+        while True:
+            try:
+                return self._q.get_nowait()
+            except queue.Empty:
+                time.sleep(0.05)
+
+
+def measure(q, count: int, interval: float) -> list[float]:
+    # producer がランダムな間隔で post し、consumer が受け取るまでの時間 [us] を返す
+    sent: dict[str, int] = {}
+    latencies: list[float] = []
+
+    def produce():
+        for i in range(count):
+            time.sleep(random.uniform(0, interval * 2))
+            key = str(i)
+            sent[key] = time.perf_counter_ns()
+            q.post(key)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    for _ in range(count):
+        key = q.receive()
+        latencies.append((time.perf_counter_ns() - sent[key]) / 1000)
+
+    producer.join()
+    return latencies
+
+
+def report(name: str, latencies: list[float]) -> None:
+    qs = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:>8}: n={len(latencies)} "
+        f"p50={qs[49]:10.1f}us p90={qs[89]:10.1f}us p99={qs[98]:10.1f}us max={max(latencies):10.1f}us"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=500, help="number of messages")
+    parser.add_argument("--interval", type=float, default=0.002, help="mean interval between posts [s]")
+    args = parser.parse_args()
+
+    report("polling", measure(PollingMessageQueue(maxsize=8), args.count, args.interval))
+    report("event", measure(MessageQueue(maxsize=8), args.count, args.interval))
+
+
+if __name__ == "__main__":
+    main()
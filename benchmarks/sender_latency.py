@@ -0,0 +1,54 @@
+"""
+Sender の送信レイテンシを計測するベンチマーク
+
+送信のたびにヘルパーを起動する場合と、ヘルパーを常駐させた場合（persistent=True）を比較する。
+デフォルトではスタンドイン（claco/bin/cui_standin.py）を使うので、Windows 以外でも実行できる。
+
+usage:
+    $ uv run python benchmarks/sender_latency.py [--count 50] [--exe-path PATH]
+"""
+
+import argparse
+import importlib.resources
+import statistics
+import time
+
+from claco.sender import ClaudeSender
+
+
+def measure(sender: ClaudeSender, count: int) -> list[float]:
+    # 1回の send にかかった時間 [ms] を返す
+    latencies = []
+    for i in range(count):
+        t0 = time.perf_counter()
+        ok, err = sender.send("Claude", f"message {i}\nsecond line")
+        latencies.append((time.perf_counter() - t0) * 1000)
+        if not ok:
+            raise RuntimeError(err)
+    return latencies
+
+
+def report(name: str, latencies: list[float]) -> None:
+    qs = statistics.quantiles(latencies, n=100)
+    print(f"{name:>10}: n={len(latencies)} p50={qs[49]:8.2f}ms p90={qs[89]:8.2f}ms p99={qs[98]:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=50, help="number of sends")
+    parser.add_argument("--exe-path", default=None, help="helper executable (default: the stand-in)")
+    args = parser.parse_args()
+
+    exe_path = args.exe_path or str(importlib.resources.files("claco.bin").joinpath("cui_standin.py"))
+
+    report("spawn", measure(ClaudeSender(exe_path), args.count))
+
+    sender = ClaudeSender(exe_path, persistent=True)
+    try:
+        report("persistent", measure(sender, args.count))
+    finally:
+        sender.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,41 @@
-from ._version import __version__
-from . import chat
-from . import comm
-from . import receiver
-from . import sender
-from . import queue
+# サブモジュールは最初にアクセスされた時に import する (PEP 562)
+# `import claco` だけでは受信・送信まわりのモジュールを読み込まない
+
+import importlib
+
+
+_SUBMODULES = {
+    "cache",
+    "chat",
+    "comm",
+    "pool",
+    "receiver",
+    "recorder",
+    "router",
+    "sender",
+    "queue",
+    "stats",
+    "transport",
+    "wire",
+}
+
+__all__ = ["__version__", *sorted(_SUBMODULES)]
+
+
+def __getattr__(name: str):
+    if name == "__version__":
+        from ._version import __version__
+
+        globals()["__version__"] = __version__
+        return __version__
+
+    if name in _SUBMODULES:
+        module = importlib.import_module(f".{name}", __name__)
+        globals()[name] = module
+        return module
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return __all__
@@ -1,23 +1,89 @@
 # server.py
 import os
 import sys
-import socket
+import time
 import datetime
+import threading
 import traceback
 
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
 
+from claco.wire import pack_batch, FrameWriter, FRAME_HEADER_SIZE
+from claco.transport import endpoint_from_env, is_stream, max_frame_size, Connection
+
 
 load_dotenv()
-CLACO_UDP_ADDR = os.getenv("CLACO_UDP_ADDR")
-CLACO_UDP_PORT = os.getenv("CLACO_UDP_PORT")
 
-if CLACO_UDP_ADDR is None:
-    raise ValueError("CLACO_UDP_ADDR is not set")
+# 送信先。CLACO_TRANSPORT=unix の場合は CLACO_UNIX_PATH、tcp の場合は CLACO_TCP_ADDR と CLACO_TCP_PORT、
+# それ以外は CLACO_UDP_ADDR と CLACO_UDP_PORT で指定する
+CLACO_ENDPOINT = endpoint_from_env()
+
+# 1回の send で送れる最大バイト数。tcp ではデータグラムの大きさの制限を受けない
+_MAX_FRAME_SIZE = max_frame_size(CLACO_ENDPOINT)
+
+# 1 を指定すると送信のたびに stderr へログを書き出す
+CLACO_SINK_VERBOSE = os.getenv("CLACO_SINK_VERBOSE", "0") not in ("", "0", "false", "False")
+
+# 0 を指定するとヘッダを付けずにテキストだけを送る（ヘッダに対応していないレシーバー向け）
+CLACO_SINK_FRAMING = os.getenv("CLACO_SINK_FRAMING", "1") not in ("", "0", "false", "False")
+
+# ヘッダに入れるセッションID。指定しない場合はランダムに決める
+CLACO_SESSION = os.getenv("CLACO_SESSION")
+
+# 返事の終わりを表すタグ
+# これを含むデータグラムが失われると受信側が返事の終わりを検出できないので、同じ連番で複数回送る
+# 受信側では重複したデータグラムは捨てられる。tcp では失われないので1回だけ送る
+CLACO_SINK_EXIT_TAG = os.getenv("CLACO_SINK_EXIT_TAG", "<exit>")
+_EXIT_REPEAT = 1 if is_stream(CLACO_ENDPOINT) else 3
+
+# 受信側に送れない場合に、1回のツール呼び出しの中で接続し直し続ける最大時間 [s]
+# tcp では受信側が起動し直すまで待ってから送る。それでも送れない場合はツール呼び出しを失敗させてモデルに伝える
+# 取りこぼしを前提とする udp では待たない
+CLACO_SINK_SEND_TIMEOUT = float(os.getenv("CLACO_SINK_SEND_TIMEOUT", "5" if is_stream(CLACO_ENDPOINT) else "0"))
+
+_writer = FrameWriter(int(CLACO_SESSION) if CLACO_SESSION else None)
+
+
+# 送信用の接続は使い回す
+# 送信に失敗した場合は接続し直して再送し、接続できない間は間隔を延ばしながら接続し直す
+_conn = Connection(CLACO_ENDPOINT)
+_sock_lock = threading.Lock()
+
+
+def _send(data: bytes, deadline: float) -> None:
+    _conn.send(data, max(deadline - time.monotonic(), 0.0))
 
-if CLACO_UDP_PORT is None:
-    raise ValueError("CLACO_UDP_PORT is not set")
+
+def _send_payload(payload: bytes, deadline: float, is_exit: bool = False) -> None:
+    if not CLACO_SINK_FRAMING:
+        _send(payload, deadline)
+        return
+
+    # 1つのデータグラムに収まらない場合はフラグメントに分けて送る
+    datagrams = _writer.frames(payload, _MAX_FRAME_SIZE)
+    for data in datagrams[:-1]:
+        _send(data, deadline)
+    for _ in range(_EXIT_REPEAT if is_exit else 1):
+        _send(datagrams[-1], deadline)
+
+
+def _log_error(error_message: str, message: str) -> None:
+    print(f"[Sink] {error_message}", file=sys.stderr)
+    traceback.print_exc(file=sys.stderr)
+
+    # 例外をログファイルに記録
+    log_directory = "logs"
+    os.makedirs(log_directory, exist_ok=True)
+    log_file_path = os.path.join(log_directory, "sink_error.log")
+
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    with open(log_file_path, "a", encoding="utf-8") as log_file:
+        log_file.write(f"[{timestamp}] {error_message}\n")
+        log_file.write(f"Message content: {message}\n")
+        log_file.write(f"{traceback.format_exc()}\n")
+        log_file.write("-" * 50 + "\n")
 
 
 # Create an MCP server
@@ -26,33 +92,34 @@ mcp = FastMCP("Sink")
 
 @mcp.tool()
 def sink(message: str) -> None:
-    print(f"[Sink] serving: {CLACO_UDP_ADDR}:{CLACO_UDP_PORT}", file=sys.stderr)
-
-    # UDP ソケット作成
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if CLACO_SINK_VERBOSE:
+        print(f"[Sink] sending to {CLACO_ENDPOINT}: {message}", file=sys.stderr)
 
     # メッセージをエンコードして送信
-    try:
-        msg = message.encode("utf-8")
-        print(f"[Sink] sending: {message}", file=sys.stderr)
-        sock.sendto(msg, (CLACO_UDP_ADDR, int(CLACO_UDP_PORT)))
-        print(f"[Sink] completed", file=sys.stderr)
-    except Exception as e:
-        error_message = f"failed to send message: {e}"
-        print(f"[Sink] {error_message}", file=sys.stderr)
-        traceback.print_exception(e, file=sys.stderr)
-
-        # 例外をログファイルに記録
-        log_directory = "logs"
-        os.makedirs(log_directory, exist_ok=True)
-        log_file_path = os.path.join(log_directory, "sink_error.log")
-
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-        with open(log_file_path, "a", encoding="utf-8") as log_file:
-            log_file.write(f"[{timestamp}] {error_message}\n")
-            log_file.write(f"Message content: {message}\n")
-            log_file.write(f"{traceback.format_exc()}\n")
-            log_file.write("-" * 50 + "\n")
-    finally:
-        sock.close()
+    msg = message.encode("utf-8")
+    with _sock_lock:
+        try:
+            _send_payload(msg, time.monotonic() + CLACO_SINK_SEND_TIMEOUT, message.strip() == CLACO_SINK_EXIT_TAG)
+        except Exception as e:
+            _log_error(f"failed to send message: {e}", message)
+            # 送れなかったことをモデルに伝える
+            raise RuntimeError(f"failed to send message to {CLACO_ENDPOINT}: {e}") from e
+
+
+@mcp.tool()
+def sink_many(messages: list[str]) -> None:
+    if CLACO_SINK_VERBOSE:
+        print(f"[Sink] sending to {CLACO_ENDPOINT}: {messages}", file=sys.stderr)
+
+    # 複数のメッセージをなるべく少ないデータグラムにまとめて送信
+    max_size = _MAX_FRAME_SIZE - FRAME_HEADER_SIZE if CLACO_SINK_FRAMING else _MAX_FRAME_SIZE
+    has_exit = any(message.strip() == CLACO_SINK_EXIT_TAG for message in messages)
+    with _sock_lock:
+        try:
+            deadline = time.monotonic() + CLACO_SINK_SEND_TIMEOUT
+            datagrams = pack_batch(messages, max_size)
+            for i, datagram in enumerate(datagrams):
+                _send_payload(datagram, deadline, has_exit and i == len(datagrams) - 1)
+        except Exception as e:
+            _log_error(f"failed to send messages: {e}", repr(messages))
+            raise RuntimeError(f"failed to send messages to {CLACO_ENDPOINT}: {e}") from e
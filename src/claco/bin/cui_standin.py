@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+ClaudeTools.Cui.exe の代わりに使うスタンドイン
+実際のウィンドウにはキー入力を送らず、受け取ったコマンドを記録して成功を返すだけ
+Windows 以外の環境で Sender の動作や送信のレイテンシを確認するために使う
+
+usage:
+    cui_standin.py TARGET [--window TITLE | --handle HANDLE] [--raw] MESSAGE | --paste-file PATH ...
+    cui_standin.py --resolve TARGET [--window TITLE]
+    cui_standin.py --serve
+
+--paste-file PATH は PATH のテキスト（UTF-8）を貼り付けるコマンドで、記録には貼り付けたテキストも含める
+--resolve はターゲットのウィンドウハンドルを `handle = XXXX` の形で出力する
+--handle で渡したハンドルが現在のハンドルと違う場合は "Window handle is invalid." で失敗する
+
+環境変数:
+    CLACO_STANDIN_LOG: 指定した場合、受け取ったコマンドを1行1 JSON で追記する
+    CLACO_STANDIN_MISSING: 指定したターゲットは見つからなかったものとして扱う
+    CLACO_STANDIN_HANDLE: ウィンドウハンドル（16進）。デフォルトは 1A2B3C
+"""
+
+import os
+import sys
+import json
+
+
+def run(args: list[str]) -> tuple[int, str, str]:
+    if not args:
+        return 2, "", "usage: cui_standin.py TARGET [--window TITLE | --handle HANDLE] [--raw] MESSAGE ...\n"
+
+    resolve = args[0] == "--resolve"
+    if resolve:
+        args = args[1:]
+        if not args:
+            return 2, "", "usage: cui_standin.py --resolve TARGET [--window TITLE]\n"
+
+    target = args[0]
+    handle = os.getenv("CLACO_STANDIN_HANDLE", "1A2B3C")
+
+    pasted = []
+    for i, arg in enumerate(args[:-1]):
+        if arg == "--paste-file":
+            try:
+                with open(args[i + 1], encoding="utf-8") as f:
+                    pasted.append(f.read())
+            except OSError as e:
+                return 2, "", f"failed to read paste file: {e}\n"
+
+    log_path = os.getenv("CLACO_STANDIN_LOG")
+    if log_path:
+        record = {"args": args}
+        if resolve:
+            record["resolve"] = True
+        if pasted:
+            record["pasted"] = pasted
+        with open(log_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    if target == os.getenv("CLACO_STANDIN_MISSING"):
+        return 1, f"Process '{target}' was not found.\n", ""
+
+    if resolve:
+        return 0, f"handle = {handle}\n", ""
+
+    if "--handle" in args[:-1] and args[args.index("--handle") + 1].upper() != handle.upper():
+        return 1, f"Window handle is invalid.\nhandle = {handle}\n", ""
+
+    return 0, "", ""
+
+
+def serve() -> None:
+    # 1行1 JSON のコマンドを読み、結果を1行1 JSON で返す
+    # stdin が閉じられたら終了する
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+
+    for line in stdin:
+        try:
+            request = json.loads(line)
+            returncode, out, err = run(request["args"])
+        except (ValueError, KeyError, TypeError) as e:
+            returncode, out, err = 2, "", f"invalid request: {e}\n"
+
+        response = {"returncode": returncode, "stdout": out, "stderr": err}
+        stdout.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+        stdout.flush()
+
+
+def main() -> int:
+    if sys.argv[1:] == ["--serve"]:
+        serve()
+        return 0
+
+    returncode, out, err = run(sys.argv[1:])
+    sys.stdout.write(out)
+    sys.stderr.write(err)
+    return returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
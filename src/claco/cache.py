@@ -0,0 +1,211 @@
+"""
+Communicator.communicate の返事をプロンプトごとにキャッシュする
+
+同じプロンプトを繰り返し送る自動化フローで、デスクトップアプリとの往復を省くために使う
+キーはターゲット、プロンプト、sink_prompt の組で、値は受け取った文のリスト
+メモリ上の LRU（有効期限付き）と、省略可能なディスク上の sqlite の2段で保持する
+"""
+
+import time
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheStats:
+    # メモリかディスクで見つかった回数
+    hits: int = 0
+    # そのうちディスクで見つかった回数
+    disk_hits: int = 0
+    # 見つからなかった回数（期限切れを含む）
+    misses: int = 0
+    # 最大数を超えたために捨てた数
+    evictions: int = 0
+    # 期限切れのために捨てた数
+    expirations: int = 0
+    # 保存した数
+    stores: int = 0
+
+    @property
+    def hit_rate(self) -> float | None:
+        total = self.hits + self.misses
+        if total == 0:
+            return None
+        return self.hits / total
+
+    def summary(self) -> dict[str, float | int | None]:
+        return {**asdict(self), "hit_rate": self.hit_rate}
+
+
+class ResponseCache:
+    """
+    返事の文のリストを保持するキャッシュ
+    複数のスレッドから使ってよい
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 256,
+        ttl: float | None = None,
+        path: str | None = None,
+        disk_maxsize: int | None = None,
+    ):
+        """
+        Args:
+            maxsize: メモリ上に保持する返事の最大数。超えた場合は最も長く使われていないものから捨てる
+            ttl: 保存してからの有効期限 [s]。None の場合は期限なし
+            path: ディスク上のキャッシュ（sqlite）のパス。None の場合はメモリ上のみ
+            disk_maxsize: ディスク上に保持する返事の最大数。None の場合は上限なし
+        """
+        if maxsize < 1:
+            raise ValueError(f"maxsize must be at least 1: {maxsize}")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.disk_maxsize = disk_maxsize
+        self.stats = CacheStats()
+        # key -> (保存した時刻 (time.time), 文のタプル)
+        self._entries: OrderedDict[str, tuple[float, tuple[str, ...]]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._open_db(path)
+
+    @staticmethod
+    def key(target: str, prompt: str, sink_prompt: str | None = None) -> str:
+        """
+        キャッシュのキーを作る
+
+        Args:
+            target: 送信先のアプリ
+            prompt: 送ったプロンプト
+            sink_prompt: プロンプトに付け加えた Sink の使い方の指示
+
+        Returns:
+            キー（16進文字列）
+        """
+        data = json.dumps([target, prompt, sink_prompt], ensure_ascii=False).encode("utf-8")
+        return hashlib.sha256(data).hexdigest()
+
+    def _open_db(self, path: str) -> None:
+        import sqlite3
+
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, created REAL NOT NULL, accessed REAL NOT NULL, sentences TEXT NOT NULL)"
+        )
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.ttl is not None and now - created > self.ttl
+
+    def get(self, key: str) -> tuple[str, ...] | None:
+        """
+        キャッシュされた返事を取り出す
+
+        Args:
+            key: ResponseCache.key で作ったキー
+
+        Returns:
+            文のタプル。見つからないか期限切れの場合は None
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, sentences = entry
+                if not self._expired(created, now):
+                    self._entries.move_to_end(key)
+                    self.stats.hits += 1
+                    return sentences
+                del self._entries[key]
+                self.stats.expirations += 1
+
+            if self._db is not None:
+                row = self._db.execute("SELECT created, sentences FROM responses WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    created, data = row
+                    if not self._expired(created, now):
+                        self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                        sentences = tuple(json.loads(data))
+                        # 次からはメモリ上で見つかるようにする
+                        self._store(key, created, sentences)
+                        self.stats.hits += 1
+                        self.stats.disk_hits += 1
+                        return sentences
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self.stats.expirations += 1
+
+            self.stats.misses += 1
+            return None
+
+    def put(self, key: str, sentences: list[str] | tuple[str, ...]) -> None:
+        """
+        返事を保存する
+
+        Args:
+            key: ResponseCache.key で作ったキー
+            sentences: 受け取った文のリスト
+        """
+        now = time.time()
+        sentences = tuple(sentences)
+        with self._lock:
+            self._store(key, now, sentences)
+            self.stats.stores += 1
+
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, created, accessed, sentences) VALUES (?, ?, ?, ?)",
+                    (key, now, now, json.dumps(sentences, ensure_ascii=False)),
+                )
+                if self.disk_maxsize is not None:
+                    cursor = self._db.execute(
+                        "DELETE FROM responses WHERE key NOT IN "
+                        "(SELECT key FROM responses ORDER BY accessed DESC LIMIT ?)",
+                        (self.disk_maxsize,),
+                    )
+                    self.stats.evictions += max(cursor.rowcount, 0)
+
+    def _store(self, key: str, created: float, sentences: tuple[str, ...]) -> None:
+        self._entries[key] = (created, sentences)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            evicted, _ = self._entries.popitem(last=False)
+            self.stats.evictions += 1
+            logger.debug(f"[{self.__class__.__name__}] evicted: {evicted}")
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def __len__(self) -> int:
+        # メモリ上に保持している返事の数
+        return len(self._entries)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
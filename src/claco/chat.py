@@ -1,28 +1,17 @@
-from claco.comm import create_communicator
-
-
 def main():
-    import os
+    # dotenv は import が遅いので、必要になった時に読み込む
+    # load_dotenv は設定済みの環境変数を上書きしないので、.env にしか無い設定だけが補われる
     from dotenv import load_dotenv
+    from claco.transport import endpoint_from_env
 
     load_dotenv()
-
-    CLACO_UDP_ADDR = os.getenv("CLACO_UDP_ADDR")
-    CLACO_UDP_PORT = os.getenv("CLACO_UDP_PORT")
-
-    if CLACO_UDP_ADDR is None:
-        raise ValueError("CLACO_UDP_ADDR is not set")
-
-    if CLACO_UDP_PORT is None:
-        raise ValueError("CLACO_UDP_PORT is not set")
+    endpoint = endpoint_from_env()
 
     TARGET = "Claude"
 
-    with create_communicator(
-        TARGET,
-        CLACO_UDP_ADDR,
-        int(CLACO_UDP_PORT),
-    ) as comm:
+    from claco.comm import create_communicator
+
+    with create_communicator(TARGET, endpoint=endpoint) as comm:
         while True:
             try:
                 print(">", end=" ", flush=True)
@@ -1,9 +1,17 @@
+import asyncio
+import time
+import threading
 import logging
+from contextlib import nullcontext
 from typing import Iterator, AsyncIterator
 
-from claco.queue import MessageQueue, AsyncMessageQueue
+from claco.queue import MessageQueue, AsyncMessageQueue, ReceiveTimeout, OverflowPolicy
 from claco.sender import Sender
-from claco.receiver import UDPReceiver
+from claco.receiver import UDPReceiver, AsyncUDPReceiver
+from claco.transport import Endpoint, udp_endpoint
+from claco.router import SessionRouter, SessionChannel, SessionKey
+from claco.stats import CallStats, LatencyRecorder
+from claco.cache import ResponseCache
 
 
 logger = logging.getLogger(__name__)
@@ -21,36 +29,100 @@ class RecvError(CommError):
     pass
 
 
+class RecvTimeout(RecvError):
+    # 返事の受信が期限切れになった
+    # ターゲットにはキャンセルを送り、その後に届いた残りのメッセージは捨てている
+
+    def __init__(self, timeout: float, idle: bool, received: int, cancelled: bool, drained: int):
+        kind = "no message" if idle else "response not completed"
+        super().__init__(f"{kind} within {timeout}s ({received=} {cancelled=} {drained=})")
+        # 超えた期限 [s]
+        self.timeout = timeout
+        # True の場合はメッセージ同士の間隔 (idle_timeout)、False の場合は全体の期限 (timeout)
+        self.idle = idle
+        # 期限切れまでに受け取ったメッセージの数
+        self.received = received
+        # キャンセルを送れたかどうか
+        self.cancelled = cancelled
+        # キャンセルの後に捨てたメッセージの数
+        self.drained = drained
+
+
 class _Sender:
     # ターゲットに送る側の処理を担当する
 
-    def __init__(self, target: str, sender: Sender):
+    def __init__(
+        self, target: str, sender: Sender, window_title: str | None = None, lock: "threading.Lock | None" = None
+    ):
         self.target = target
         self.sender = sender
+        self.window_title = window_title
+        # 複数のウィンドウへのキー入力を1つずつ行うためのロック
+        # キー入力はフォーカスのあるウィンドウに届くので、同時に送ると別のウィンドウの入力と混ざる
+        self.lock = lock
+
+    def _typing(self):
+        return self.lock if self.lock is not None else nullcontext()
 
     def send(self, message: str):
-        h, e = self.sender.send(self.target, message)
+        with self._typing():
+            h, e = self.sender.send(self.target, message, window_title=self.window_title)
         if not h:
             raise PostError(e)
 
     async def asend(self, message: str):
-        h, e = await self.sender.asend(self.target, message)
+        h, e = await self.sender.asend(self.target, message, window_title=self.window_title)
         if not h:
             raise PostError(e)
 
+    @property
+    def sink_prompt(self) -> str | None:
+        return getattr(self.sender, "sink_prompt", None)
+
     def clear(self):
         if hasattr(self.sender, "send_clear"):
-            self.sender.send_clear(self.target)
+            with self._typing():
+                self.sender.send_clear(self.target, window_title=self.window_title)
+
+    def reprime(self):
+        # セッションモードの ClaudeSender に、次の送信で Sink ツールの使い方の指示を送り直させる
+        if hasattr(self.sender, "reprime"):
+            self.sender.reprime(self.target, self.window_title)
+
+    def close(self):
+        self.sender.close()
 
     async def aclear(self):
         if hasattr(self.sender, "asend_clear"):
-            await self.sender.asend_clear(self.target)
+            await self.sender.asend_clear(self.target, window_title=self.window_title)
+
+    def cancel(self) -> bool:
+        # 生成中の返事を止める。送れなかった場合は False
+        if not hasattr(self.sender, "send_cancel"):
+            return False
+        try:
+            with self._typing():
+                h, e = self.sender.send_cancel(self.target, window_title=self.window_title)
+        except Exception as e:
+            logger.exception(f"[{self.__class__.__name__}] send_cancel raised exception")
+            return False
+        return bool(h)
+
+    async def acancel(self) -> bool:
+        if not hasattr(self.sender, "asend_cancel"):
+            return self.cancel()
+        try:
+            h, e = await self.sender.asend_cancel(self.target, window_title=self.window_title)
+        except Exception as e:
+            logger.exception(f"[{self.__class__.__name__}] asend_cancel raised exception")
+            return False
+        return bool(h)
 
 
 class _Receiver:
     # ターゲットから返事をもらう側の処理を担当する
 
-    def __init__(self, receiver: UDPReceiver, queue: MessageQueue):
+    def __init__(self, receiver: UDPReceiver | SessionChannel, queue: MessageQueue):
         self.receiver = receiver
         self.messages = queue
         self.receiver.register_callback(self._post)
@@ -65,13 +137,29 @@ class _Receiver:
     def __exit__(self, exc_type, exc_value, traceback):
         self.receiver.__exit__(exc_type, exc_value, traceback)
 
-    def receive(self) -> Iterator[str]:
+    def receive(
+        self, timeout: float | None = None, idle_timeout: float | None = None, deadline: float | None = None
+    ) -> Iterator[str]:
         try:
-            for message in self.messages.receive_all():
+            for message in self.messages.receive_all(timeout, idle_timeout, deadline=deadline):
                 yield message
+        except ReceiveTimeout:
+            raise
         except Exception as e:
             raise RecvError() from e
 
+    def drain(self, idle_timeout: float) -> int:
+        # 返事の終わりが届くか、idle_timeout の間何も届かなくなるまで残りのメッセージを捨てる
+        # 届き続ける場合も idle_timeout の 10 倍で打ち切る
+        n = 0
+        try:
+            for _ in self.messages.receive_all(timeout=idle_timeout * 10, idle_timeout=idle_timeout):
+                n += 1
+        except ReceiveTimeout:
+            pass
+        self.messages.clear()
+        return n
+
     def clear(self):
         self.messages.clear()
 
@@ -79,44 +167,162 @@ class _Receiver:
 class _AsyncReceiver:
     # ターゲットから返事をもらう側の処理を担当する
 
-    def __init__(self, receiver: UDPReceiver, queue: AsyncMessageQueue):
+    def __init__(self, receiver: UDPReceiver | AsyncUDPReceiver | SessionChannel, queue: AsyncMessageQueue):
         self.receiver = receiver
         self.messages = queue
         self.receiver.register_callback(self._post)
 
     def _post(self, message, address, timestamp):
-        # 今のところ UDPReceiver のコールバックが同期呼び出しを前提としているので
-        # ここも同期呼び出しにする
-        self.messages.post(message)
+        # AsyncUDPReceiver からはイベントループ上で、UDPReceiver からは受信スレッドで呼ばれる
+        # どちらの場合も post_threadsafe がイベントループ上のキューへ順番通りに積む
+        self.messages.post_threadsafe(message)
+
+    def _bind(self):
+        try:
+            self.messages.bind(asyncio.get_running_loop())
+        except RuntimeError:
+            # イベントループ外で with 文が使われた場合は receive 時に bind する
+            pass
 
     def __enter__(self):
+        self._bind()
         self.receiver.__enter__()
         return self
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.receiver.__exit__(exc_type, exc_value, traceback)
 
-    async def receive(self) -> AsyncIterator[str]:
+    async def __aenter__(self):
+        self._bind()
+        if hasattr(self.receiver, "__aenter__"):
+            await self.receiver.__aenter__()
+        else:
+            self.receiver.__enter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if hasattr(self.receiver, "__aexit__"):
+            await self.receiver.__aexit__(exc_type, exc_value, traceback)
+        else:
+            self.receiver.__exit__(exc_type, exc_value, traceback)
+
+    async def receive(
+        self, timeout: float | None = None, idle_timeout: float | None = None, deadline: float | None = None
+    ) -> AsyncIterator[str]:
+        self._bind()
         try:
-            async for message in self.messages.receive_all():
+            async for message in self.messages.receive_all(timeout, idle_timeout, deadline=deadline):
                 yield message
+        except ReceiveTimeout:
+            raise
         except Exception as e:
             raise RecvError() from e
 
+    async def drain(self, idle_timeout: float) -> int:
+        # _Receiver.drain の非同期版
+        self._bind()
+        n = 0
+        try:
+            async for _ in self.messages.receive_all(timeout=idle_timeout * 10, idle_timeout=idle_timeout):
+                n += 1
+        except ReceiveTimeout:
+            pass
+        self.messages.clear()
+        return n
+
     def clear(self):
         self.messages.clear()
 
 
+def _measure(messages: Iterator[str], call: CallStats, stats: LatencyRecorder) -> Iterator[str]:
+    # メッセージを受け取った時刻と、consumer が処理に使った時間を記録しながら中継する
+    try:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                message = next(messages)
+            except StopIteration:
+                call.exit = time.perf_counter()
+                return
+            t1 = time.perf_counter()
+            call.waits.append(t1 - t0)
+            call.messages.append(t1)
+            yield message
+            call.consumer.append(time.perf_counter() - t1)
+    finally:
+        stats.record(call)
+
+
+async def _ameasure(messages: AsyncIterator[str], call: CallStats, stats: LatencyRecorder) -> AsyncIterator[str]:
+    # _measure の非同期版
+    try:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                message = await anext(messages)
+            except StopAsyncIteration:
+                call.exit = time.perf_counter()
+                return
+            t1 = time.perf_counter()
+            call.waits.append(t1 - t0)
+            call.messages.append(t1)
+            yield message
+            call.consumer.append(time.perf_counter() - t1)
+    finally:
+        stats.record(call)
+
+
+def _record(messages: Iterator[str], cache: ResponseCache, key: str) -> Iterator[str]:
+    # メッセージを中継しながら集め、返事の終わりまで受け取れた場合だけキャッシュに保存する
+    sentences = []
+    for message in messages:
+        sentences.append(message)
+        yield message
+    cache.put(key, sentences)
+
+
+async def _arecord(messages: AsyncIterator[str], cache: ResponseCache, key: str) -> AsyncIterator[str]:
+    # _record の非同期版
+    # 非同期ジェネレータは途中で閉じられても中身が自動では閉じられないので、明示的に閉じる
+    sentences = []
+    try:
+        async for message in messages:
+            sentences.append(message)
+            yield message
+    finally:
+        await messages.aclose()
+    cache.put(key, sentences)
+
+
+async def _areplay(sentences: tuple[str, ...]) -> AsyncIterator[str]:
+    # キャッシュされた返事を receive と同じ形で返す
+    for sentence in sentences:
+        yield sentence
+
+
 class Communicator:
     def __init__(
         self,
         target: str,
         sender: Sender,
-        receiver: UDPReceiver,
+        receiver: UDPReceiver | SessionChannel,
         queue: MessageQueue,
+        window_title: str | None = None,
+        stats: LatencyRecorder | None = None,
+        cache: ResponseCache | None = None,
+        drain_timeout: float = 1.0,
+        send_lock: "threading.Lock | None" = None,
     ):
-        self.sender = _Sender(target, sender)
+        # send_lock を渡した場合は、同じロックを持つ Communicator 同士でキー入力を1つずつ行う
+        self.sender = _Sender(target, sender, window_title, send_lock)
         self.receiver = _Receiver(receiver, queue)
+        # 期限切れでキャンセルを送った後、残りのメッセージを捨てる時に待つメッセージ同士の間隔 [s]
+        self.drain_timeout = drain_timeout
+        # stats を渡した場合のみ、communicate の各段階にかかった時間を記録する
+        self.stats = stats
+        self.last_call: CallStats | None = None
+        # cache を渡した場合のみ、同じプロンプトへの返事を使い回す
+        self.cache = cache
 
     def __enter__(self):
         self.receiver.__enter__()
@@ -124,22 +330,85 @@ class Communicator:
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.receiver.__exit__(exc_type, exc_value, traceback)
+        self.sender.close()
 
     def send(self, message):
         logger.debug(f"[{self.__class__.__name__}] send: {message}")
         self.sender.send(message)
 
-    def receive(self):
+    def receive(self, timeout: float | None = None, idle_timeout: float | None = None) -> Iterator[str]:
+        """
+        返事を受け取る
+
+        Args:
+            timeout: 返事の終わりまでの期限 [s]
+            idle_timeout: メッセージ同士の間隔の上限 [s]
+
+        期限を超えた場合はターゲットにキャンセルを送り、残りのメッセージを捨ててから RecvTimeout
+        """
         logger.debug(f"[{self.__class__.__name__}] start receiving")
-        return self.receiver.receive()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        return self._receive(deadline, timeout, idle_timeout)
+
+    def _receive(self, deadline: float | None, timeout: float | None, idle_timeout: float | None) -> Iterator[str]:
+        received = 0
+        try:
+            # 期限切れの時に、残り時間ではなく指定した timeout を報告できるよう、期限の時刻を渡す
+            for message in self.receiver.receive(timeout, idle_timeout, deadline=deadline):
+                received += 1
+                yield message
+        except ReceiveTimeout as e:
+            logger.warning(f"[{self.__class__.__name__}] receive timed out: {e}; cancelling {self.sender.target}")
+            cancelled = self.sender.cancel()
+            drained = self.receiver.drain(self.drain_timeout)
+            raise RecvTimeout(e.timeout if e.idle else timeout, e.idle, received, cancelled, drained) from e
 
     def clear(self):
         self.sender.clear()
 
-    def communicate(self, message: str) -> Iterator[str]:
+    def reprime(self):
+        # 次の communicate で Sink ツールの使い方の指示を送り直す（セッションモードの ClaudeSender のみ）
+        self.sender.reprime()
+
+    def communicate(
+        self, message: str, timeout: float | None = None, idle_timeout: float | None = None
+    ) -> Iterator[str]:
+        """
+        メッセージを送って返事を受け取る
+
+        Args:
+            message: 送るメッセージ
+            timeout: 送信を始めてから返事の終わりまでの期限 [s]
+            idle_timeout: メッセージ同士の間隔の上限 [s]
+
+        期限を超えた場合はターゲットにキャンセルを送り、残りのメッセージを捨ててから RecvTimeout
+        """
         logger.debug(f"[{self.__class__.__name__}] communicate: {message}")
-        self.send(message)
-        return self.receive()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(self.sender.target, message, self.sender.sink_prompt)
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.debug(f"[{self.__class__.__name__}] cache hit: {len(cached)} messages")
+                return iter(cached)
+
+        if self.stats is None:
+            self.send(message)
+            messages = self._receive(deadline, timeout, idle_timeout)
+        else:
+            call = self.last_call = self.stats.begin()
+            try:
+                self.send(message)
+            except:
+                self.stats.record(call)
+                raise
+            call.send_end = time.perf_counter()
+            messages = _measure(self._receive(deadline, timeout, idle_timeout), call, self.stats)
+
+        if key is not None:
+            messages = _record(messages, self.cache, key)
+        return messages
 
 
 class AsyncCommunicator:
@@ -147,11 +416,22 @@ class AsyncCommunicator:
         self,
         target: str,
         sender: Sender,
-        receiver: UDPReceiver,
+        receiver: UDPReceiver | AsyncUDPReceiver | SessionChannel,
         queue: AsyncMessageQueue,
+        window_title: str | None = None,
+        stats: LatencyRecorder | None = None,
+        cache: ResponseCache | None = None,
+        drain_timeout: float = 1.0,
     ):
-        self.sender = _Sender(target, sender)
+        self.sender = _Sender(target, sender, window_title)
         self.receiver = _AsyncReceiver(receiver, queue)
+        # 期限切れでキャンセルを送った後、残りのメッセージを捨てる時に待つメッセージ同士の間隔 [s]
+        self.drain_timeout = drain_timeout
+        # stats を渡した場合のみ、communicate の各段階にかかった時間を記録する
+        self.stats = stats
+        self.last_call: CallStats | None = None
+        # cache を渡した場合のみ、同じプロンプトへの返事を使い回す
+        self.cache = cache
 
     def __enter__(self):
         self.receiver.__enter__()
@@ -159,35 +439,111 @@ class AsyncCommunicator:
 
     def __exit__(self, exc_type, exc_value, traceback):
         self.receiver.__exit__(exc_type, exc_value, traceback)
+        self.sender.close()
 
-    def send(self, message):
-        # 今のところ UDPReceiver のコールバックが同期呼び出しを前提としているので
-        # ここも同期呼び出しにする
+    async def __aenter__(self):
+        await self.receiver.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.receiver.__aexit__(exc_type, exc_value, traceback)
+        self.sender.close()
+
+    async def send(self, message):
+        # ヘルパーの実行中もイベントループを止めない
         logger.debug(f"[{self.__class__.__name__}] send: {message}")
-        self.sender.send(message)
+        await self.sender.asend(message)
 
-    def receive(self):
+    def receive(self, timeout: float | None = None, idle_timeout: float | None = None) -> AsyncIterator[str]:
+        # Communicator.receive の非同期版
         logger.debug(f"[{self.__class__.__name__}] start receiving")
-        return self.receiver.receive()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        return self._receive(deadline, timeout, idle_timeout)
+
+    async def _receive(
+        self, deadline: float | None, timeout: float | None, idle_timeout: float | None
+    ) -> AsyncIterator[str]:
+        received = 0
+        try:
+            async for message in self.receiver.receive(timeout, idle_timeout, deadline=deadline):
+                received += 1
+                yield message
+        except ReceiveTimeout as e:
+            logger.warning(f"[{self.__class__.__name__}] receive timed out: {e}; cancelling {self.sender.target}")
+            cancelled = await self.sender.acancel()
+            drained = await self.receiver.drain(self.drain_timeout)
+            raise RecvTimeout(e.timeout if e.idle else timeout, e.idle, received, cancelled, drained) from e
 
     async def clear(self):
-        self.sender.aclear()
+        await self.sender.aclear()
+
+    def reprime(self):
+        # Communicator.reprime と同じ
+        self.sender.reprime()
 
-    def communicate(self, message: str) -> AsyncIterator[str]:
+    def communicate(
+        self, message: str, timeout: float | None = None, idle_timeout: float | None = None
+    ) -> AsyncIterator[str]:
+        # Communicator.communicate の非同期版
         logger.debug(f"[{self.__class__.__name__}] communicate: {message}")
-        self.send(message)
-        return self.receive()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        key = None
+        if self.cache is not None:
+            key = self.cache.key(self.sender.target, message, self.sender.sink_prompt)
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.debug(f"[{self.__class__.__name__}] cache hit: {len(cached)} messages")
+                return _areplay(cached)
+
+        # 送信は非同期なので、返事の受け取りを始めた時に送る
+        messages = self._communicate(message, deadline, timeout, idle_timeout)
+        if key is not None:
+            messages = _arecord(messages, self.cache, key)
+        return messages
+
+    async def _communicate(
+        self, message: str, deadline: float | None, timeout: float | None, idle_timeout: float | None
+    ) -> AsyncIterator[str]:
+        if self.stats is None:
+            await self.send(message)
+            messages = self._receive(deadline, timeout, idle_timeout)
+        else:
+            call = self.last_call = self.stats.begin()
+            try:
+                await self.send(message)
+            except:
+                self.stats.record(call)
+                raise
+            call.send_end = time.perf_counter()
+            messages = _ameasure(self._receive(deadline, timeout, idle_timeout), call, self.stats)
+
+        try:
+            async for m in messages:
+                yield m
+        finally:
+            # 途中で受信をやめた場合も、stats の記録などの後始末をすぐに行う
+            await messages.aclose()
 
 
 def create_communicator(
     target: str,
-    udp_addr: str,
-    udp_port: int,
+    udp_addr: str | None = None,
+    udp_port: int | None = None,
     udp_bufsize: int = 4096,
+    udp_rcvbuf: int | None = None,
+    udp_drain: bool = False,
+    udp_workers: int = 0,
     queue_max_size: int = 8,
+    queue_overflow: OverflowPolicy = "unbounded",
     exe_path: str | None = None,
     sink_prompt: str | None = None,
+    persistent_sender: bool = False,
+    session_sender: bool = False,
+    stats: LatencyRecorder | None = None,
+    endpoint: Endpoint | None = None,
+    cache: ResponseCache | None = None,
 ) -> Communicator:
+    # endpoint を指定した場合は udp_addr と udp_port の代わりにそちらで受信する
     from claco.sender import ClaudeSender
     from claco.queue import ClaudeMessageQueue
 
@@ -196,22 +552,107 @@ def create_communicator(
         sender_args["exe_path"] = exe_path
     if sink_prompt is not None:
         sender_args["sink_prompt"] = sink_prompt
-    sender = ClaudeSender(**sender_args)
+    sender = ClaudeSender(persistent=persistent_sender, session=session_sender, **sender_args)
 
-    queue = ClaudeMessageQueue(maxsize=queue_max_size)
-    receiver = UDPReceiver(udp_addr, udp_port, buffer_size=udp_bufsize)
-    return Communicator(target, sender, receiver, queue)
+    queue = ClaudeMessageQueue(maxsize=queue_max_size, overflow=queue_overflow)
+    receiver = UDPReceiver(
+        endpoint or udp_endpoint(udp_addr, udp_port),
+        buffer_size=udp_bufsize,
+        rcvbuf=udp_rcvbuf,
+        drain=udp_drain,
+        workers=udp_workers,
+    )
+    return Communicator(target, sender, receiver, queue, stats=stats, cache=cache)
 
 
 def create_async_communicator(
     target: str,
-    udp_addr: str,
-    udp_port: int,
+    udp_addr: str | None = None,
+    udp_port: int | None = None,
     udp_bufsize: int = 4096,
+    udp_rcvbuf: int | None = None,
+    queue_max_size: int = 8,
+    queue_overflow: OverflowPolicy = "unbounded",
+    exe_path: str | None = None,
+    sink_prompt: str | None = None,
+    persistent_sender: bool = False,
+    session_sender: bool = False,
+    stats: LatencyRecorder | None = None,
+    endpoint: Endpoint | None = None,
+    cache: ResponseCache | None = None,
+    sender_timeout: float | None = None,
+    sender_max_concurrency: int = 4,
+    sender_parallel_windows: bool = False,
+) -> AsyncCommunicator:
+    # endpoint を指定した場合は udp_addr と udp_port の代わりにそちらで受信する
+    # sender_timeout と sender_max_concurrency はヘルパー実行の期限と同時実行数
+    # sender_parallel_windows は別のウィンドウへの送信を並行させるかどうか（ClaudeSender を参照）
+    from claco.sender import ClaudeSender
+    from claco.queue import AsyncClaudeMessageQueue
+
+    sender_args = {}
+    if exe_path is not None:
+        sender_args["exe_path"] = exe_path
+    if sink_prompt is not None:
+        sender_args["sink_prompt"] = sink_prompt
+    sender = ClaudeSender(
+        persistent=persistent_sender,
+        session=session_sender,
+        timeout=sender_timeout,
+        max_concurrency=sender_max_concurrency,
+        parallel_windows=sender_parallel_windows,
+        **sender_args,
+    )
+
+    queue = AsyncClaudeMessageQueue(maxsize=queue_max_size, overflow=queue_overflow)
+    receiver = AsyncUDPReceiver(
+        endpoint or udp_endpoint(udp_addr, udp_port),
+        buffer_size=udp_bufsize,
+        rcvbuf=udp_rcvbuf,
+    )
+    return AsyncCommunicator(target, sender, receiver, queue, stats=stats, cache=cache)
+
+
+def create_routed_communicator(
+    target: str,
+    router: SessionRouter,
+    session: SessionKey,
+    queue_max_size: int = 8,
+    queue_overflow: OverflowPolicy = "unbounded",
+    exe_path: str | None = None,
+    sink_prompt: str | None = None,
+    persistent_sender: bool = False,
+    session_sender: bool = False,
+    window_title: str | None = None,
+) -> Communicator:
+    # router のレシーバーを共有し、session 宛てのメッセージだけを受け取る Communicator を作る
+    from claco.sender import ClaudeSender
+    from claco.queue import ClaudeMessageQueue
+
+    sender_args = {}
+    if exe_path is not None:
+        sender_args["exe_path"] = exe_path
+    if sink_prompt is not None:
+        sender_args["sink_prompt"] = sink_prompt
+    sender = ClaudeSender(persistent=persistent_sender, session=session_sender, **sender_args)
+
+    queue = ClaudeMessageQueue(maxsize=queue_max_size, overflow=queue_overflow)
+    return Communicator(target, sender, router.channel(session), queue, window_title)
+
+
+def create_routed_async_communicator(
+    target: str,
+    router: SessionRouter,
+    session: SessionKey,
     queue_max_size: int = 8,
+    queue_overflow: OverflowPolicy = "unbounded",
     exe_path: str | None = None,
     sink_prompt: str | None = None,
+    persistent_sender: bool = False,
+    session_sender: bool = False,
+    window_title: str | None = None,
 ) -> AsyncCommunicator:
+    # router のレシーバーを共有し、session 宛てのメッセージだけを受け取る AsyncCommunicator を作る
     from claco.sender import ClaudeSender
     from claco.queue import AsyncClaudeMessageQueue
 
@@ -220,8 +661,7 @@ def create_async_communicator(
         sender_args["exe_path"] = exe_path
     if sink_prompt is not None:
         sender_args["sink_prompt"] = sink_prompt
-    sender = ClaudeSender(**sender_args)
+    sender = ClaudeSender(persistent=persistent_sender, session=session_sender, **sender_args)
 
-    queue = AsyncClaudeMessageQueue(maxsize=queue_max_size)
-    receiver = UDPReceiver(udp_addr, udp_port, buffer_size=udp_bufsize)
-    return AsyncCommunicator(target, sender, receiver, queue)
+    queue = AsyncClaudeMessageQueue(maxsize=queue_max_size, overflow=queue_overflow)
+    return AsyncCommunicator(target, sender, router.channel(session), queue, window_title)
@@ -0,0 +1,273 @@
+"""
+複数のターゲットウィンドウにプロンプトを振り分けて、並列に処理するプール
+"""
+
+import queue
+import time
+import asyncio
+import threading
+import logging
+from concurrent.futures import Future
+from contextlib import ExitStack
+from typing import Iterable, Iterator, AsyncIterator
+
+from claco.comm import Communicator, RecvError, create_routed_communicator
+from claco.queue import OverflowPolicy
+from claco.router import SessionRouter, SessionKey
+
+
+logger = logging.getLogger(__name__)
+
+
+class CommunicatorPool:
+    """
+    ウィンドウごとの Communicator を束ね、キューに積まれたプロンプトを空いているウィンドウに送る
+    ウィンドウは <exit> を受け取るまで使用中として扱う
+    キー入力はフォーカスのあるウィンドウに届くので、送信は1つずつ行い、返事の受信だけを並列に行う
+
+    各 Communicator は別々のウィンドウと、別々の Sink のセッションを使うこと
+    """
+
+    def __init__(
+        self,
+        communicators: list[Communicator],
+        timeout: float | None = None,
+        idle_timeout: float | None = None,
+    ):
+        """
+        Args:
+            communicators: ウィンドウごとの Communicator
+            timeout: 1つのプロンプトの返事の終わりまでの期限 [s]
+            idle_timeout: メッセージ同士の間隔の上限 [s]
+
+        期限を超えたプロンプトはキャンセルしてウィンドウを空け、その Future は RecvTimeout で終わる
+        """
+        self.communicators = communicators
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self._jobs: queue.Queue[tuple[str, Future] | None] = queue.Queue()
+        self._workers: list[threading.Thread] = []
+        self._stack: ExitStack | None = None
+        self._busy: set[int] = set()
+        self._lock = threading.Lock()
+        # すべての Communicator で共有する送信用のロック
+        self._send_lock = threading.Lock()
+        # abort されたか stop の期限を超えて、受信を打ち切っている
+        self._aborting = False
+        for comm in communicators:
+            comm.sender.lock = self._send_lock
+
+    @property
+    def busy(self) -> list[Communicator]:
+        # 返事を待っている Communicator
+        with self._lock:
+            return [self.communicators[i] for i in sorted(self._busy)]
+
+    @property
+    def idle(self) -> list[Communicator]:
+        # 空いている Communicator
+        with self._lock:
+            return [c for i, c in enumerate(self.communicators) if i not in self._busy]
+
+    def _work(self, index: int, comm: Communicator):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+
+            message, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            with self._lock:
+                self._busy.add(index)
+            logger.debug(f"[{self.__class__.__name__}] worker {index}: {message=}")
+
+            try:
+                result = list(comm.communicate(message, self.timeout, self.idle_timeout))
+                if self._aborting:
+                    # 受信キューを閉じたので、返事の途中で終わっている
+                    raise RecvError(f"pool stopped before the response completed ({len(result)} messages received)")
+                future.set_result(result)
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                with self._lock:
+                    self._busy.discard(index)
+
+    def submit(self, message: str) -> Future[list[str]]:
+        """
+        プロンプトをキューに積む
+
+        Args:
+            message: 送信するプロンプト
+
+        Returns:
+            返事の文のリストを結果とする Future
+        """
+        if self._stack is None:
+            raise RuntimeError("pool is not started")
+
+        future: Future[list[str]] = Future()
+        self._jobs.put((message, future))
+        return future
+
+    def map(self, messages: Iterable[str]) -> Iterator[list[str]]:
+        # すべてのプロンプトをキューに積み、返事をプロンプトの順番で返す
+        futures = [self.submit(message) for message in messages]
+        for future in futures:
+            yield future.result()
+
+    async def asubmit(self, message: str) -> list[str]:
+        return await asyncio.wrap_future(self.submit(message))
+
+    async def amap(self, messages: Iterable[str]) -> AsyncIterator[list[str]]:
+        # すべてのプロンプトをキューに積み、返事をプロンプトの順番で返す
+        futures = [asyncio.wrap_future(self.submit(message)) for message in messages]
+        for future in futures:
+            yield await future
+
+    async def as_completed(self, messages: Iterable[str]) -> AsyncIterator[tuple[str, list[str]]]:
+        # すべてのプロンプトをキューに積み、返事が届いた順に (プロンプト, 返事) を返す
+        async def run(message: str):
+            return message, await self.asubmit(message)
+
+        for task in asyncio.as_completed([run(message) for message in messages]):
+            yield await task
+
+    def start(self):
+        if self._stack is not None:
+            logger.warning(f"[{self.__class__.__name__}] `start` called, but already running. ignoring...")
+            return
+        if self._aborting:
+            # 閉じた受信キューは再び使えない
+            raise RuntimeError("pool was aborted and cannot be restarted")
+
+        with ExitStack() as stack:
+            for comm in self.communicators:
+                stack.enter_context(comm)
+            self._stack = stack.pop_all()
+
+        for i, comm in enumerate(self.communicators):
+            worker = threading.Thread(target=self._work, args=(i, comm), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self, timeout: float | None = None):
+        """
+        キューに積まれたプロンプトを処理し終えてから停止する
+
+        Args:
+            timeout: 処理し終えるまで待つ最大時間 [s]。None の場合は、すべての返事が届くまで待つ
+                超えた場合は abort と同じように、まだ送っていないプロンプトをキャンセルし、
+                返事を待っている Communicator の受信を打ち切って（その Future は RecvError で終わる）停止する
+        """
+        if self._stack is None:
+            logger.warning(f"[{self.__class__.__name__}] `stop` called, but not running. ignoring...")
+            return
+
+        for _ in self._workers:
+            self._jobs.put(None)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(None if deadline is None else max(deadline - time.monotonic(), 0.0))
+
+        if any(worker.is_alive() for worker in self._workers):
+            logger.warning(f"[{self.__class__.__name__}] workers did not finish in {timeout}s; aborting")
+            self._abort()
+        self._close()
+
+    def abort(self):
+        """
+        処理し終えるのを待たずに停止する
+        まだ送っていないプロンプトはキャンセルし、返事を待っている Communicator の受信は打ち切る（その Future は RecvError で終わる）
+        """
+        if self._stack is None:
+            logger.warning(f"[{self.__class__.__name__}] `abort` called, but not running. ignoring...")
+            return
+
+        self._abort()
+        self._close()
+
+    def _close(self):
+        self._workers.clear()
+        self._stack.close()
+        self._stack = None
+
+    def _abort(self):
+        # まだ送っていないプロンプトをキャンセルし、返事を待っているワーカーを起こす
+        self._aborting = True
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None:
+                job[1].cancel()
+        # ワーカーに終了の合図を積む（stop から呼ばれた場合は、取り出してしまった分を積み直す）
+        for _ in self._workers:
+            self._jobs.put(None)
+        for comm in self.communicators:
+            comm.receiver.messages.close()
+        for worker in self._workers:
+            # 送信中のヘルパーは止められないので、ここでは少しだけ待つ
+            worker.join(1.0)
+            if worker.is_alive():
+                logger.warning(f"[{self.__class__.__name__}] worker {worker.name} is still running")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+def create_communicator_pool(
+    target: str,
+    router: SessionRouter,
+    windows: dict[str, SessionKey],
+    queue_max_size: int = 8,
+    queue_overflow: OverflowPolicy = "unbounded",
+    exe_path: str | None = None,
+    sink_prompt: str | None = None,
+    persistent_sender: bool = False,
+    session_sender: bool = False,
+    timeout: float | None = None,
+    idle_timeout: float | None = None,
+) -> CommunicatorPool:
+    """
+    ウィンドウごとに Communicator を作り、プールにまとめる
+
+    Args:
+        target: ターゲットのプロセス名
+        router: 受信に使う SessionRouter
+        windows: ウィンドウタイトルと、そのウィンドウの Sink のセッションIDの対応
+        queue_max_size: Communicator ごとの受信キューの大きさ
+        queue_overflow: 受信キューが一杯の時の扱い
+        exe_path: ヘルパーのパス
+        sink_prompt: Sink ツールの使い方を指示するプロンプト
+        persistent_sender: ヘルパーを常駐させるかどうか
+        session_sender: True の場合、Sink ツールの使い方の指示をウィンドウごとに最初の送信にだけ付け加える
+        timeout: 1つのプロンプトの返事の終わりまでの期限 [s]
+        idle_timeout: メッセージ同士の間隔の上限 [s]
+
+    Returns:
+        CommunicatorPool
+    """
+    communicators = [
+        create_routed_communicator(
+            target,
+            router,
+            session,
+            queue_max_size=queue_max_size,
+            queue_overflow=queue_overflow,
+            exe_path=exe_path,
+            sink_prompt=sink_prompt,
+            persistent_sender=persistent_sender,
+            session_sender=session_sender,
+            window_title=window_title,
+        )
+        for window_title, session in windows.items()
+    ]
+    return CommunicatorPool(communicators, timeout, idle_timeout)
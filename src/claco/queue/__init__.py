@@ -1,2 +1,2 @@
-from .base import MessageQueue, AsyncMessageQueue
+from .base import MessageQueue, AsyncMessageQueue, QueueClosed, ReceiveTimeout, OverflowPolicy
 from .claude import ClaudeMessageQueue, AsyncClaudeMessageQueue
@@ -1,92 +1,442 @@
 import queue
-from asyncio import queues as aqueue, sleep as asleep
+import asyncio
+from asyncio import queues as aqueue
+from collections import deque
+import struct
 import time
+import threading
 import logging
-from typing import Iterator, AsyncIterator
+from typing import Iterator, AsyncIterator, Literal, get_args
 
 
 logger = logging.getLogger(__name__)
 
 
+# キューが一杯の時に post されたメッセージの扱い
+#   block: 空きができるまで待つ（タイムアウトしたら捨てて queue.Full）
+#   drop_oldest: 一番古いメッセージを捨てて積む
+#   drop_newest: 新しいメッセージを捨てる
+#   unbounded: maxsize を無視して積む
+#   spill: あふれた分を一時ファイルに書き出し、空きができ次第順番に戻す
+OverflowPolicy = Literal["block", "drop_oldest", "drop_newest", "unbounded", "spill"]
+
+
+def _check_overflow(overflow: str) -> None:
+    if overflow not in get_args(OverflowPolicy):
+        raise ValueError(f"unknown overflow policy: {overflow!r}")
+
+
+class QueueClosed(Exception):
+    pass
+
+
+class ReceiveTimeout(TimeoutError):
+    # receive_all で、全体の期限 (timeout) か、メッセージ同士の間隔の上限 (idle_timeout) を超えた
+
+    def __init__(self, timeout: float, idle: bool):
+        super().__init__(f"{'idle' if idle else 'total'} timeout expired: {timeout}s")
+        self.timeout = timeout
+        self.idle = idle
+
+
+def _start_deadline(timeout: float | None, deadline: float | None) -> tuple[float | None, float | None]:
+    # receive_all の (deadline, ReceiveTimeout に入れる全体の期限 [s])
+    # deadline だけを渡された場合は、受け取り始めた時点の残り時間を全体の期限として報告する
+    if deadline is None:
+        return (None if timeout is None else time.monotonic() + timeout), timeout
+    if timeout is None:
+        timeout = round(max(deadline - time.monotonic(), 0.0), 3)
+    return deadline, timeout
+
+
+def _wait_time(deadline: float | None, idle_timeout: float | None) -> tuple[float | None, bool]:
+    # 次のメッセージを待つ時間と、それが idle_timeout で決まったかどうか
+    if deadline is None:
+        return idle_timeout, True
+    remaining = max(deadline - time.monotonic(), 0.0)
+    if idle_timeout is not None and idle_timeout < remaining:
+        return idle_timeout, True
+    return remaining, False
+
+
+class _SpillFile:
+    # あふれたメッセージを一時ファイルに書き出し、書いた順に読み出す
+    # deque と同じように append/popleft/len/clear で使う
+
+    _LENGTH = struct.Struct("!I")
+
+    def __init__(self, dir: str | None = None):
+        self.dir = dir
+        self._file = None
+        self._read_pos = 0
+        self._write_pos = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, message: str) -> None:
+        if self._file is None:
+            import tempfile
+
+            self._file = tempfile.TemporaryFile(dir=self.dir)
+        data = message.encode("utf-8")
+        self._file.seek(self._write_pos)
+        self._file.write(self._LENGTH.pack(len(data)))
+        self._file.write(data)
+        self._write_pos += self._LENGTH.size + len(data)
+        self._count += 1
+
+    def popleft(self) -> str:
+        if self._count == 0:
+            raise IndexError("pop from an empty spill file")
+        self._file.seek(self._read_pos)
+        (n,) = self._LENGTH.unpack(self._file.read(self._LENGTH.size))
+        message = self._file.read(n).decode("utf-8")
+        self._read_pos += self._LENGTH.size + n
+        self._count -= 1
+        if self._count == 0:
+            self.clear()
+        return message
+
+    def clear(self) -> None:
+        # 読み切ったらファイルを切り詰めて使い回す
+        if self._file is not None:
+            self._file.truncate(0)
+        self._read_pos = 0
+        self._write_pos = 0
+        self._count = 0
+
+
 class MessageQueue:
-    def __init__(self, maxsize=1):
-        self._q = queue.Queue(maxsize=maxsize)
+    def __init__(
+        self,
+        maxsize=1,
+        overflow: OverflowPolicy = "block",
+        block_timeout: float | None = None,
+        spill_dir: str | None = None,
+    ):
+        """
+        Args:
+            maxsize: キューに保持するメッセージの最大数。0 以下の場合は無制限
+            overflow: キューが一杯の時の扱い（OverflowPolicy）
+            block_timeout: overflow="block" で post が待つ時間のデフォルト値。None の場合は無制限に待つ
+            spill_dir: overflow="spill" で一時ファイルを作るディレクトリ
+        """
+        _check_overflow(overflow)
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.block_timeout = block_timeout
+        self._limit = 0 if overflow == "unbounded" else maxsize
+        self._q: deque[str] = deque()
+        self._spill = _SpillFile(spill_dir)
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._not_full = threading.Condition(self._mutex)
         self._closed = False
+        # 捨てたメッセージの数
+        self.dropped = 0
+        # 空きを待ったメッセージの数
+        self.blocked = 0
+        # 一時ファイルに書き出したメッセージの数
+        self.spilled = 0
+
+    def _full(self) -> bool:
+        return 0 < self._limit <= len(self._q)
 
-    def post(self, message: str) -> None:
+    def _is_control(self, message: str) -> bool:
+        # True を返したメッセージは drop_newest でも捨てず、代わりに一番古いメッセージを捨てる
+        return False
+
+    def post(self, message: str, timeout: float | None = None) -> None:
         logger.debug(f"[{self.__class__.__name__}] post: {message=}")
-        self._q.put(message)
 
-    def receive(self) -> str:
-        while True:
-            try:
-                message = self._q.get_nowait()
-                logger.debug(f"[{self.__class__.__name__}] receive: {message=}")
-                return message
-            except queue.Empty:
-                time.sleep(0.05)
+        with self._not_full:
+            if self._closed:
+                raise QueueClosed()
+
+            if self.overflow == "spill" and (self._spill or self._full()):
+                # 順番を保つため、書き出したメッセージが残っている間は後続もすべて書き出す
+                self._spill.append(message)
+                self.spilled += 1
+            elif not self._full():
+                self._q.append(message)
+            elif self.overflow == "block":
+                self.blocked += 1
+                if timeout is None:
+                    timeout = self.block_timeout
+                if not self._not_full.wait_for(lambda: self._closed or not self._full(), timeout):
+                    self.dropped += 1
+                    raise queue.Full()
+                if self._closed:
+                    raise QueueClosed()
+                self._q.append(message)
+            elif self.overflow == "drop_oldest" or self._is_control(message):
+                dropped = self._q.popleft()
+                self._q.append(message)
+                self.dropped += 1
+                logger.debug(f"[{self.__class__.__name__}] queue is full; dropped: {dropped=}")
+            else:
+                self.dropped += 1
+                logger.debug(f"[{self.__class__.__name__}] queue is full; dropped: {message=}")
+                return
+
+            self._not_empty.notify()
+
+    def _pop(self) -> str:
+        # _mutex を取った状態で呼ぶこと
+        message = self._q.popleft()
+        if self._spill:
+            self._q.append(self._spill.popleft())
+        self._not_full.notify()
+        return message
+
+    def receive(self, timeout: float | None = None) -> str:
+        # メッセージが届くか、タイムアウトするか、close されるまでブロックする
+        # close 後もキューに残っているメッセージは受け取れる
+        with self._not_empty:
+            if not self._not_empty.wait_for(lambda: self._closed or self._q, timeout):
+                raise queue.Empty()
+            if not self._q:
+                raise QueueClosed()
+            message = self._pop()
+
+        logger.debug(f"[{self.__class__.__name__}] receive: {message=}")
+        return message
 
     def try_receive(self) -> str | None:
-        try:
-            message = self._q.get_nowait()
-            logger.debug(f"[{self.__class__.__name__}] try_receive: {message=}")
-            return message
-        except queue.Empty:
-            return None
+        with self._mutex:
+            if not self._q:
+                return None
+            message = self._pop()
+
+        logger.debug(f"[{self.__class__.__name__}] try_receive: {message=}")
+        return message
+
+    def receive_all(
+        self, timeout: float | None = None, idle_timeout: float | None = None, deadline: float | None = None
+    ) -> Iterator[str]:
+        """
+        close されるまでメッセージを順に返す
 
-    def receive_all(self) -> Iterator[str]:
+        Args:
+            timeout: 全体の期限 [s]。超えた場合は ReceiveTimeout
+            idle_timeout: メッセージ同士の間隔の上限 [s]。超えた場合は ReceiveTimeout
+            deadline: 全体の期限の時刻（time.monotonic）。途中から受け取る場合に、最初に決めた期限を引き継ぐ
+                timeout は ReceiveTimeout に入れる値としてだけ使う（省略した場合は受け取り始めた時点の残り時間）
+        """
         logger.debug(f"[{self.__class__.__name__}] start receive_all")
 
+        deadline, timeout = _start_deadline(timeout, deadline)
         while True:
-            msg = self.receive()
+            wait, idle = _wait_time(deadline, idle_timeout)
+            try:
+                msg = self.receive(wait)
+            except QueueClosed:
+                return
+            except queue.Empty:
+                raise ReceiveTimeout(idle_timeout if idle else timeout, idle) from None
             yield msg
 
+    def close(self):
+        # ブロック中の post/receive をすべて起こす
+        logger.debug(f"[{self.__class__.__name__}] close")
+
+        with self._mutex:
+            self._closed = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
     def clear(self):
         logger.debug(f"[{self.__class__.__name__}] clear")
 
-        try:
-            self._q.queue.clear()
-        except:
-            logger.exception("Queue.queue.clear")
+        with self._mutex:
+            self._q.clear()
+            self._spill.clear()
+            self._not_full.notify_all()
 
 
 class AsyncMessageQueue:
-    def __init__(self, maxsize=1):
-        self._q = aqueue.Queue(maxsize)
+    def __init__(self, maxsize=1, overflow: OverflowPolicy = "block", spill_dir: str | None = None):
+        """
+        Args:
+            maxsize: キューに保持するメッセージの最大数。0 以下の場合は無制限
+            overflow: キューが一杯の時の扱い（OverflowPolicy）
+                block の場合、post は空きができるまで待ち、post_nowait はメモリ上の backlog に積む
+            spill_dir: overflow="spill" で一時ファイルを作るディレクトリ
+        """
+        _check_overflow(overflow)
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self._q = aqueue.Queue(0 if overflow == "unbounded" else maxsize)
         self._closed = False
+        # キューが一杯のときに post_nowait されたメッセージを順番に保持する
+        # spill の場合は一時ファイルに保持する
+        self._backlog: deque[str] | _SpillFile = _SpillFile(spill_dir) if overflow == "spill" else deque()
+        # 捨てたメッセージの数
+        self.dropped = 0
+        # 空きを待ったメッセージの数
+        self.blocked = 0
+        # 一時ファイルに書き出したメッセージの数
+        self.spilled = 0
+        self._drainer: asyncio.Task | None = None
+        # 別スレッドから post_threadsafe されたメッセージの受け口
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._inbox: deque[str] = deque()
+        self._inbox_lock = threading.Lock()
+        self._wakeup_scheduled = False
+
+    def _is_control(self, message: str) -> bool:
+        # True を返したメッセージは drop_newest でも捨てず、代わりに一番古いメッセージを捨てる
+        return False
 
     async def post(self, message: str) -> None:
+        if self.overflow != "block":
+            # block 以外では待たない
+            self.post_nowait(message)
+            return
+
         logger.debug(f"[{self.__class__.__name__}] post: {message=}")
+        if self._q.full():
+            self.blocked += 1
         await self._q.put(message)
 
-    async def receive(self) -> str:
-        while True:
-            try:
+    def post_nowait(self, message: str) -> None:
+        # イベントループのスレッドから呼ぶこと
+        # キューが一杯の場合は overflow に従って捨てるか、backlog に積んでおき空きができ次第順番に流し込む
+        logger.debug(f"[{self.__class__.__name__}] post_nowait: {message=}")
+
+        draining = self._drainer is not None and not self._drainer.done()
+        if not draining and not self._q.full():
+            self._q.put_nowait(message)
+            return
+
+        if self.overflow == "drop_newest" and not self._is_control(message):
+            self.dropped += 1
+            logger.debug(f"[{self.__class__.__name__}] queue is full; dropped: {message=}")
+            return
+        if self.overflow in ("drop_oldest", "drop_newest"):
+            dropped = self._q.get_nowait()
+            self._q.put_nowait(message)
+            self.dropped += 1
+            logger.debug(f"[{self.__class__.__name__}] queue is full; dropped: {dropped=}")
+            return
+
+        self._backlog.append(message)
+        if self.overflow == "spill":
+            self.spilled += 1
+        else:
+            self.blocked += 1
+        if not draining:
+            self._drainer = asyncio.get_running_loop().create_task(self._drain_backlog())
+
+    async def _drain_backlog(self) -> None:
+        while self._backlog:
+            message = self._backlog.popleft()
+            await self._q.put(message)
+
+    def bind(self, loop: asyncio.AbstractEventLoop) -> None:
+        # post_threadsafe の配送先となるイベントループを設定する
+        # bind 前に届いていたメッセージもここで流し込む
+        with self._inbox_lock:
+            self._loop = loop
+            if not self._inbox or self._wakeup_scheduled:
+                return
+            self._wakeup_scheduled = True
+        loop.call_soon_threadsafe(self._flush_inbox)
+
+    def post_threadsafe(self, message: str) -> None:
+        # 任意のスレッドから呼べる post
+        # 連続して届いたメッセージは、イベントループの1回の起床でまとめて流し込む
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        if running is not None and running is self._loop:
+            self.post_nowait(message)
+            return
+
+        with self._inbox_lock:
+            self._inbox.append(message)
+            if self._loop is None or self._wakeup_scheduled:
+                return
+            self._wakeup_scheduled = True
+            loop = self._loop
+
+        try:
+            loop.call_soon_threadsafe(self._flush_inbox)
+        except RuntimeError:
+            # イベントループが既に閉じている
+            logger.warning(f"[{self.__class__.__name__}] event loop is closed; message dropped: {message=}")
+
+    def _flush_inbox(self) -> None:
+        with self._inbox_lock:
+            messages = self._inbox
+            self._inbox = deque()
+            self._wakeup_scheduled = False
+
+        for message in messages:
+            self.post_nowait(message)
+
+    async def receive(self, timeout: float | None = None) -> str:
+        # タイムアウトした場合は TimeoutError
+        if timeout is None:
+            message = await self._q.get()
+        else:
+            async with asyncio.timeout(timeout):
                 message = await self._q.get()
-                logger.debug(f"[{self.__class__.__name__}] receive: {message=}")
-                return message
-            except aqueue.QueueEmpty:
-                await asleep(0.05)
+        logger.debug(f"[{self.__class__.__name__}] receive: {message=}")
+        return message
 
     async def try_receive(self) -> str | None:
         try:
-            message = await self._q.get_nowait()
+            message = self._q.get_nowait()
             logger.debug(f"[{self.__class__.__name__}] try_receive: {message=}")
             return message
         except aqueue.QueueEmpty:
             return None
 
-    async def receive_all(self) -> AsyncIterator[str]:
+    async def receive_all(
+        self, timeout: float | None = None, idle_timeout: float | None = None, deadline: float | None = None
+    ) -> AsyncIterator[str]:
+        """
+        メッセージを順に返す
+
+        Args:
+            timeout: 全体の期限 [s]。超えた場合は ReceiveTimeout
+            idle_timeout: メッセージ同士の間隔の上限 [s]。超えた場合は ReceiveTimeout
+            deadline: 全体の期限の時刻（time.monotonic）。途中から受け取る場合に、最初に決めた期限を引き継ぐ
+                timeout は ReceiveTimeout に入れる値としてだけ使う（省略した場合は受け取り始めた時点の残り時間）
+        """
         logger.debug(f"[{self.__class__.__name__}] start receive_all")
 
+        deadline, timeout = _start_deadline(timeout, deadline)
         while True:
-            msg = await self.receive()
+            wait, idle = _wait_time(deadline, idle_timeout)
+            try:
+                msg = await self.receive(wait)
+            except TimeoutError:
+                raise ReceiveTimeout(idle_timeout if idle else timeout, idle) from None
             yield msg
 
     def clear(self):
         logger.debug(f"[{self.__class__.__name__}] clear")
 
-        try:
-            self._q.queue.clear()
-        except:
-            logger.exception("Queue.queue.clear")
+        with self._inbox_lock:
+            self._inbox.clear()
+        self._backlog.clear()
+        if self._drainer is not None:
+            self._drainer.cancel()
+            self._drainer = None
+        # 内部の _queue を直接消すと、一杯の時に put で待っているタスクが起こされないので、1つずつ取り出す
+        while True:
+            try:
+                self._q.get_nowait()
+            except aqueue.QueueEmpty:
+                break
+            self._q.task_done()
@@ -1,39 +1,105 @@
+import queue
 import logging
 from typing import override
 
-from .base import MessageQueue, AsyncMessageQueue
+from .base import (
+    MessageQueue,
+    AsyncMessageQueue,
+    QueueClosed,
+    ReceiveTimeout,
+    OverflowPolicy,
+    _wait_time,
+    _start_deadline,
+)
+from claco.wire import unpack_batch
 
 
 logger = logging.getLogger(__name__)
 
 
 class ClaudeMessageQueue(MessageQueue):
-    def __init__(self, maxsize=1, exit_tag="<exit>"):
-        super().__init__(maxsize)
+    def __init__(
+        self,
+        maxsize=1,
+        exit_tag="<exit>",
+        overflow: OverflowPolicy = "block",
+        block_timeout: float | None = None,
+        spill_dir: str | None = None,
+    ):
+        super().__init__(maxsize, overflow, block_timeout, spill_dir)
         self.exit_tag = exit_tag
 
     @override
-    def receive_all(self):
+    def _is_control(self, message: str) -> bool:
+        # <exit> を捨てると receive_all が終わらなくなる
+        return message.strip() == self.exit_tag
+
+    @override
+    def post(self, message: str, timeout: float | None = None) -> None:
+        # sink_many でまとめて送られたメッセージは一文ずつに戻す
+        for msg in unpack_batch(message):
+            super().post(msg, timeout)
+
+    @override
+    def receive_all(
+        self, timeout: float | None = None, idle_timeout: float | None = None, deadline: float | None = None
+    ):
         logger.debug(f"[{self.__class__.__name__}] start receive_all")
 
+        deadline, timeout = _start_deadline(timeout, deadline)
         while True:
-            msg = self.receive()
+            wait, idle = _wait_time(deadline, idle_timeout)
+            try:
+                msg = self.receive(wait)
+            except QueueClosed:
+                return
+            except queue.Empty:
+                raise ReceiveTimeout(idle_timeout if idle else timeout, idle) from None
             if msg.strip() == self.exit_tag:
                 break
             yield msg
 
 
 class AsyncClaudeMessageQueue(AsyncMessageQueue):
-    def __init__(self, maxsize=1, exit_tag="<exit>"):
-        super().__init__(maxsize)
+    def __init__(
+        self,
+        maxsize=1,
+        exit_tag="<exit>",
+        overflow: OverflowPolicy = "block",
+        spill_dir: str | None = None,
+    ):
+        super().__init__(maxsize, overflow, spill_dir)
         self.exit_tag = exit_tag
 
     @override
-    async def receive_all(self):
+    def _is_control(self, message: str) -> bool:
+        # <exit> を捨てると receive_all が終わらなくなる
+        return message.strip() == self.exit_tag
+
+    @override
+    async def post(self, message: str) -> None:
+        # sink_many でまとめて送られたメッセージは一文ずつに戻す
+        for msg in unpack_batch(message):
+            await super().post(msg)
+
+    @override
+    def post_nowait(self, message: str) -> None:
+        for msg in unpack_batch(message):
+            super().post_nowait(msg)
+
+    @override
+    async def receive_all(
+        self, timeout: float | None = None, idle_timeout: float | None = None, deadline: float | None = None
+    ):
         logger.debug(f"[{self.__class__.__name__}] start receive_all")
 
+        deadline, timeout = _start_deadline(timeout, deadline)
         while True:
-            msg = await self.receive()
+            wait, idle = _wait_time(deadline, idle_timeout)
+            try:
+                msg = await self.receive(wait)
+            except TimeoutError:
+                raise ReceiveTimeout(idle_timeout if idle else timeout, idle) from None
             if msg.strip() == self.exit_tag:
                 break
             yield msg
@@ -4,38 +4,122 @@ UDP経由でメッセージを受信し、登録されたコールバック関
 """
 
 import socket
+import selectors
 import datetime
 import time
+import queue
 import threading
 import logging
-from typing import Callable, List, Any, Optional, Tuple
+from typing import Callable, List, Any, Optional, Tuple, Dict, NamedTuple, TYPE_CHECKING, override
+
+from claco.wire import ReorderBuffer, Reassembler, GapEvent, Frame, decode_frame
+from claco.transport import (
+    Endpoint,
+    TRANSPORT_UDP,
+    TRANSPORT_UNIX,
+    RecordDecoder,
+    udp_endpoint,
+    is_stream,
+    create_socket,
+    bind_socket,
+    unbind_socket,
+)
+
+if TYPE_CHECKING:
+    import asyncio
+    import multiprocessing
 
 
 logger = logging.getLogger(__name__)
 
 
-class UDPReceiver:
+class Envelope(NamedTuple):
+    # 受信したメッセージと、その送信元の情報
+    # ヘッダの無いデータグラムの場合、session と seq は None
+    session: int | None
+    seq: int | None
+    message: str
+    address: Tuple
+    timestamp: datetime.datetime
+
+
+class _Session:
+    # ヘッダ付きのデータグラムを送ってくるセッションごとの受信状態
+
+    # 覚えておく過去の epoch の数
+    max_retired = 8
+
+    def __init__(self, session: int, reorder_window: float, max_message_size: int, epoch: int = 0):
+        self.reorder = ReorderBuffer(session, reorder_window)
+        self.reassembler = Reassembler(max_message_size)
+        # 送信側のプロセスを区別する値
+        self.epoch = epoch
+        # 同じセッションIDで以前に送ってきたプロセスの epoch。遅れて届いたフレームを捨てるのに使う
+        self.retired: List[int] = []
+        # 最後に受信した送信元アドレス
+        self.address: Tuple | None = None
+        # 最後に受信した時刻（time.monotonic）
+        self.last_seen = 0.0
+
+    def deadline(self) -> float | None:
+        deadlines = [d for d in (self.reorder.deadline(), self.reassembler.deadline()) if d is not None]
+        return min(deadlines, default=None)
+
+
+class _ReceiverBase:
     """
-    UDPメッセージを受信し、登録されたコールバック関数で処理するクラス
-    コンテキストマネージャー（with文）とスレッドでの実行をサポート
+    UDPレシーバーの共通部分
+    コールバック関数の管理と、受信したデータのデコード・配送を担当する
     """
 
-    def __init__(self, ip: str, port: int, buffer_size: int = 4096):
+    # SO_REUSEPORT を指定して、同じアドレスに複数のソケットをバインドできるようにするかどうか
+    reuse_port = False
+
+    # この時間 [s] 何も受信しなかったセッションの受信状態は、新しいセッションが来た時に捨てる
+    session_idle_timeout = 300.0
+
+    def __init__(
+        self,
+        ip: str | Endpoint,
+        port: int | None = None,
+        buffer_size: int = 4096,
+        reorder_window: float = 0.2,
+        max_message_size: int = 1 << 20,
+        rcvbuf: int | None = None,
+    ):
         """
         UDPレシーバーの初期化
 
         Args:
-            ip: 受信するIPアドレス
-            port: 受信するポート
+            ip: 受信するIPアドレス。Endpoint を渡した場合は、そのトランスポートで受信する
+            port: 受信するポート（ip に Endpoint を渡した場合は不要）
             buffer_size: 受信バッファサイズ
+            reorder_window: ヘッダ付きのデータグラムに欠番があったとき、届くのを待つ最大時間 [s]
+            max_message_size: フラグメントから組み立てるメッセージの最大バイト数
+            rcvbuf: ソケットの受信バッファ（SO_RCVBUF）のバイト数。None の場合は OS のデフォルト
         """
-        self.ip = ip
-        self.port = port
+        if isinstance(ip, Endpoint):
+            self.endpoint = ip
+        else:
+            self.endpoint = udp_endpoint(ip, port)
+        if self.endpoint.transport == TRANSPORT_UNIX:
+            self.ip, self.port = self.endpoint.address, None
+        else:
+            self.ip, self.port = self.endpoint.address
         self.buffer_size = buffer_size
+        self.reorder_window = reorder_window
+        self.max_message_size = max_message_size
+        self.rcvbuf = rcvbuf
+        # tcp で受け付けるレコードの最大バイト数
+        self.max_record_size = max(max_message_size, buffer_size) + 64
         self.callbacks: List[Callable[[str, Tuple, datetime.datetime], Any]] = []
+        self.envelope_callbacks: List[Callable[[Envelope], Any]] = []
+        self.gap_callbacks: List[Callable[[GapEvent], Any]] = []
+        self.batch_callbacks: List[Callable[[List[Envelope]], Any]] = []
         self.running = False
-        self.sock: Optional[socket.socket] = None
-        self.receiver_thread: Optional[threading.Thread] = None
+        self._sessions: Dict[int, _Session] = {}
+        # batch_callbacks に渡す前のメッセージ
+        self._batch: List[Envelope] = []
 
     def register_callback(self, callback: Callable[[str, Tuple, datetime.datetime], Any]) -> None:
         """
@@ -46,40 +130,342 @@ class UDPReceiver:
         """
         self.callbacks.append(callback)
 
+    def register_envelope_callback(self, callback: Callable[[Envelope], Any]) -> None:
+        """
+        メッセージを受信した時に、セッションIDや連番と一緒に受け取るコールバック関数を登録する
+
+        Args:
+            callback: 呼び出される関数。引数は Envelope
+        """
+        self.envelope_callbacks.append(callback)
+
+    def register_gap_callback(self, callback: Callable[[GapEvent], Any]) -> None:
+        """
+        ヘッダ付きのデータグラムに欠番が見つかった時に呼び出されるコールバック関数を登録する
+
+        Args:
+            callback: 呼び出される関数。引数は GapEvent
+        """
+        self.gap_callbacks.append(callback)
+
+    def register_batch_callback(self, callback: Callable[[List[Envelope]], Any]) -> None:
+        """
+        1回の受信でまとめて受け取ったメッセージを、リストで受け取るコールバック関数を登録する
+        メッセージごとのコールバック関数をすべて呼び出した後に呼び出される
+
+        Args:
+            callback: 呼び出される関数。引数は Envelope のリスト（変更しないこと）
+        """
+        self.batch_callbacks.append(callback)
+
+    def _create_socket(self) -> socket.socket:
+        """
+        受信用のソケットを作成する
+        """
+        sock = create_socket(self.endpoint, self.reuse_port)
+
+        # バーストをカーネル側で吸収できるよう、受信バッファを広げる
+        if self.rcvbuf is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+            # Linux では指定値の2倍が設定され、上限は net.core.rmem_max で制限される
+            actual = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+            if actual < self.rcvbuf:
+                logger.warning(
+                    f"[{self.__class__.__name__}] SO_RCVBUF is limited by the OS: requested={self.rcvbuf} {actual=}"
+                )
+            else:
+                logger.debug(f"[{self.__class__.__name__}] SO_RCVBUF={actual}")
+
+        return sock
+
+    def _bind_socket(self, sock: socket.socket) -> None:
+        """
+        受信用のソケットをバインドする。失敗した場合はソケットを閉じる
+        """
+        try:
+            bind_socket(sock, self.endpoint)
+        except:
+            sock.close()
+            raise
+
+    def _dispatch(
+        self,
+        data: bytes | memoryview,
+        address: Tuple,
+        timestamp: datetime.datetime | None = None,
+    ) -> None:
+        """
+        受信したデータを解釈し、順番通りにコールバック関数へ渡す
+        ヘッダの無いデータグラムは受信した順にそのまま渡す
+
+        Args:
+            data: 受信したデータ。memoryview の場合、呼び出しから戻った後は参照しない
+            address: 送信元アドレス
+            timestamp: 受信時刻。None の場合は現在時刻
+        """
+        # 受信時刻
+        if timestamp is None:
+            timestamp = datetime.datetime.now()
+
+        try:
+            frame = decode_frame(data)
+        except ValueError as e:
+            logger.warning(f"[{self.__class__.__name__}] invalid frame from {address}: {e}")
+            return
+
+        if frame is None:
+            self._deliver(data, address, timestamp)
+            return
+
+        now = time.monotonic()
+        sess = self._sessions.get(frame.session)
+        if sess is None:
+            self._prune_sessions(now)
+            sess = self._sessions[frame.session] = _Session(
+                frame.session, self.reorder_window, self.max_message_size, frame.epoch
+            )
+        elif frame.epoch != sess.epoch:
+            if frame.epoch in sess.retired:
+                # 再起動する前のプロセスが送ったフレームが遅れて届いた
+                return
+            sess = self._restart_session(sess, frame.epoch, timestamp)
+        sess.address = address
+        sess.last_seen = now
+
+        released, gaps = sess.reorder.push(frame, now)
+        self._release(sess, released, gaps, timestamp)
+
+    def _restart_session(self, sess: _Session, epoch: int, timestamp: datetime.datetime) -> _Session:
+        """
+        同じセッションIDの送信側が再起動したので、受信状態を作り直す
+        再起動する前のプロセスの欠番待ちのフレームは、欠番を飛ばして先に渡す
+        """
+        session = sess.reorder.session
+        logger.debug(f"[{self.__class__.__name__}] session restarted: {session=} epoch={sess.epoch}->{epoch}")
+
+        released, gaps = sess.reorder.flush()
+        self._release(sess, released, gaps, timestamp)
+
+        new = _Session(session, self.reorder_window, self.max_message_size, epoch)
+        new.address = sess.address
+        new.retired = (sess.retired + [sess.epoch])[-_Session.max_retired :]
+        self._sessions[session] = new
+        return new
+
+    def _prune_sessions(self, now: float) -> None:
+        """
+        しばらく何も受信せず、欠番待ちや組み立て途中のデータも無いセッションの受信状態を捨てる
+        """
+        idle = [
+            session
+            for session, sess in self._sessions.items()
+            if now - sess.last_seen >= self.session_idle_timeout and sess.deadline() is None
+        ]
+        for session in idle:
+            del self._sessions[session]
+        if idle:
+            logger.debug(f"[{self.__class__.__name__}] pruned idle sessions: {idle}")
+
+    def _expire(self) -> None:
+        """
+        待ち時間を過ぎた欠番を飛ばし、後続のデータをコールバック関数へ渡す
+        組み立てが終わらないままタイムアウトしたメッセージは捨てる
+        """
+        now = time.monotonic()
+        timestamp = datetime.datetime.now()
+        for session, sess in self._sessions.items():
+            released, gaps = sess.reorder.expire(now)
+            self._release(sess, released, gaps, timestamp)
+            if sess.reassembler.expire(now):
+                logger.warning(f"[{self.__class__.__name__}] fragmented message timed out: {session=}")
+        self._flush_batch()
+
+    def _next_deadline(self) -> float | None:
+        """
+        次に _expire を呼ぶべき時刻（time.monotonic）を返す
+        """
+        deadlines = [d for sess in self._sessions.values() if (d := sess.deadline()) is not None]
+        return min(deadlines, default=None)
+
+    def _release(self, sess: _Session, frames: List[Frame], gaps: List[GapEvent], timestamp: datetime.datetime):
+        for gap in gaps:
+            # 欠番をまたいだフラグメントは組み立てられない
+            sess.reassembler.reset()
+            self._notify_gap(gap)
+
+        now = time.monotonic()
+        for frame in frames:
+            data = sess.reassembler.feed(frame, now)
+            if data is not None:
+                self._deliver(data, sess.address, timestamp, frame.session, frame.seq)
+
+    def _deliver(
+        self,
+        data: bytes | memoryview,
+        address: Tuple,
+        timestamp: datetime.datetime,
+        session: int | None = None,
+        seq: int | None = None,
+    ) -> None:
+        """
+        データをデコードし、登録されたコールバック関数に渡す
+
+        Args:
+            data: 受信したデータ
+            address: 送信元アドレス
+            timestamp: 受信時刻
+            session: セッションID（ヘッダの無いデータグラムの場合は None）
+            seq: 連番（ヘッダの無いデータグラムの場合は None）
+        """
+        # データをデコード
+        try:
+            message = str(data, "utf-8")
+        except UnicodeDecodeError:
+            data = bytes(data)
+            logger.exception(f"[{self.__class__.__name__}] failed to decode message: {data}")
+            message = str(data)[2:-1]  # デコード失敗時はバイト列をそのまま文字列として扱う
+
+        self._emit(message, address, timestamp, session, seq)
+
+    def _emit(
+        self,
+        message: str,
+        address: Tuple,
+        timestamp: datetime.datetime,
+        session: int | None = None,
+        seq: int | None = None,
+    ) -> None:
+        """
+        デコード済みのメッセージを、登録されたコールバック関数に渡す
+        """
+        logger.debug(f"[{self.__class__.__name__}] {message=} {address=} {timestamp=}")
+
+        # 登録されたすべてのコールバック関数を呼び出す
+        for callback in self.callbacks:
+            try:
+                callback(message, address, timestamp)
+            except Exception as e:
+                logger.exception(f"[{self.__class__.__name__}] callback raised exception: message={message}")
+
+        if self.envelope_callbacks or self.batch_callbacks:
+            envelope = Envelope(session, seq, message, address, timestamp)
+            for callback in self.envelope_callbacks:
+                try:
+                    callback(envelope)
+                except Exception as e:
+                    logger.exception(f"[{self.__class__.__name__}] callback raised exception: {envelope=}")
+            if self.batch_callbacks:
+                self._batch.append(envelope)
+
+    def _notify_gap(self, gap: GapEvent) -> None:
+        """
+        欠番を、登録されたコールバック関数に渡す
+        """
+        logger.warning(f"[{self.__class__.__name__}] missing datagrams: {gap}")
+        for callback in self.gap_callbacks:
+            try:
+                callback(gap)
+            except Exception as e:
+                logger.exception(f"[{self.__class__.__name__}] gap callback raised exception: {gap=}")
+
+    def _flush_batch(self) -> None:
+        """
+        溜まったメッセージを batch_callbacks に渡す
+        """
+        if not self._batch:
+            return
+
+        batch, self._batch = self._batch, []
+        for callback in self.batch_callbacks:
+            try:
+                callback(batch)
+            except Exception as e:
+                logger.exception(f"[{self.__class__.__name__}] batch callback raised exception: {len(batch)=}")
+
+
+class UDPReceiver(_ReceiverBase):
+    """
+    UDPメッセージを受信し、登録されたコールバック関数で処理するクラス
+    コンテキストマネージャー（with文）とスレッドでの実行をサポート
+    """
+
+    def __init__(
+        self,
+        ip: str | Endpoint,
+        port: int | None = None,
+        buffer_size: int = 4096,
+        reorder_window: float = 0.2,
+        max_message_size: int = 1 << 20,
+        rcvbuf: int | None = None,
+        drain: bool = False,
+        max_batch: int = 256,
+        workers: int = 0,
+    ):
+        """
+        UDPレシーバーの初期化
+
+        Args:
+            ip: 受信するIPアドレス。Endpoint を渡した場合は、そのトランスポートで受信する
+            port: 受信するポート（ip に Endpoint を渡した場合は不要）
+            buffer_size: 受信バッファサイズ
+            reorder_window: ヘッダ付きのデータグラムに欠番があったとき、届くのを待つ最大時間 [s]
+            max_message_size: フラグメントから組み立てるメッセージの最大バイト数
+            rcvbuf: ソケットの受信バッファ（SO_RCVBUF）のバイト数。None の場合は OS のデフォルト
+            drain: True の場合、ノンブロッキングのソケットを selectors で待ち、
+                1回の起床で溜まっているデータグラムをまとめて受信する
+            max_batch: drain モードで1回の起床で受信するデータグラムの最大数
+            workers: 1以上の場合、SO_REUSEPORT で同じアドレスにバインドしたワーカープロセスを workers 個起動し、
+                各ワーカーが受信・デコードしたメッセージをこのプロセスのコールバック関数に渡す。
+                カーネルは送信元アドレスごとにワーカーを選ぶので、送信元が変わらない限りセッション内の順番は保たれる
+        """
+        super().__init__(ip, port, buffer_size, reorder_window, max_message_size, rcvbuf)
+        if workers > 0 and not hasattr(socket, "SO_REUSEPORT"):
+            raise ValueError("workers requires SO_REUSEPORT, which is not supported on this platform")
+        if workers > 0 and self.endpoint.transport != TRANSPORT_UDP:
+            raise ValueError(f"workers is not supported by {self.endpoint.transport} transport")
+        self.drain = drain
+        self.max_batch = max_batch
+        self.workers = workers
+        self.sock: Optional[socket.socket] = None
+        self.receiver_thread: Optional[threading.Thread] = None
+        # drain モードで、停止時に受信ループを起こすためのソケット
+        self._wakeup: Optional[Tuple[socket.socket, socket.socket]] = None
+        # tcp で受け付けた接続
+        self._conns: Dict[socket.socket, Tuple[RecordDecoder, Tuple]] = {}
+        # ワーカープロセスとの連絡用
+        self._worker_procs: List["multiprocessing.Process"] = []
+        self._worker_queue: Optional["multiprocessing.Queue"] = None
+        self._worker_stop: Optional["multiprocessing.Event"] = None
+        self._worker_ready = threading.Semaphore(0)
+        self._worker_error: BaseException | None = None
+
     def _receive_loop(self):
         """
         メッセージ受信ループ - 別スレッドで実行される
         """
         try:
-            # ソケットをアドレスとポートにバインド
-            self.sock.bind((self.ip, self.port))
+            # 受信バッファはあらかじめ確保しておき、受信のたびに確保しない
+            buf = bytearray(self.buffer_size)
+            view = memoryview(buf)
 
             # メインループ
             while self.running:
                 try:
-                    # データを受信
-                    data, address = self.sock.recvfrom(self.buffer_size)
+                    # 欠番待ちがある場合は、待ち時間が過ぎたら起きるようにする
+                    deadline = self._next_deadline()
+                    if deadline is not None:
+                        wait = deadline - time.monotonic()
+                        if wait <= 0:
+                            self._expire()
+                            continue
+                        self.sock.settimeout(min(wait, 0.5))
+                    else:
+                        self.sock.settimeout(0.5)
 
-                    # 受信時刻
-                    timestamp = datetime.datetime.now()
-
-                    # データをデコード
-                    try:
-                        message = data.decode("utf-8")
-                    except UnicodeDecodeError:
-                        logger.exception(f"[{self.__class__.__name__}] failed to decode message: {data}")
-                        message = str(data)[2:-1]  # デコード失敗時はバイト列をそのまま文字列として扱う
-
-                    logger.debug(f"[{self.__class__.__name__}] {message=} {address=} {timestamp=}")
-
-                    # 登録されたすべてのコールバック関数を呼び出す
-                    for callback in self.callbacks:
-                        try:
-                            callback(message, address, timestamp)
-                        except Exception as e:
-                            logger.exception(
-                                f"[{self.__class__.__name__}] callback raised exception: message={message}"
-                            )
+                    # データを受信
+                    nbytes, address = self.sock.recvfrom_into(buf)
+                    self._dispatch(view[:nbytes], address)
+                    self._flush_batch()
 
                 except socket.timeout:
                     # タイムアウトは正常、ループを継続
@@ -93,6 +479,228 @@ class UDPReceiver:
             if self.running:  # 停止処理中でなければエラーを表示
                 logger.exception(f"[{self.__class__.__name__}] failed to start receiver")
 
+    def _drain_loop(self):
+        """
+        メッセージ受信ループ（drain モード） - 別スレッドで実行される
+        ソケットが読めるようになったら、溜まっているデータグラムを読み切るまで受信してからコールバック関数を呼ぶ
+        """
+        try:
+            self.sock.setblocking(False)
+
+            # 受信バッファはあらかじめ確保しておき、受信のたびに確保しない
+            buf = bytearray(self.buffer_size)
+            view = memoryview(buf)
+
+            with selectors.DefaultSelector() as selector:
+                selector.register(self.sock, selectors.EVENT_READ)
+                selector.register(self._wakeup[0], selectors.EVENT_READ)
+
+                # メインループ
+                while self.running:
+                    try:
+                        # 欠番待ちがある場合は、待ち時間が過ぎたら起きるようにする
+                        # 無い場合は、データグラムが届くか stop されるまで待つ
+                        deadline = self._next_deadline()
+                        timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+                        selector.select(timeout)
+                        if not self.running:
+                            break
+
+                        self._drain_socket(buf, view)
+
+                        deadline = self._next_deadline()
+                        if deadline is not None and deadline <= time.monotonic():
+                            self._expire()
+                        self._flush_batch()
+
+                    except Exception as e:
+                        if self.running:  # 停止処理中でなければエラーを表示
+                            logger.exception(f"[{self.__class__.__name__}] failed to call `recvfrom`")
+                            time.sleep(0.1)  # 少し待機
+
+        except Exception as e:
+            if self.running:  # 停止処理中でなければエラーを表示
+                logger.exception(f"[{self.__class__.__name__}] failed to start receiver")
+
+    def _drain_socket(self, buf: bytearray, view: memoryview) -> int:
+        """
+        ソケットに溜まっているデータグラムを、最大 max_batch 個まで受信する
+        受信時刻は1回の起床につき1度だけ取得する
+
+        Returns:
+            受信したデータグラムの数
+        """
+        timestamp = datetime.datetime.now()
+        count = 0
+        while count < self.max_batch:
+            try:
+                nbytes, address = self.sock.recvfrom_into(buf)
+            except (BlockingIOError, InterruptedError):
+                break
+            self._dispatch(view[:nbytes], address, timestamp)
+            count += 1
+        return count
+
+    def _stream_loop(self):
+        """
+        メッセージ受信ループ（tcp） - 別スレッドで実行される
+        複数の Sink からの接続を受け付け、長さを前に付けたレコードを1つのデータグラムとして扱う
+        """
+        try:
+            self.sock.setblocking(False)
+
+            with selectors.DefaultSelector() as selector:
+                selector.register(self.sock, selectors.EVENT_READ)
+                selector.register(self._wakeup[0], selectors.EVENT_READ)
+
+                # メインループ
+                while self.running:
+                    try:
+                        # 欠番待ちがある場合は、待ち時間が過ぎたら起きるようにする
+                        deadline = self._next_deadline()
+                        timeout = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+                        events = selector.select(timeout)
+                        if not self.running:
+                            break
+
+                        timestamp = datetime.datetime.now()
+                        for key, _ in events:
+                            if key.fileobj is self.sock:
+                                self._accept(selector)
+                            elif key.fileobj in self._conns:
+                                self._read_connection(selector, key.fileobj, timestamp)
+
+                        deadline = self._next_deadline()
+                        if deadline is not None and deadline <= time.monotonic():
+                            self._expire()
+                        self._flush_batch()
+
+                    except Exception as e:
+                        if self.running:  # 停止処理中でなければエラーを表示
+                            logger.exception(f"[{self.__class__.__name__}] failed to call `recv`")
+                            time.sleep(0.1)  # 少し待機
+
+        except Exception as e:
+            if self.running:  # 停止処理中でなければエラーを表示
+                logger.exception(f"[{self.__class__.__name__}] failed to start receiver")
+
+    def _accept(self, selector: selectors.BaseSelector) -> None:
+        try:
+            conn, address = self.sock.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        conn.setblocking(False)
+        self._conns[conn] = (RecordDecoder(self.max_record_size), address)
+        selector.register(conn, selectors.EVENT_READ)
+        logger.debug(f"[{self.__class__.__name__}] accepted connection from {address}")
+
+    def _read_connection(self, selector: selectors.BaseSelector, conn: socket.socket, timestamp: datetime.datetime):
+        decoder, address = self._conns[conn]
+        try:
+            data = conn.recv(max(self.buffer_size, 65536))
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            logger.warning(f"[{self.__class__.__name__}] connection from {address} failed: {e!r}")
+            data = b""
+
+        try:
+            records = decoder.feed(data) if data else []
+        except ValueError as e:
+            logger.warning(f"[{self.__class__.__name__}] invalid record from {address}: {e}")
+            records, data = [], b""
+
+        for record in records:
+            self._dispatch(record, address, timestamp)
+
+        if not data:
+            # 切断された。途中までしか届いていないレコードは捨てる
+            if decoder.pending:
+                logger.warning(
+                    f"[{self.__class__.__name__}] connection from {address} closed in the middle of a record"
+                )
+            logger.debug(f"[{self.__class__.__name__}] connection from {address} closed")
+            selector.unregister(conn)
+            del self._conns[conn]
+            conn.close()
+
+    def _start_workers(self) -> None:
+        """
+        ワーカープロセスを起動する
+        """
+        # fork はスレッドを持つプロセスでは安全でなく、Windows でも使えないので spawn を使う
+        import multiprocessing
+
+        ctx = multiprocessing.get_context("spawn")
+        self._worker_queue = ctx.Queue()
+        self._worker_stop = ctx.Event()
+        self._worker_ready = threading.Semaphore(0)
+        self._worker_error = None
+        options = {
+            "buffer_size": self.buffer_size,
+            "reorder_window": self.reorder_window,
+            "max_message_size": self.max_message_size,
+            "rcvbuf": self.rcvbuf,
+            "max_batch": self.max_batch,
+        }
+        self._worker_procs = [
+            ctx.Process(
+                target=_worker_main,
+                args=(self.endpoint, options, self._worker_queue, self._worker_stop),
+                daemon=True,
+            )
+            for _ in range(self.workers)
+        ]
+        for proc in self._worker_procs:
+            proc.start()
+
+    def _forward_loop(self):
+        """
+        ワーカープロセスから届いたメッセージを、登録されたコールバック関数に渡す - 別スレッドで実行される
+        """
+        done = 0
+        while done < len(self._worker_procs):
+            try:
+                kind, item = self._worker_queue.get(timeout=0.5)
+            except queue.Empty:
+                if not self.running or not any(proc.is_alive() for proc in self._worker_procs):
+                    break
+                continue
+            except Exception as e:
+                if self.running:
+                    logger.exception(f"[{self.__class__.__name__}] failed to receive from workers")
+                break
+
+            if kind == "batch":
+                for x in item:
+                    if isinstance(x, GapEvent):
+                        self._notify_gap(x)
+                    else:
+                        self._emit(x.message, x.address, x.timestamp, x.session, x.seq)
+                self._flush_batch()
+            elif kind == "ready":
+                self._worker_ready.release()
+            elif kind == "error":
+                self._worker_error = item
+                self._worker_ready.release()
+            elif kind == "done":
+                done += 1
+
+        # start が待っている場合は起こす
+        if self._worker_error is None:
+            self._worker_error = RuntimeError("worker processes exited")
+        for _ in self._worker_procs:
+            self._worker_ready.release()
+
+    def _wait_workers(self, timeout: float = 30.0) -> None:
+        # すべてのワーカーがバインドし終わるまで待つ
+        deadline = time.monotonic() + timeout
+        for _ in self._worker_procs:
+            if not self._worker_ready.acquire(timeout=max(deadline - time.monotonic(), 0.0)):
+                raise TimeoutError("workers did not start in time")
+            if self._worker_error is not None:
+                raise self._worker_error
+
     def start(self, threaded: bool = True):
         """
         UDPメッセージ受信サーバを起動する
@@ -107,29 +715,63 @@ class UDPReceiver:
             logger.warning(f"[{self.__class__.__name__}] `start` called, but already running. ignoring...")
             return
 
+        if self.workers > 0:
+            self._start_workers()
+            print(f"Starting UDP receiver on {self.endpoint} ({self.workers} workers)")
+            print("Press Ctrl+C to exit.")
+
+            self.running = True
+            if not threaded:
+                self._forward_loop()
+                self.cleanup()
+                return
+
+            self.receiver_thread = threading.Thread(target=self._forward_loop, daemon=True)
+            self.receiver_thread.start()
+            try:
+                self._wait_workers()
+            except:
+                self.stop()
+                raise
+            return
+
         # UDPソケットの作成
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock = self._create_socket()
 
-        # ソケットの再利用を有効化
-        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # ソケットをアドレスとポートにバインド
+        # 受信ループの開始前にバインドしておき、start から戻った時点で受信できるようにする
+        try:
+            self._bind_socket(self.sock)
+        except:
+            self.sock = None
+            raise
 
         # タイムアウトを設定して、定期的にループをチェックできるようにする
         self.sock.settimeout(0.5)
 
-        print(f"Starting UDP receiver on {self.ip}:{self.port}")
+        print(f"Starting UDP receiver on {self.endpoint}")
         print("Press Ctrl+C to exit.")
 
         # 実行フラグをセット
         self.running = True
 
+        if is_stream(self.endpoint):
+            self._wakeup = socket.socketpair()
+            loop = self._stream_loop
+        elif self.drain:
+            self._wakeup = socket.socketpair()
+            loop = self._drain_loop
+        else:
+            loop = self._receive_loop
+
         if threaded:
             # 別スレッドで受信ループを開始
-            self.receiver_thread = threading.Thread(target=self._receive_loop, daemon=True)
+            self.receiver_thread = threading.Thread(target=loop, daemon=True)
             self.receiver_thread.start()
             logger.debug(f"[{self.__class__.__name__}] start thread {self.receiver_thread.native_id}")
         else:
             # 同じスレッドで受信ループを実行（以前の動作）
-            self._receive_loop()
+            loop()
             self.cleanup()  # 同期モードの場合は終了時にクリーンアップ
 
     def stop(self):
@@ -144,6 +786,16 @@ class UDPReceiver:
 
         self.running = False
 
+        if self._worker_stop is not None:
+            self._worker_stop.set()
+
+        # drain モードの受信ループはタイムアウトせずに待っているので、起こす
+        if self._wakeup is not None:
+            try:
+                self._wakeup[1].send(b"\0")
+            except OSError:
+                pass
+
         # スレッドが存在し、現在のスレッドでない場合は待機
         if (
             self.receiver_thread
@@ -162,6 +814,28 @@ class UDPReceiver:
         if self.sock:
             self.sock.close()
             self.sock = None
+            unbind_socket(self.endpoint)
+
+        for conn in self._conns:
+            conn.close()
+        self._conns.clear()
+
+        if self._wakeup is not None:
+            for sock in self._wakeup:
+                sock.close()
+            self._wakeup = None
+
+        for proc in self._worker_procs:
+            proc.join(timeout=2.0)
+            if proc.is_alive():
+                logger.warning(f"[{self.__class__.__name__}] worker {proc.pid} did not exit; terminating")
+                proc.terminate()
+        self._worker_procs = []
+        if self._worker_queue is not None:
+            self._worker_queue.close()
+            self._worker_queue.cancel_join_thread()
+            self._worker_queue = None
+        self._worker_stop = None
 
         self.receiver_thread = None
         logger.info(f"[{self.__class__.__name__}] Server closed.")
@@ -188,6 +862,331 @@ class UDPReceiver:
         self.stop()
 
 
+class _WorkerReceiver(UDPReceiver):
+    # ワーカープロセスで受信・デコードし、1回の起床で受け取ったメッセージと欠番をまとめて親プロセスに送る
+
+    def __init__(self, out: "multiprocessing.Queue", *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.reuse_port = True
+        self._out = out
+        self._outbox: List[Envelope | GapEvent] = []
+        self.register_envelope_callback(lambda envelope: self._outbox.append(envelope))
+        self.register_gap_callback(lambda gap: self._outbox.append(gap))
+
+    @override
+    def _notify_gap(self, gap: GapEvent) -> None:
+        # ログは親プロセスで出す
+        for callback in self.gap_callbacks:
+            callback(gap)
+
+    @override
+    def _flush_batch(self) -> None:
+        super()._flush_batch()
+        if self._outbox:
+            items, self._outbox = self._outbox, []
+            self._out.put(("batch", items))
+
+
+def _worker_main(
+    endpoint: Endpoint, options: Dict[str, Any], out: "multiprocessing.Queue", stop: "multiprocessing.Event"
+) -> None:
+    # ワーカープロセスのエントリーポイント
+    receiver = _WorkerReceiver(out, endpoint, drain=True, **options)
+    try:
+        receiver.start(threaded=True)
+    except Exception as e:
+        out.put(("error", e))
+        return
+    out.put(("ready", None))
+
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop()
+        out.put(("done", None))
+
+
+class _DatagramProtocol:
+    # イベントループから受け取ったデータグラムを AsyncUDPReceiver に渡す
+    # asyncio.DatagramProtocol と同じメソッドを持つ
+    # UDPReceiver だけを使う場合に asyncio を import しなくて済むよう、継承はしない
+
+    def __init__(self, receiver: "AsyncUDPReceiver"):
+        self.receiver = receiver
+
+    def connection_made(self, transport) -> None:
+        pass
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        pass
+
+    def datagram_received(self, data: bytes, addr: Tuple) -> None:
+        self.receiver._dispatch(data, addr)
+        self.receiver._flush_batch()
+        self.receiver._schedule_expire()
+
+    def error_received(self, exc: Exception) -> None:
+        logger.error(f"[{self.receiver.__class__.__name__}] error received: {exc!r}")
+
+
+class _StreamProtocol:
+    # tcp の接続ごとに、受け取ったレコードを AsyncUDPReceiver に渡す
+    # asyncio.Protocol と同じメソッドを持つ
+
+    def __init__(self, receiver: "AsyncUDPReceiver"):
+        self.receiver = receiver
+        self.decoder = RecordDecoder(receiver.max_record_size)
+        self.transport = None
+        self.address: Tuple | None = None
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+        self.address = transport.get_extra_info("peername")
+        self.receiver._streams.add(transport)
+        logger.debug(f"[{self.receiver.__class__.__name__}] accepted connection from {self.address}")
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self.receiver._streams.discard(self.transport)
+        if self.decoder.pending:
+            # 途中までしか届いていないレコードは捨てる
+            logger.warning(
+                f"[{self.receiver.__class__.__name__}] connection from {self.address} closed in the middle of a record"
+            )
+        logger.debug(f"[{self.receiver.__class__.__name__}] connection from {self.address} closed")
+
+    def data_received(self, data: bytes) -> None:
+        try:
+            records = self.decoder.feed(data)
+        except ValueError as e:
+            logger.warning(f"[{self.receiver.__class__.__name__}] invalid record from {self.address}: {e}")
+            self.transport.close()
+            return
+
+        timestamp = datetime.datetime.now()
+        for record in records:
+            self.receiver._dispatch(record, self.address, timestamp)
+        self.receiver._flush_batch()
+        self.receiver._schedule_expire()
+
+    def eof_received(self) -> bool | None:
+        return None
+
+    def pause_writing(self) -> None:
+        pass
+
+    def resume_writing(self) -> None:
+        pass
+
+
+class AsyncUDPReceiver(_ReceiverBase):
+    """
+    asyncio のイベントループ上でUDPメッセージを受信するクラス
+    受信スレッドを持たず、コールバック関数はイベントループのスレッドで呼び出される
+    非同期コンテキストマネージャー（async with文）と、イベントループ上でのコンテキストマネージャー（with文）をサポート
+    """
+
+    def __init__(
+        self,
+        ip: str | Endpoint,
+        port: int | None = None,
+        buffer_size: int = 4096,
+        reorder_window: float = 0.2,
+        max_message_size: int = 1 << 20,
+        rcvbuf: int | None = None,
+    ):
+        """
+        UDPレシーバーの初期化
+
+        Args:
+            ip: 受信するIPアドレス。Endpoint を渡した場合は、そのトランスポートで受信する
+            port: 受信するポート（ip に Endpoint を渡した場合は不要）
+            buffer_size: 受信バッファサイズ（イベントループ側で受信するため使用しない）
+            reorder_window: ヘッダ付きのデータグラムに欠番があったとき、届くのを待つ最大時間 [s]
+            max_message_size: フラグメントから組み立てるメッセージの最大バイト数
+            rcvbuf: ソケットの受信バッファ（SO_RCVBUF）のバイト数。None の場合は OS のデフォルト
+        """
+        super().__init__(ip, port, buffer_size, reorder_window, max_message_size, rcvbuf)
+        self.transport: Optional["asyncio.DatagramTransport"] = None
+        self._expire_timer: Optional["asyncio.TimerHandle"] = None
+        # tcp の場合のサーバと、受け付けた接続
+        self._server: Optional["asyncio.Server"] = None
+        self._streams: set["asyncio.Transport"] = set()
+        # with 文で開始した場合の、イベントループへの登録が終わっていないタスクとソケット
+        self._start_task: Optional["asyncio.Task"] = None
+        self._pending_sock: Optional[socket.socket] = None
+
+    def _schedule_expire(self) -> None:
+        # 欠番待ちがあれば、待ち時間が過ぎた時点で _expire を呼ぶ
+        # イベントループの time() は time.monotonic() と同じ時計を使う
+        if self._expire_timer is not None:
+            return
+        deadline = self._next_deadline()
+        if deadline is not None:
+            import asyncio
+
+            self._expire_timer = asyncio.get_running_loop().call_at(deadline, self._on_expire_timer)
+
+    def _on_expire_timer(self) -> None:
+        self._expire_timer = None
+        if not self.running:
+            return
+        self._expire()
+        self._schedule_expire()
+
+    async def start(self):
+        """
+        UDPメッセージ受信を開始する
+        """
+        logger.debug(f"[{self.__class__.__name__}] Starting UDP receiver...")
+
+        # 既に実行中の場合は何もしない
+        if self.running:
+            logger.warning(f"[{self.__class__.__name__}] `start` called, but already running. ignoring...")
+            return
+
+        sock = self._open()
+        await self._serve(sock)
+
+        # 実行フラグをセット
+        self.running = True
+
+    def _open(self) -> socket.socket:
+        # create_datagram_endpoint は SO_REUSEADDR を指定できないので、ソケットはこちらで用意する
+        # バインド（tcp の場合は listen も）は同期的に行うので、この時点から届いたデータはカーネルに溜まる
+        sock = self._create_socket()
+        self._bind_socket(sock)
+        self._pending_sock = sock
+        return sock
+
+    async def _serve(self, sock: socket.socket) -> None:
+        # バインドしたソケットをイベントループに登録する
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        try:
+            if is_stream(self.endpoint):
+                self._server = await loop.create_server(lambda: _StreamProtocol(self), sock=sock)
+            else:
+                self.transport, _ = await loop.create_datagram_endpoint(lambda: _DatagramProtocol(self), sock=sock)
+        except BaseException:
+            sock.close()
+            unbind_socket(self.endpoint)
+            raise
+        finally:
+            self._pending_sock = None
+
+        logger.info(f"[{self.__class__.__name__}] Starting UDP receiver on {self.endpoint}")
+
+    def stop(self):
+        """
+        レシーバーを停止する
+        待機するスレッドが無いので、すぐに戻る
+        """
+        logger.debug(f"[{self.__class__.__name__}] Stopping UDP receiver...")
+
+        if not self.running:
+            logger.warning(f"[{self.__class__.__name__}] `stop` called, but not running. ignoring...")
+            return
+
+        self.running = False
+        self.cleanup()
+
+    def cleanup(self):
+        """
+        リソースをクリーンアップする
+        """
+        if self._expire_timer:
+            self._expire_timer.cancel()
+            self._expire_timer = None
+
+        if self._start_task is not None:
+            # イベントループへの登録が終わる前に停止した
+            self._start_task.cancel()
+            self._start_task = None
+        if self._pending_sock is not None:
+            self._pending_sock.close()
+            self._pending_sock = None
+            unbind_socket(self.endpoint)
+
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+            unbind_socket(self.endpoint)
+
+        if self._server:
+            self._server.close()
+            self._server = None
+            for transport in list(self._streams):
+                transport.close()
+            self._streams.clear()
+
+        logger.info(f"[{self.__class__.__name__}] Server closed.")
+
+    def __enter__(self):
+        """
+        with文での開始時に呼ばれる
+        イベントループ上でのみ使える。ソケットはすぐにバインドし、イベントループへの登録はタスクで行う
+
+        Returns:
+            self: このインスタンス
+        """
+        import asyncio
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            raise RuntimeError(
+                f"{self.__class__.__name__} must be started on a running event loop; use UDPReceiver outside asyncio"
+            ) from None
+
+        if self.running:
+            logger.warning(f"[{self.__class__.__name__}] `start` called, but already running. ignoring...")
+            return self
+
+        logger.debug(f"[{self.__class__.__name__}] Starting UDP receiver...")
+        sock = self._open()
+        self._start_task = loop.create_task(self._serve(sock))
+        self._start_task.add_done_callback(self._on_started)
+        self.running = True
+        return self
+
+    def _on_started(self, task: "asyncio.Task") -> None:
+        if self._start_task is task:
+            self._start_task = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"[{self.__class__.__name__}] failed to start: {task.exception()!r}")
+            self.running = False
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """
+        with文の終了時に呼ばれる
+        """
+        self.stop()
+
+    async def __aenter__(self):
+        """
+        async with文での開始時に呼ばれる
+
+        Returns:
+            self: このインスタンス
+        """
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """
+        async with文の終了時に呼ばれる
+
+        Args:
+            exc_type: 例外の種類
+            exc_val: 例外の値
+            exc_tb: トレースバック
+        """
+        self.stop()
+
+
 # 使用例
 def main():
     """メイン関数 - 使用例を示す"""
@@ -0,0 +1,470 @@
+"""
+受信したメッセージを追記専用のログに記録し、後から読み出したり再生したりする
+
+ログはディレクトリにセグメントごとに書き出す
+    {先頭のレコード番号:012d}.log: レコードを追記したファイル
+    {先頭のレコード番号:012d}.idx: 各レコードの .log 内のオフセットとセッションID
+1つのセグメントが segment_size を超えると、次のセグメントに切り替える
+
+レコードの形式（ビッグエンディアン）:
+    monotonic (8 bytes) | wall (8 bytes) | session (8 bytes) | seq (8 bytes) | message 長 (4 bytes) | address 長 (2 bytes)
+    | message (UTF-8) | address (JSON)
+    monotonic は記録した時の time.monotonic_ns()、wall は受信時刻の UNIX 時間 [ns]
+    session と seq はヘッダの無いデータグラムの場合 -1
+
+読み出し側は .log と .idx を mmap するので、ファイル全体を読み込まずに任意のレコードやセッションを取り出せる
+"""
+
+import os
+import mmap
+import time
+import queue
+import struct
+import datetime
+import threading
+import logging
+from typing import Any, Callable, Iterator, List, NamedTuple, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+RECORD_HEADER = struct.Struct("!qqqqIH")
+# .log 内のオフセットとセッションID
+INDEX_ENTRY = struct.Struct("!Qq")
+
+LOG_SUFFIX = ".log"
+INDEX_SUFFIX = ".idx"
+
+_STOP = object()
+
+
+class Record(NamedTuple):
+    # ログから読み出したメッセージ
+    # ヘッダの無いデータグラムの場合、session と seq は None
+    index: int
+    session: int | None
+    seq: int | None
+    message: str
+    address: Tuple | str | None
+    timestamp: datetime.datetime
+    monotonic: int
+
+    @property
+    def envelope(self):
+        # レシーバーの envelope_callbacks と同じ形に戻す
+        from claco.receiver import Envelope
+
+        return Envelope(self.session, self.seq, self.message, self.address, self.timestamp)
+
+
+def _segment_name(first: int) -> str:
+    return f"{first:012d}"
+
+
+def _list_segments(directory: str) -> List[int]:
+    # ディレクトリ内のセグメントの先頭のレコード番号
+    firsts = []
+    for name in os.listdir(directory):
+        stem, ext = os.path.splitext(name)
+        if ext == LOG_SUFFIX and stem.isdigit():
+            firsts.append(int(stem))
+    return sorted(firsts)
+
+
+def _encode_address(address: Tuple | str | None) -> bytes:
+    import json
+
+    if address is None:
+        return b""
+    if isinstance(address, tuple):
+        address = list(address)
+    return json.dumps(address, separators=(",", ":")).encode("utf-8")
+
+
+def _decode_address(data: bytes) -> Tuple | str | None:
+    import json
+
+    if not data:
+        return None
+    address = json.loads(data)
+    return tuple(address) if isinstance(address, list) else address
+
+
+class TranscriptRecorder:
+    """
+    レシーバーが受信したメッセージをログに記録する
+    受信スレッドではキューに入れるだけで、書き込みは別スレッドで行うので、受信を遅らせない
+
+    usage:
+        recorder = TranscriptRecorder("transcripts")
+        recorder.attach(receiver)
+        with recorder, receiver:
+            ...
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_size: int = 64 * 1024 * 1024,
+        flush_interval: float = 0.05,
+        fsync: bool = False,
+    ):
+        """
+        Args:
+            directory: ログを書き出すディレクトリ。既にログがある場合は新しいセグメントから追記する
+            segment_size: 1つのセグメントの .log の最大バイト数の目安
+            flush_interval: 受信してからファイルに書き出すまでに溜めておく時間 [s]
+            fsync: True の場合、書き出すたびに fsync する
+        """
+        self.directory = os.fspath(directory)
+        self.segment_size = segment_size
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        # 書き込んだレコードの数
+        self.recorded = 0
+        # 書き込みに失敗したレコードの数
+        self.errors = 0
+        self._queue: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._log = None
+        self._index = None
+        self._offset = 0
+        self._next = 0
+        self._last_address: Any = None
+        self._last_address_data = b""
+
+    def attach(self, receiver) -> None:
+        """
+        レシーバーの batch_callbacks に登録する
+
+        Args:
+            receiver: UDPReceiver または AsyncUDPReceiver
+        """
+        receiver.register_batch_callback(self.record_batch)
+
+    def record(self, envelope) -> None:
+        """
+        メッセージを1つ記録する（envelope_callbacks に登録して使うこともできる）
+
+        Args:
+            envelope: 受信したメッセージ
+        """
+        self._queue.put((time.monotonic_ns(), (envelope,)))
+
+    def record_batch(self, envelopes: List) -> None:
+        """
+        まとめて受信したメッセージを記録する
+
+        Args:
+            envelopes: 受信したメッセージのリスト（変更しない）
+        """
+        self._queue.put((time.monotonic_ns(), envelopes))
+
+    @property
+    def pending(self) -> int:
+        # まだ書き込んでいないバッチの数
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        # 既存のログの続きのレコード番号から新しいセグメントを始める
+        self._next = TranscriptReader(self.directory).count_and_close()
+        self._open_segment()
+
+        self._thread = threading.Thread(target=self._run, name=self.__class__.__name__, daemon=True)
+        self._thread.start()
+        logger.debug(f"[{self.__class__.__name__}] recording to {self.directory} from record {self._next}")
+
+    def stop(self) -> None:
+        # キューに残っているメッセージを書き込んでから止める
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self._close_segment()
+        logger.debug(f"[{self.__class__.__name__}] stopped: {self.recorded=} {self.errors=}")
+
+    def _open_segment(self) -> None:
+        path = os.path.join(self.directory, _segment_name(self._next))
+        self._log = open(path + LOG_SUFFIX, "ab", buffering=1024 * 1024)
+        self._index = open(path + INDEX_SUFFIX, "ab")
+        self._offset = self._log.tell()
+
+    def _close_segment(self) -> None:
+        for f in (self._log, self._index):
+            if f is not None:
+                f.close()
+        self._log = self._index = None
+
+    def _flush(self) -> None:
+        # .log を先に書き出し、.idx が書き出されていないレコードを指さないようにする
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self._index.flush()
+        if self.fsync:
+            os.fsync(self._index.fileno())
+
+    def _write_batch(self, monotonic: int, envelopes: List) -> None:
+        # 1回の受信でまとめて届いたメッセージを、それぞれのファイルへの1回の write で書き込む
+        records = []
+        entries = []
+        for envelope in envelopes:
+            session = -1 if envelope.session is None else envelope.session
+            seq = -1 if envelope.seq is None else envelope.seq
+            message = envelope.message.encode("utf-8")
+            if envelope.address != self._last_address:
+                # 送信元アドレスはほとんど変わらないので、直前のものを使い回す
+                self._last_address = envelope.address
+                self._last_address_data = _encode_address(envelope.address)
+            address = self._last_address_data
+            wall = int(envelope.timestamp.timestamp() * 1_000_000) * 1000
+
+            records.append(RECORD_HEADER.pack(monotonic, wall, session, seq, len(message), len(address)))
+            records.append(message)
+            records.append(address)
+            entries.append(INDEX_ENTRY.pack(self._offset, session))
+            self._offset += RECORD_HEADER.size + len(message) + len(address)
+
+            if self._offset >= self.segment_size:
+                self._commit(records, entries)
+                records, entries = [], []
+                self._flush()
+                self._close_segment()
+                self._open_segment()
+
+        self._commit(records, entries)
+
+    def _commit(self, records: List[bytes], entries: List[bytes]) -> None:
+        if not entries:
+            return
+        self._log.write(b"".join(records))
+        self._index.write(b"".join(entries))
+        self._next += len(entries)
+        self.recorded += len(entries)
+
+    def _run(self) -> None:
+        q = self._queue
+        stop = False
+        while not stop:
+            items = [q.get()]
+            if items[0] is not _STOP and self.flush_interval > 0:
+                # 受信のたびに起こされて受信スレッドと GIL を奪い合わないよう、しばらく溜めてからまとめて書き込む
+                time.sleep(self.flush_interval)
+            while True:
+                try:
+                    items.append(q.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in items:
+                if item is _STOP:
+                    stop = True
+                    continue
+                monotonic, envelopes = item
+                try:
+                    self._write_batch(monotonic, envelopes)
+                except Exception as e:
+                    self.errors += len(envelopes)
+                    logger.exception(f"[{self.__class__.__name__}] failed to record {len(envelopes)} messages")
+
+            try:
+                self._flush()
+            except OSError as e:
+                logger.exception(f"[{self.__class__.__name__}] failed to flush")
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+
+class _Segment:
+    # mmap した1つのセグメント
+
+    def __init__(self, directory: str, first: int):
+        path = os.path.join(directory, _segment_name(first))
+        self.first = first
+        self.log = self._map(path + LOG_SUFFIX)
+        self.index = self._map(path + INDEX_SUFFIX)
+
+        # 書き込み途中のレコードは数えない
+        log_size = len(self.log) if self.log is not None else 0
+        count = (len(self.index) if self.index is not None else 0) // INDEX_ENTRY.size
+        while count > 0:
+            offset, _ = INDEX_ENTRY.unpack_from(self.index, (count - 1) * INDEX_ENTRY.size)
+            if offset + RECORD_HEADER.size <= log_size:
+                *_, n, m = RECORD_HEADER.unpack_from(self.log, offset)
+                if offset + RECORD_HEADER.size + n + m <= log_size:
+                    break
+            count -= 1
+        self.count = count
+
+    @staticmethod
+    def _map(path: str) -> mmap.mmap | None:
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+
+    def entry(self, i: int) -> Tuple[int, int]:
+        return INDEX_ENTRY.unpack_from(self.index, i * INDEX_ENTRY.size)
+
+    def read(self, i: int) -> Record:
+        offset, _ = self.entry(i)
+        monotonic, wall, session, seq, n, m = RECORD_HEADER.unpack_from(self.log, offset)
+        start = offset + RECORD_HEADER.size
+        return Record(
+            index=self.first + i,
+            session=None if session < 0 else session,
+            seq=None if seq < 0 else seq,
+            message=self.log[start : start + n].decode("utf-8"),
+            address=_decode_address(self.log[start + n : start + n + m]),
+            timestamp=datetime.datetime.fromtimestamp(wall / 1e9),
+            monotonic=monotonic,
+        )
+
+    def close(self) -> None:
+        for m in (self.log, self.index):
+            if m is not None:
+                m.close()
+
+
+class TranscriptReader:
+    """
+    TranscriptRecorder が書き出したログを読み出す
+    開いた時点で書き出されていたレコードだけを読み出す。記録中のログの続きを読む場合は refresh を呼ぶ
+
+    usage:
+        with TranscriptReader("transcripts") as reader:
+            for record in reader.session(session_id):
+                print(record.message)
+    """
+
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: TranscriptRecorder に渡したディレクトリ
+        """
+        self.directory = os.fspath(directory)
+        self._segments: List[_Segment] = []
+        self.refresh()
+
+    def refresh(self) -> None:
+        """
+        セグメントを開き直す
+        """
+        self.close()
+        if os.path.isdir(self.directory):
+            self._segments = [_Segment(self.directory, first) for first in _list_segments(self.directory)]
+
+    def count_and_close(self) -> int:
+        # 次に記録するレコード番号を返して閉じる
+        n = max((s.first + s.count for s in self._segments), default=0)
+        self.close()
+        return n
+
+    def close(self) -> None:
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
+
+    def __len__(self) -> int:
+        return sum(s.count for s in self._segments)
+
+    def _locate(self, index: int) -> Tuple[_Segment, int]:
+        for segment in self._segments:
+            if segment.first <= index < segment.first + segment.count:
+                return segment, index - segment.first
+        raise IndexError(f"record not found: {index}")
+
+    def __getitem__(self, index: int) -> Record:
+        segment, i = self._locate(index)
+        return segment.read(i)
+
+    def __iter__(self) -> Iterator[Record]:
+        return self.records()
+
+    def records(self, start: int = 0) -> Iterator[Record]:
+        """
+        レコード番号が start 以上のレコードを順に返す
+        """
+        for segment in self._segments:
+            if segment.first + segment.count <= start:
+                continue
+            for i in range(max(start - segment.first, 0), segment.count):
+                yield segment.read(i)
+
+    def session(self, session: int | None) -> Iterator[Record]:
+        """
+        1つのセッションのレコードを順に返す
+        .idx だけを走査するので、他のセッションのメッセージは読み込まない
+
+        Args:
+            session: セッションID。None の場合はヘッダの無いデータグラム
+        """
+        key = -1 if session is None else session
+        for segment in self._segments:
+            if segment.index is None:
+                continue
+            for i, (_, s) in enumerate(INDEX_ENTRY.iter_unpack(segment.index[: segment.count * INDEX_ENTRY.size])):
+                if s == key:
+                    yield segment.read(i)
+
+    def sessions(self) -> set[int | None]:
+        # 記録されているセッションID
+        found = set()
+        for segment in self._segments:
+            if segment.index is None:
+                continue
+            for _, s in INDEX_ENTRY.iter_unpack(segment.index[: segment.count * INDEX_ENTRY.size]):
+                found.add(None if s < 0 else s)
+        return found
+
+    def replay(
+        self,
+        callback: Callable[[Any], Any],
+        session: int | None | Tuple[()] = (),
+        speed: float = 0.0,
+    ) -> int:
+        """
+        記録したメッセージを Envelope にしてコールバック関数に渡す
+
+        Args:
+            callback: 呼び出される関数。引数は Envelope（レシーバーの envelope_callbacks と同じ）
+            session: 再生するセッションID。省略した場合はすべてのセッション
+            speed: 記録した時の間隔を何倍速で再現するか。0 の場合は待たずに渡す
+
+        Returns:
+            渡したメッセージの数
+        """
+        records = self.records() if session == () else self.session(session)
+        n = 0
+        start = None
+        t0 = time.monotonic_ns()
+        for record in records:
+            if speed > 0:
+                if start is None:
+                    start = record.monotonic
+                delay = (record.monotonic - start) / speed - (time.monotonic_ns() - t0)
+                if delay > 0:
+                    time.sleep(delay / 1e9)
+            callback(record.envelope)
+            n += 1
+        return n
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,182 @@
+"""
+1つのレシーバーを複数の Communicator で共有するためのルーター
+受信したメッセージを、Sink が付けたセッションID（ヘッダの無いデータグラムの場合は送信元アドレス）で振り分ける
+"""
+
+import datetime
+import threading
+import logging
+from typing import Callable, Any, Tuple
+
+from claco.receiver import UDPReceiver, AsyncUDPReceiver, Envelope
+from claco.wire import GapEvent
+
+
+logger = logging.getLogger(__name__)
+
+
+SessionKey = int | Tuple
+
+
+class SessionChannel:
+    """
+    1つのセッション宛てのメッセージだけを受け取るチャンネル
+    UDPReceiver と同じように Communicator に渡して使う
+    """
+
+    def __init__(self, router: "SessionRouter", key: SessionKey):
+        self.router = router
+        self.key = key
+        self.callbacks: list[Callable[[str, Tuple, datetime.datetime], Any]] = []
+        self.gap_callbacks: list[Callable[[GapEvent], Any]] = []
+
+    def register_callback(self, callback: Callable[[str, Tuple, datetime.datetime], Any]) -> None:
+        self.callbacks.append(callback)
+
+    def register_gap_callback(self, callback: Callable[[GapEvent], Any]) -> None:
+        self.gap_callbacks.append(callback)
+
+    def _deliver(self, envelope: Envelope) -> None:
+        for callback in self.callbacks:
+            try:
+                callback(envelope.message, envelope.address, envelope.timestamp)
+            except Exception as e:
+                logger.exception(f"[{self.__class__.__name__}] callback raised exception: {envelope=}")
+
+    def _notify_gap(self, gap: GapEvent) -> None:
+        for callback in self.gap_callbacks:
+            try:
+                callback(gap)
+            except Exception as e:
+                logger.exception(f"[{self.__class__.__name__}] gap callback raised exception: {gap=}")
+
+    def close(self) -> None:
+        # ルーターから外す。同じセッションのチャンネルを作り直せるようになる
+        self.router._remove(self)
+
+    def __enter__(self):
+        # 一度閉じたチャンネルを再び開いた場合は、ルーターに登録し直す
+        self.router._attach(self)
+        self.router._acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.router._release()
+        finally:
+            self.close()
+
+    async def __aenter__(self):
+        self.router._attach(self)
+        await self.router._aacquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        try:
+            await self.router._arelease()
+        finally:
+            self.close()
+
+
+class SessionRouter:
+    """
+    1つのレシーバーで受信したメッセージを、セッションごとのチャンネルに振り分ける
+    レシーバーはチャンネルが最初に開かれた時に起動し、すべて閉じられた時に停止する
+    """
+
+    def __init__(self, receiver: UDPReceiver | AsyncUDPReceiver):
+        """
+        Args:
+            receiver: 共有するレシーバー
+        """
+        self.receiver = receiver
+        self.channels: dict[SessionKey, SessionChannel] = {}
+        # どのチャンネルにも届けられなかったメッセージの数
+        self.unrouted = 0
+        self._lock = threading.Lock()
+        # async with で使う場合に、レシーバーの起動・停止が終わるまで他のチャンネルを待たせるロック
+        self._alock: "asyncio.Lock | None" = None
+        self._refs = 0
+        receiver.register_envelope_callback(self._route)
+        receiver.register_gap_callback(self._route_gap)
+
+    def channel(self, key: SessionKey) -> SessionChannel:
+        """
+        セッション宛てのチャンネルを作る
+
+        Args:
+            key: セッションID。ヘッダを付けない Sink の場合は送信元アドレス (ip, port)
+
+        Returns:
+            チャンネル
+        """
+        with self._lock:
+            if key in self.channels:
+                raise ValueError(f"channel already exists: {key!r}")
+            ch = self.channels[key] = SessionChannel(self, key)
+        logger.debug(f"[{self.__class__.__name__}] open channel: {key=}")
+        return ch
+
+    def _attach(self, ch: SessionChannel) -> None:
+        with self._lock:
+            current = self.channels.setdefault(ch.key, ch)
+        if current is not ch:
+            raise ValueError(f"channel already exists: {ch.key!r}")
+
+    def _remove(self, ch: SessionChannel) -> None:
+        with self._lock:
+            if self.channels.get(ch.key) is ch:
+                del self.channels[ch.key]
+        logger.debug(f"[{self.__class__.__name__}] close channel: key={ch.key}")
+
+    def _route(self, envelope: Envelope) -> None:
+        key = envelope.session if envelope.session is not None else envelope.address
+        ch = self.channels.get(key)
+        if ch is None:
+            self.unrouted += 1
+            logger.debug(f"[{self.__class__.__name__}] no channel for {key=}; dropped: {envelope.message=}")
+            return
+        ch._deliver(envelope)
+
+    def _route_gap(self, gap: GapEvent) -> None:
+        ch = self.channels.get(gap.session)
+        if ch is not None:
+            ch._notify_gap(gap)
+
+    def _acquire(self) -> None:
+        with self._lock:
+            if self._refs == 0:
+                self.receiver.__enter__()
+            self._refs += 1
+
+    def _release(self) -> None:
+        with self._lock:
+            self._refs -= 1
+            if self._refs == 0:
+                self.receiver.__exit__(None, None, None)
+
+    def _async_lock(self) -> "asyncio.Lock":
+        import asyncio
+
+        if self._alock is None:
+            self._alock = asyncio.Lock()
+        return self._alock
+
+    async def _aacquire(self) -> None:
+        if not hasattr(self.receiver, "__aenter__"):
+            self._acquire()
+            return
+        # 最初のチャンネルがレシーバーを起動している間に開かれたチャンネルは、ソケットの準備ができるまで待つ
+        async with self._async_lock():
+            if self._refs == 0:
+                await self.receiver.__aenter__()
+            self._refs += 1
+
+    async def _arelease(self) -> None:
+        if not hasattr(self.receiver, "__aexit__"):
+            self._release()
+            return
+        async with self._async_lock():
+            self._refs -= 1
+            if self._refs == 0:
+                await self.receiver.__aexit__(None, None, None)
@@ -1,2 +1,2 @@
 from .base import Sender
-from .claude import ClaudeSender
+from .claude import ClaudeSender, SINK_PROMPT, SINK_MANY_PROMPT
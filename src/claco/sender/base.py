@@ -1,10 +1,12 @@
 import os
+import json
 import subprocess
 from subprocess import PIPE
-import asyncio
+import time
+import threading
+import weakref
 from locale import getdefaultlocale
 import re
-import importlib.resources
 import logging
 from typing import Literal
 
@@ -19,6 +21,9 @@ def _decode(x: bytes) -> str:
         return str(x)[2:-1]
 
 
+_HANDLE_PATTERN = re.compile(r"handle\s*=\s*([0-9A-Fa-f]+)")
+
+
 def _get_error_message(out: str, target: str) -> str:
     err_msg = out
 
@@ -26,8 +31,7 @@ def _get_error_message(out: str, target: str) -> str:
         err_msg = f"Process '{target}' was not found."
     elif f"Window handle is invalid." in out:
         err_msg = f"Target window is minimized."
-        r = re.compile(r"handle\s*=\s*([0-9A-Fa-f]+)")
-        if handles := r.findall(out):
+        if handles := _HANDLE_PATTERN.findall(out):
             err_msg += "\nfound window handles:"
             for handle in handles:
                 err_msg += f"\n  handle = {handle}"
@@ -35,49 +39,403 @@ def _get_error_message(out: str, target: str) -> str:
     return err_msg
 
 
+def _write_paste_file(text: str) -> str:
+    # 貼り付けるテキストを UTF-8 で一時ファイルに書き出し、そのパスを返す
+    # tempfile は import が遅いので、必要になった時に読み込む
+    import tempfile
+
+    fd, path = tempfile.mkstemp(prefix="claco-paste-", suffix=".txt")
+    with os.fdopen(fd, "w", encoding="utf-8", newline="") as f:
+        f.write(text)
+    return path
+
+
+def _remove_files(paths: list[str]) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            logger.warning(f"failed to remove {path!r}")
+
+
+class _Worker:
+    # `{exe_path} --serve` で起動した常駐プロセスにコマンドを送る
+    #
+    # プロトコル（1行1 JSON、UTF-8）
+    #   request:  {"args": [target, ...]}          -- 1回分の `{exe_path} target ...` の引数
+    #   response: {"returncode": 0, "stdout": "...", "stderr": "..."}
+
+    def __init__(self, exe_path: str):
+        self.exe_path = exe_path
+        self.proc: subprocess.Popen | None = None
+        self.lock = threading.Lock()
+
+    def _start(self):
+        logger.debug(f"[{self.__class__.__name__}] start worker: {self.exe_path}")
+        self.proc = subprocess.Popen([self.exe_path, "--serve"], stdin=PIPE, stdout=PIPE)
+
+    def _kill(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=1.0)
+        except Exception:
+            logger.exception(f"[{self.__class__.__name__}] failed to kill worker")
+        self.proc = None
+
+    def abort(self) -> None:
+        # run の実行中に別のスレッドから呼んでよい。プロセスを終了させて、応答を待っている run を起こす
+        # self.proc の後始末は、ロックを持っている run 側で行う
+        proc = self.proc
+        if proc is None:
+            return
+        try:
+            proc.kill()
+        except OSError:
+            pass
+
+    def run(self, args: list[str], timeout: float | None = None) -> tuple[int, str, str]:
+        request = (json.dumps({"args": args}, ensure_ascii=False) + "\n").encode("utf-8")
+
+        with self.lock:
+            # 書き込みの時点でプロセスが落ちていた場合は、まだコマンドが実行されていないので
+            # 再起動して一度だけ送り直す
+            for retry in (True, False):
+                if self.proc is None or self.proc.poll() is not None:
+                    self._start()
+                try:
+                    self.proc.stdin.write(request)
+                    self.proc.stdin.flush()
+                    break
+                except OSError:
+                    logger.warning(f"[{self.__class__.__name__}] worker is not alive; restarting...")
+                    self._kill()
+                    if not retry:
+                        raise
+
+            # readline には期限を指定できないので、期限を過ぎたらプロセスを終了させて起こす
+            timer = None
+            if timeout is not None:
+                deadline = time.monotonic() + timeout
+                timer = threading.Timer(timeout, self.abort)
+                timer.daemon = True
+                timer.start()
+            try:
+                line = self.proc.stdout.readline()
+            finally:
+                if timer is not None:
+                    timer.cancel()
+
+            if not line and timer is not None and time.monotonic() >= deadline:
+                logger.error(f"[{self.__class__.__name__}] worker did not respond in {timeout}s; restarting...")
+                self._kill()
+                return -1, "", f"helper timed out after {timeout}s"
+
+            # コマンドを送った後に落ちた場合は、実行されたかどうか分からないので送り直さない
+            # 次回の送信時に再起動する
+            try:
+                response = json.loads(line)
+                return response["returncode"], response.get("stdout", ""), response.get("stderr", "")
+            except (ValueError, KeyError, TypeError):
+                logger.error(f"[{self.__class__.__name__}] invalid response from worker: {line!r}")
+                self._kill()
+                return -1, "", f"worker crashed or returned an invalid response: {line!r}"
+
+    def close(self):
+        with self.lock:
+            if self.proc is None:
+                return
+            try:
+                # stdin を閉じると worker は終了する
+                self.proc.stdin.close()
+                self.proc.wait(timeout=1.0)
+            except Exception:
+                self._kill()
+            self.proc = None
+
+
+# asend/asends のキー入力を、Sender をまたいでプロセス全体で1つずつ実行するためのロック
+# ヘルパーはフォーカスしたウィンドウにキーを送るので、別のウィンドウへの送信でも並行するとキー入力が混ざる
+# asyncio.Lock は作成したイベントループでしか使えないので、ループごとに作る
+_typing_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = weakref.WeakKeyDictionary()
+
+
+def _typing_lock() -> "asyncio.Lock":
+    import asyncio
+
+    loop = asyncio.get_running_loop()
+    lock = _typing_locks.get(loop)
+    if lock is None:
+        lock = _typing_locks[loop] = asyncio.Lock()
+    return lock
+
+
 class Sender:
-    def __init__(self, exe_path: str | None = None):
+    def __init__(
+        self,
+        exe_path: str | None = None,
+        persistent: bool = False,
+        paste_threshold: int | None = None,
+        cache_handles: bool = False,
+        retries: int = 1,
+        retry_backoff: float = 0.1,
+        timeout: float | None = None,
+        max_concurrency: int = 4,
+        parallel_windows: bool = False,
+    ):
+        """
+        Args:
+            exe_path: ターゲットにキー入力を送るヘルパーのパス
+            persistent: True の場合、ヘルパーを `--serve` で常駐させて送信のたびに起動しない
+            paste_threshold: sends で、この文字数以上のテキストはキー入力の代わりに一時ファイル経由で貼り付ける
+                （`--paste-file PATH`）。コマンドラインの長さの制限を受けず、長さによらずほぼ一定の時間で送れる
+                None の場合は常にキー入力
+            cache_handles: True の場合、ターゲットのウィンドウハンドルを最初に一度だけ調べ（`--resolve`）、
+                以降の送信ではハンドルを直接渡して（`--handle`）ヘルパーがウィンドウを探さなくて済むようにする
+            retries: キャッシュしたハンドルが "Window handle is invalid." で使えなかった場合に、調べ直して送り直す回数
+            retry_backoff: 最初に送り直すまでの待ち時間 [s]。送り直すたびに倍にする
+            timeout: ヘルパーの1回の実行の制限時間 [s]。超えた場合はヘルパーを終了させて失敗を返す
+            max_concurrency: parallel_windows が True の場合に、asend/asends で同時に実行するヘルパーの最大数
+            parallel_windows: True の場合、asend/asends で別のウィンドウへの送信を並行して実行する
+                False の場合は、キー入力が混ざらないようにプロセス全体で1つずつ実行する
+                ウィンドウを前面に出さずにキーを送れるヘルパーを使う場合だけ指定する
+                同じウィンドウへの送信は常に1つずつ実行する
+        """
         if exe_path is None:
+            # importlib.resources は import が遅いので、必要になった時に読み込む
+            import importlib.resources
+
             exe_path = str(importlib.resources.files("claco.bin").joinpath("ClaudeTools.Cui.exe"))
         self.exe_path = exe_path
-        logger.debug(f"[{self.__class__.__name__}] {exe_path=}")
+        self.persistent = persistent
+        self.paste_threshold = paste_threshold
+        self.cache_handles = cache_handles
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        # (target, window_title) -> ウィンドウハンドル
+        self._handles: dict[tuple[str, str | None], str] = {}
+        self._resolve_supported = True
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.parallel_windows = parallel_windows
+        # asend/asends で使う同期プリミティブ。作成したイベントループでしか使えないので、ループごとに作り直す
+        self._loop = None
+        self._semaphore = None
+        self._target_locks: dict[tuple[str, str | None], "asyncio.Lock"] = {}
+        self._worker = _Worker(exe_path) if persistent else None
+        logger.debug(f"[{self.__class__.__name__}] {exe_path=} {persistent=}")
         if not os.path.exists(exe_path):
             logger.warning(f"[{self.__class__.__name__}] {exe_path!r} does not exist; may not work properly")
 
-    def send(
-        self,
-        target: str,
-        message: str,
-        raw: bool = False,
-        window_title: str | None = None,
-    ) -> tuple[Literal[True], None] | tuple[Literal[False], str]:
-        # execute command `{exe_path} {message}`
-        logger.debug(f"[{self.__class__.__name__}] send: {target=} {window_title=} {message=} {raw=}")
-
-        args = [self.exe_path, target]
+    def _run(self, args: list[str]) -> tuple[int, str, str]:
+        # ヘルパーを実行して (returncode, stdout, stderr) を返す
+        if self._worker is not None:
+            return self._worker.run(args[1:], self.timeout)
+
+        try:
+            x = subprocess.run(args, shell=False, stdout=PIPE, stderr=PIPE, timeout=self.timeout)
+        except subprocess.TimeoutExpired:
+            return -1, "", f"helper timed out after {self.timeout}s"
+        return x.returncode, _decode(x.stdout), _decode(x.stderr)
+
+    async def _arun(self, args: list[str]) -> tuple[int, str, str]:
+        # _run の非同期版。イベントループを止めずにヘルパーを実行する
+        import asyncio
+
+        async with self._async_semaphore():
+            if self._worker is not None:
+                # 常駐させたヘルパーとのやりとりはブロックするので、別スレッドで行う（期限は _Worker.run が守る）
+                # ヘルパーは他のウィンドウへの送信と共有しているので、キャンセルされても終了させない
+                return await asyncio.to_thread(self._worker.run, args[1:], self.timeout)
+
+            proc = await asyncio.create_subprocess_exec(*args, stdout=PIPE, stderr=PIPE)
+            try:
+                out, err = await asyncio.wait_for(proc.communicate(), self.timeout)
+            except TimeoutError:
+                proc.kill()
+                await proc.wait()
+                return -1, "", f"helper timed out after {self.timeout}s"
+            except BaseException:
+                # キャンセルされた場合もヘルパーを残さない
+                if proc.returncode is None:
+                    proc.kill()
+                raise
+            return proc.returncode, _decode(out), _decode(err)
+
+    def _bind_loop(self) -> None:
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._target_locks = {}
+
+    def _async_semaphore(self) -> "asyncio.Semaphore":
+        self._bind_loop()
+        return self._semaphore
+
+    def _target_lock(self, target: str, window_title: str | None) -> "asyncio.Lock":
+        # 送信を1つずつ実行するためのロック
+        # parallel_windows が False の場合はプロセス全体で、True の場合は同じウィンドウへの送信だけを1つずつにする
+        import asyncio
+
+        if not self.parallel_windows:
+            return _typing_lock()
+
+        self._bind_loop()
+        key = (target, window_title)
+        lock = self._target_locks.get(key)
+        if lock is None:
+            lock = self._target_locks[key] = asyncio.Lock()
+        return lock
+
+    def _resolve_args(self, target: str, window_title: str | None) -> list[str] | None:
+        # ウィンドウハンドルを調べるヘルパーの引数。キャッシュ済みか、調べない場合は None
+        if not self.cache_handles or not self._resolve_supported or (target, window_title) in self._handles:
+            return None
+        args = [self.exe_path, "--resolve", target]
         if window_title:
             args.append("--window")
             args.append(window_title)
-        if raw:
-            args.append("--raw")
-        args.append(message)
-        x = subprocess.run(args, shell=False, stdout=PIPE, stderr=PIPE)
-
-        e = x.returncode
+        return args
+
+    def _store_handle(self, target: str, window_title: str | None, e: int, out: str) -> None:
+        # `--resolve` の結果からウィンドウハンドルをキャッシュする
+        handles = _HANDLE_PATTERN.findall(out)
+        if e == 0 and len(handles) == 1:
+            logger.debug(f"[{self.__class__.__name__}] resolved {target=} {window_title=}: handle={handles[0]}")
+            self._handles[(target, window_title)] = handles[0]
+            return
+
+        if e != 0 and f"Process '{target}' was not found." not in out and "Window handle is invalid." not in out:
+            # ヘルパーが `--resolve` に対応していない。以降はハンドルを使わずに送る
+            logger.warning(f"[{self.__class__.__name__}] helper does not support --resolve; disable handle cache")
+            self._resolve_supported = False
+
+    def invalidate(self, target: str | None = None, window_title: str | None = None) -> None:
+        """
+        キャッシュしたウィンドウハンドルを捨て、次の送信で調べ直す
+
+        Args:
+            target: 対象のターゲット。None の場合はすべて
+            window_title: 対象のウィンドウ
+        """
+        if target is None:
+            self._handles.clear()
+        else:
+            self._handles.pop((target, window_title), None)
+
+    def _should_retry(
+        self, target: str, window_title: str | None, e: int, out: str, attempt: int, stale: bool
+    ) -> float | None:
+        # 前の送信でキャッシュしたハンドルが無効になっていた場合は、キャッシュを捨てて待ってから調べ直して送り直す
+        # キーを送る前に失敗しているので、送り直しても二重に入力されることはない
+        # 調べたばかりのハンドルや、ハンドルを使わずに送った場合の失敗はウィンドウの最小化なので、送り直さない
+        if e == 0 or not stale or "Window handle is invalid." not in out or attempt >= self.retries:
+            return None
+        self.invalidate(target, window_title)
+        delay = self.retry_backoff * (2**attempt)
+        logger.warning(f"[{self.__class__.__name__}] window handle is invalid; retrying in {delay:.2f}s")
+        return delay
+
+    def _execute(
+        self, target: str, messages: list[tuple[str, bool]], window_title: str | None
+    ) -> tuple[int, str, str]:
+        attempt = 0
+        while True:
+            # 前の送信でキャッシュしたハンドルを使うかどうか
+            stale = (target, window_title) in self._handles
+            if args := self._resolve_args(target, window_title):
+                self._store_handle(target, window_title, *self._run(args)[:2])
+
+            args, paths = self._build_args(target, messages, window_title)
+            try:
+                e, out, err = self._run(args)
+            finally:
+                _remove_files(paths)
+
+            delay = self._should_retry(target, window_title, e, out, attempt, stale)
+            if delay is None:
+                return e, out, err
+            time.sleep(delay)
+            attempt += 1
+
+    async def _aexecute(
+        self, target: str, messages: list[tuple[str, bool]], window_title: str | None
+    ) -> tuple[int, str, str]:
+        # _execute の非同期版
+        import asyncio
+
+        async with self._target_lock(target, window_title):
+            attempt = 0
+            while True:
+                stale = (target, window_title) in self._handles
+                if args := self._resolve_args(target, window_title):
+                    self._store_handle(target, window_title, *(await self._arun(args))[:2])
+
+                args, paths = self._build_args(target, messages, window_title)
+                try:
+                    e, out, err = await self._arun(args)
+                finally:
+                    _remove_files(paths)
+
+                delay = self._should_retry(target, window_title, e, out, attempt, stale)
+                if delay is None:
+                    return e, out, err
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def _build_args(
+        self, target: str, messages: list[tuple[str, bool]], window_title: str | None
+    ) -> tuple[list[str], list[str]]:
+        # sends に渡す (テキスト, raw) のリストから、ヘルパーの引数と、貼り付けに使う一時ファイルのリストを作る
+        args = [self.exe_path, target]
+        if handle := self._handles.get((target, window_title)):
+            # ウィンドウを探さずに、キャッシュしたハンドルに直接送る
+            args.append("--handle")
+            args.append(handle)
+        elif window_title:
+            args.append("--window")
+            args.append(window_title)
 
+        paths = []
+        try:
+            for text, raw in messages:
+                if raw:
+                    args.append("--raw")
+                    args.append(text)
+                elif self.paste_threshold is not None and len(text) >= self.paste_threshold:
+                    paths.append(_write_paste_file(text))
+                    args.append("--paste-file")
+                    args.append(paths[-1])
+                else:
+                    args.append(text)
+        except:
+            _remove_files(paths)
+            raise
+        return args, paths
+
+    def close(self):
+        # 常駐させたヘルパーを終了する
+        if self._worker is not None:
+            self._worker.close()
+
+    def _result(
+        self, target: str, e: int, out: str, err: str
+    ) -> tuple[Literal[True], None] | tuple[Literal[False], str]:
         if e == 0:
             return True, None
 
-        out, err = _decode(x.stdout), _decode(x.stderr)
-
         logger.debug(f"[{self.__class__.__name__}] stdout: {out}")
-        logger.debug(f"[{self.__class__.__name__}] stderr: {out}")
+        logger.debug(f"[{self.__class__.__name__}] stderr: {err}")
 
-        err_msg = _get_error_message(out, target)
+        err_msg = _get_error_message(out or err, target)
 
         return False, err_msg
 
-    async def asend(
+    def send(
         self,
         target: str,
         message: str,
@@ -85,32 +443,23 @@ class Sender:
         window_title: str | None = None,
     ) -> tuple[Literal[True], None] | tuple[Literal[False], str]:
         # execute command `{exe_path} {message}`
-        logger.debug(f"[{self.__class__.__name__}] asend: {target=} {message=} {raw=}")
-
-        args = [self.exe_path, target]
-        if window_title:
-            args.append("--window")
-            args.append(window_title)
-        if raw:
-            args.append("--raw")
-        args.append(message)
-        x = await asyncio.subprocess.create_subprocess_shell(args, shell=False, stdout=PIPE, stderr=PIPE)
-
-        out, err = await x.communicate()
-
-        e = x.returncode
-
-        if e == 0:
-            return True, None
-
-        out, err = _decode(x.stdout), _decode(x.stderr)
+        logger.debug(f"[{self.__class__.__name__}] send: {target=} {window_title=} {message=} {raw=}")
 
-        logger.debug(f"[{self.__class__.__name__}] stdout: {out}")
-        logger.debug(f"[{self.__class__.__name__}] stderr: {out}")
+        e, out, err = self._execute(target, [(message, raw)], window_title)
+        return self._result(target, e, out, err)
 
-        err_msg = _get_error_message(out, target)
+    async def asend(
+        self,
+        target: str,
+        message: str,
+        raw: bool = False,
+        window_title: str | None = None,
+    ) -> tuple[Literal[True], None] | tuple[Literal[False], str]:
+        # execute command `{exe_path} {message}`
+        logger.debug(f"[{self.__class__.__name__}] asend: {target=} {message=} {raw=}")
 
-        return False, err_msg
+        e, out, err = await self._aexecute(target, [(message, raw)], window_title)
+        return self._result(target, e, out, err)
 
     def sends(
         self,
@@ -121,31 +470,8 @@ class Sender:
         # execute command `{exe_path} {message}`
         logger.debug(f"[{self.__class__.__name__}] send: {target=} {messages=}")
 
-        args = [self.exe_path, target]
-        if window_title:
-            args.append("--window")
-            args.append(window_title)
-        for message in messages:
-            if message[1]:
-                args.append("--raw")
-            args.append(message[0])
-
-        x = subprocess.run(args, shell=False, stdout=PIPE, stderr=PIPE)
-
-        e = x.returncode
-
-        if e == 0:
-            out, err = _decode(x.stdout), _decode(x.stderr)
-            return True, None
-
-        out, err = _decode(x.stdout), _decode(x.stderr)
-
-        logger.debug(f"[{self.__class__.__name__}] stdout: {out}")
-        logger.debug(f"[{self.__class__.__name__}] stderr: {out}")
-
-        err_msg = _get_error_message(out, target)
-
-        return False, err_msg
+        e, out, err = self._execute(target, messages, window_title)
+        return self._result(target, e, out, err)
 
     async def asends(
         self,
@@ -156,29 +482,5 @@ class Sender:
         # execute command `{exe_path} {message}`
         logger.debug(f"[{self.__class__.__name__}] send: {target=} {messages=}")
 
-        args = [self.exe_path, target]
-        if window_title:
-            args.append("--window")
-            args.append(window_title)
-        for message in messages:
-            if message[1]:
-                args.append("--raw")
-            args.append(message[0])
-
-        x = await asyncio.subprocess.create_subprocess_shell(args, shell=False, stdout=PIPE, stderr=PIPE)
-
-        out, err = await x.communicate()
-
-        e = x.returncode
-
-        if e == 0:
-            return True, None
-
-        out, err = _decode(x.stdout), _decode(x.stderr)
-
-        logger.debug(f"[{self.__class__.__name__}] stdout: {out}")
-        logger.debug(f"[{self.__class__.__name__}] stderr: {out}")
-
-        err_msg = _get_error_message(out, target)
-
-        return False, err_msg
+        e, out, err = await self._aexecute(target, messages, window_title)
+        return self._result(target, e, out, err)
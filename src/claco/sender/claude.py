@@ -10,90 +10,176 @@ logger = logging.getLogger(__name__)
 _IGNORE = object()
 
 
+# 一文ごとに sink ツールを呼び出させるプロンプト
+SINK_PROMPT = '返事は Sink ツールを使用して書き出してください。Sink ツールは一文ごとに区切って呼び出してください。段落の区切りでは "</>" とだけ書き出してください。すべての文章を Sink ツールで書き出し終わったら、最後に Sink ツールで <exit> とだけ書き出してください。'
+
+# 複数の文をまとめて sink_many ツールに渡させるプロンプト
+# ツールの呼び出し回数が減るので、返事を受け取り終わるまでの時間が短くなる
+SINK_MANY_PROMPT = '返事は sink_many ツールを使用して書き出してください。sink_many ツールには一文ごとに区切った文のリストを渡してください。ツールの呼び出し回数ができるだけ少なくなるよう、一段落程度の文をまとめて一度に渡してください。段落の区切りでは "</>" とだけ書いた要素を入れてください。すべての文章を書き出し終わったら、最後の要素として <exit> とだけ書いた要素を入れてください。'
+
+
+# paste_threshold の目安。これ以上の文字数のメッセージは、キー入力の代わりにヘルパーの `--paste-file` で貼り付ける
+# 同梱の ClaudeTools.Cui.exe は `--paste-file` に対応していないので、デフォルトでは使わない
+PASTE_THRESHOLD = 2000
+
+# セッションモードで sink_prompt に付け加え、以降のターンでも同じように書き出させるプロンプト
+SESSION_PROMPT = "この会話では、以降の返事もすべて同じように書き出してください。"
+
+
 class ClaudeSender(Sender):
     def __init__(
         self,
         exe_path: str | None = None,
-        sink_prompt='返事は Sink ツールを使用して書き出してください。Sink ツールは一文ごとに区切って呼び出してください。段落の区切りでは "</>" とだけ書き出してください。すべての文章を Sink ツールで書き出し終わったら、最後に Sink ツールで <exit> とだけ書き出してください。',
+        sink_prompt=SINK_PROMPT,
+        persistent: bool = False,
+        session: bool = False,
+        paste_threshold: int | None = None,
+        cache_handles: bool = False,
+        timeout: float | None = None,
+        max_concurrency: int = 4,
+        parallel_windows: bool = False,
     ):
-        super().__init__(exe_path)
-        logger.debug(f"[{self.__class__.__name__}] {exe_path=} {sink_prompt=}")
+        """
+        Args:
+            exe_path: ターゲットにキー入力を送るヘルパーのパス
+            sink_prompt: メッセージの後ろに付け加える、Sink ツールの使い方の指示
+            persistent: True の場合、ヘルパーを `--serve` で常駐させて送信のたびに起動しない
+            session: True の場合、sink_prompt はウィンドウごとに最初の送信（と clear の後）にだけ付け加える
+                2回目以降はメッセージだけを送るので、入力するキーが減り、会話のコンテキストも膨らまない
+            paste_threshold: この文字数以上のメッセージは、1文字ずつ入力する代わりに一時ファイル経由で貼り付ける
+                None の場合は常にキー入力。`--paste-file` に対応したヘルパーを使う場合だけ指定する（PASTE_THRESHOLD を参照）
+            cache_handles: True の場合、ウィンドウハンドルを一度だけ調べてキャッシュする
+                `--resolve`/`--handle` に対応したヘルパーを使う場合だけ指定する（同梱のヘルパーは対応していない）
+            timeout: ヘルパーの1回の実行の制限時間 [s]
+            max_concurrency: parallel_windows が True の場合に、asend で同時に実行するヘルパーの最大数
+            parallel_windows: True の場合、asend で別のウィンドウへの送信を並行して実行する
+                False の場合はキー入力が混ざらないように、プロセス全体で1つずつ実行する
+        """
+        super().__init__(
+            exe_path,
+            persistent,
+            paste_threshold,
+            cache_handles,
+            timeout=timeout,
+            max_concurrency=max_concurrency,
+            parallel_windows=parallel_windows,
+        )
+        logger.debug(f"[{self.__class__.__name__}] {exe_path=} {sink_prompt=} {persistent=} {session=}")
         self.sink_prompt = sink_prompt
-
-    def __create_send_argss(self, message: str):
-        message = message.splitlines()
-
+        self.session = session
+        # セッションモードで、sink_prompt を送り済みの (target, window_title)
+        self._primed: set[tuple[str, str | None]] = set()
+
+    def primed(self, target: str, window_title: str | None = None) -> bool:
+        # sink_prompt を付けずに送ってよいかどうか
+        return self.session and (target, window_title) in self._primed
+
+    def reprime(self, target: str | None = None, window_title: str | None = None) -> None:
+        """
+        次の送信で sink_prompt を付け加え直す（セッションモードのみ意味がある）
+        新しい会話を始めた場合や、モデルが指示を忘れた場合に呼ぶ
+
+        Args:
+            target: 対象のターゲット。None の場合はすべて
+            window_title: 対象のウィンドウ
+        """
+        logger.debug(f"[{self.__class__.__name__}] reprime {target=} {window_title=}")
+        if target is None:
+            self._primed.clear()
+        else:
+            self._primed.discard((target, window_title))
+
+    def __create_send_argss(self, message: str, prime: bool = True):
         args = []
-        for i, line in enumerate(message):
-            args.append((line.strip(), False))
-            if i < len(message) - 1:
-                args.append(("+{ENTER}", True))
-
-        args.append(("+{ENTER}+{ENTER}", True))
-        args.append((self.sink_prompt, False))
+        if self.paste_threshold is not None and len(message.strip()) >= self.paste_threshold:
+            # 改行を含めてそのまま貼り付けるので、行ごとに +{ENTER} を入力しなくてよい
+            args.append((message.strip(), False))
+        else:
+            message = message.splitlines()
+            for i, line in enumerate(message):
+                args.append((line.strip(), False))
+                if i < len(message) - 1:
+                    args.append(("+{ENTER}", True))
+
+        if prime:
+            args.append(("+{ENTER}+{ENTER}", True))
+            if self.session:
+                args.append((self.sink_prompt + SESSION_PROMPT, False))
+            else:
+                args.append((self.sink_prompt, False))
         args.append(("{ENTER}", True))
         return args
 
     @override
-    def send(self, target: str, message: str, raw=_IGNORE):
-        logger.debug(f"[{self.__class__.__name__}] send: {target=} {message=} {raw=}")
+    def send(self, target: str, message: str, raw=_IGNORE, window_title: str | None = None):
+        logger.debug(f"[{self.__class__.__name__}] send: {target=} {window_title=} {message=} {raw=}")
 
-        args = self.__create_send_argss(message)
-        h, e = super().sends(target, args)
+        prime = not self.primed(target, window_title)
+        args = self.__create_send_argss(message, prime)
+        h, e = super().sends(target, args, window_title=window_title)
         if not h:
             logger.error(f"[{self.__class__.__name__}] failed to send message: {e}")
             return False, e
 
+        if prime and self.session:
+            self._primed.add((target, window_title))
         return True, None
 
     @override
-    async def asend(self, target: str, message: str, raw=_IGNORE):
-        logger.debug(f"[{self.__class__.__name__}] asend: {target=} {message=} {raw=}")
+    async def asend(self, target: str, message: str, raw=_IGNORE, window_title: str | None = None):
+        logger.debug(f"[{self.__class__.__name__}] asend: {target=} {window_title=} {message=} {raw=}")
 
-        args = self.__create_send_argss(message)
-        h, e = await super().asends(target, args)
+        prime = not self.primed(target, window_title)
+        args = self.__create_send_argss(message, prime)
+        h, e = await super().asends(target, args, window_title=window_title)
         if not h:
             logger.error(f"[{self.__class__.__name__}] failed to send message: {e}")
             return False, e
 
+        if prime and self.session:
+            self._primed.add((target, window_title))
         return True, None
 
-    def send_clear(self, target: str):
-        logger.debug(f"[{self.__class__.__name__}] send_clear {target=}")
+    def send_clear(self, target: str, window_title: str | None = None):
+        logger.debug(f"[{self.__class__.__name__}] send_clear {target=} {window_title=}")
+        # clear の後は sink_prompt を送り直す
+        self.reprime(target, window_title)
 
         # ^A does not work
-        h, e = super().send(target, "_^{END}+^{HOME}{DEL}", raw=True)
+        h, e = super().send(target, "_^{END}+^{HOME}{DEL}", raw=True, window_title=window_title)
         if not h:
             logger.error(f"[{self.__class__.__name__}] failed to send message: {e}")
             return False, e
 
         return True, None
 
-    async def asend_clear(self, target: str):
-        logger.debug(f"[{self.__class__.__name__}] asend_clear {target=}")
+    async def asend_clear(self, target: str, window_title: str | None = None):
+        logger.debug(f"[{self.__class__.__name__}] asend_clear {target=} {window_title=}")
+        # clear の後は sink_prompt を送り直す
+        self.reprime(target, window_title)
 
         # ^A does not work
-        h, e = await super().asend(target, "_^{END}+^{HOME}{DEL}", raw=True)
+        h, e = await super().asend(target, "_^{END}+^{HOME}{DEL}", raw=True, window_title=window_title)
         if not h:
             logger.error(f"[{self.__class__.__name__}] failed to send message: {e}")
             return False, e
 
         return True, None
 
-    def send_cancel(self, target: str):
-        logger.debug(f"[{self.__class__.__name__}] send_cancel {target=}")
+    def send_cancel(self, target: str, window_title: str | None = None):
+        logger.debug(f"[{self.__class__.__name__}] send_cancel {target=} {window_title=}")
 
-        h, e = super().send(target, "_^{BS}{ESC}", raw=True)
+        h, e = super().send(target, "_^{BS}{ESC}", raw=True, window_title=window_title)
         if not h:
             logger.error(f"[{self.__class__.__name__}] failed to send message: {e}")
             return False, e
 
         return True, None
 
-    async def asend_cancel(self, target: str):
-        logger.debug(f"[{self.__class__.__name__}] asend_cancel {target=}")
+    async def asend_cancel(self, target: str, window_title: str | None = None):
+        logger.debug(f"[{self.__class__.__name__}] asend_cancel {target=} {window_title=}")
 
-        h, e = await super().asend(target, "_^{BS}{ESC}", raw=True)
+        h, e = await super().asend(target, "_^{BS}{ESC}", raw=True, window_title=window_title)
         if not h:
             logger.error(f"[{self.__class__.__name__}] failed to send message: {e}")
             return False, e
@@ -0,0 +1,184 @@
+"""
+Communicator.communicate の各段階にかかった時間を記録する
+"""
+
+import math
+import time
+import threading
+from collections import deque
+from dataclasses import dataclass, field
+
+
+@dataclass
+class CallStats:
+    """
+    1回の communicate で記録した時刻（time.perf_counter）
+    """
+
+    send_start: float
+    send_end: float | None = None
+    # 各メッセージを consumer に渡した時刻
+    messages: list[float] = field(default_factory=list)
+    # 各メッセージが届くまでキューで待った時間 [s]
+    waits: list[float] = field(default_factory=list)
+    # consumer が各メッセージの処理に使った時間 [s]
+    consumer: list[float] = field(default_factory=list)
+    # <exit> を受け取った時刻。途中で受信をやめた場合は None
+    exit: float | None = None
+
+    @property
+    def send_time(self) -> float | None:
+        # ヘルパーでの送信にかかった時間
+        if self.send_end is None:
+            return None
+        return self.send_end - self.send_start
+
+    @property
+    def first_message_latency(self) -> float | None:
+        # 送信し終わってから最初のメッセージが届くまでの時間
+        if self.send_end is None or not self.messages:
+            return None
+        return self.messages[0] - self.send_end
+
+    @property
+    def gaps(self) -> list[float]:
+        # メッセージ同士の間隔
+        return [b - a for a, b in zip(self.messages, self.messages[1:])]
+
+    @property
+    def total(self) -> float | None:
+        # 送信を始めてから <exit> を受け取るまでの時間
+        if self.exit is None:
+            return None
+        return self.exit - self.send_start
+
+    @property
+    def completed(self) -> bool:
+        return self.exit is not None
+
+
+class Histogram:
+    """
+    対数スケールのバケットで値の分布を数えるヒストグラム
+    メモリ使用量は記録した値の数によらず一定
+    """
+
+    def __init__(self, min_value: float = 1e-6, max_value: float = 1e3, resolution: float = 0.05):
+        """
+        Args:
+            min_value: 区別する最小の値。これより小さい値は min_value として数える
+            max_value: 区別する最大の値。これより大きい値は max_value として数える
+            resolution: バケットの相対的な幅
+        """
+        self.min_value = min_value
+        self.max_value = max_value
+        self._log_base = math.log1p(resolution)
+        self._buckets = [0] * (self._index(max_value) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def _index(self, value: float) -> int:
+        value = min(max(value, self.min_value), self.max_value)
+        return int(math.log(value / self.min_value) / self._log_base)
+
+    def record(self, value: float) -> None:
+        self._buckets[self._index(value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def percentile(self, p: float) -> float | None:
+        """
+        p パーセンタイルの値を返す（バケットの上端の値）
+
+        Args:
+            p: 0 から 100 までの値
+        """
+        if self.count == 0:
+            return None
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for i, n in enumerate(self._buckets):
+            seen += n
+            if seen >= max(rank, 1):
+                return min(self.min_value * math.exp(self._log_base * (i + 1)), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float | None:
+        if self.count == 0:
+            return None
+        return self.sum / self.count
+
+    def summary(self) -> dict[str, float | int | None]:
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "max": self.max if self.count else None,
+        }
+
+
+class LatencyRecorder:
+    """
+    CallStats を集計し、段階ごとのヒストグラムを保持する
+
+    段階:
+        send: ヘルパーでの送信
+        first_message: 送信し終わってから最初のメッセージが届くまで
+        wait: 各メッセージが届くまでキューで待った時間
+        gap: メッセージ同士の間隔
+        consumer: consumer が各メッセージの処理に使った時間
+        total: 送信を始めてから <exit> を受け取るまで
+    """
+
+    STAGES = ("send", "first_message", "wait", "gap", "consumer", "total")
+
+    def __init__(self, keep_calls: int = 100):
+        """
+        Args:
+            keep_calls: 保持しておく直近の CallStats の数
+        """
+        self.histograms = {stage: Histogram() for stage in self.STAGES}
+        self.calls: deque[CallStats] = deque(maxlen=keep_calls)
+        self.incomplete = 0
+        self._lock = threading.Lock()
+
+    def begin(self) -> CallStats:
+        return CallStats(send_start=time.perf_counter())
+
+    def record(self, call: CallStats) -> None:
+        with self._lock:
+            self.calls.append(call)
+            h = self.histograms
+            if call.send_time is not None:
+                h["send"].record(call.send_time)
+            if call.first_message_latency is not None:
+                h["first_message"].record(call.first_message_latency)
+            for x in call.waits:
+                h["wait"].record(x)
+            for x in call.gaps:
+                h["gap"].record(x)
+            for x in call.consumer:
+                h["consumer"].record(x)
+            if call.total is not None:
+                h["total"].record(call.total)
+            else:
+                self.incomplete += 1
+
+    @property
+    def last(self) -> CallStats | None:
+        with self._lock:
+            return self.calls[-1] if self.calls else None
+
+    def percentile(self, stage: str, p: float) -> float | None:
+        with self._lock:
+            return self.histograms[stage].percentile(p)
+
+    def summary(self) -> dict[str, dict[str, float | int | None]]:
+        # 段階ごとの count/mean/p50/p95/p99/max [s]
+        with self._lock:
+            return {stage: h.summary() for stage, h in self.histograms.items()}
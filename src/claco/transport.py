@@ -0,0 +1,381 @@
+"""
+Sink サーバとレシーバーの間でデータグラムを運ぶトランスポート
+_server.py（送信側）と receiver.py（受信側）の両方から使う
+
+    udp: UDP（デフォルト）。別のホストとも通信できる
+    unix: Unix ドメインソケット（AF_UNIX, SOCK_DGRAM）。同じホスト内でのみ使え、IP スタックを通らず取りこぼしも無い
+    tcp: TCP。データグラムの代わりに、長さを前に付けたレコードを1本の接続で送る。
+        別のホストとも通信でき、取りこぼしもデータグラムの大きさの制限も無い
+
+環境変数:
+    CLACO_TRANSPORT: udp, unix または tcp（デフォルトは udp）
+    CLACO_UDP_ADDR, CLACO_UDP_PORT: udp の場合の宛先
+    CLACO_UNIX_PATH: unix の場合のソケットファイルのパス
+    CLACO_TCP_ADDR, CLACO_TCP_PORT: tcp の場合の宛先。省略した場合は CLACO_UDP_ADDR, CLACO_UDP_PORT を使う
+"""
+
+import os
+import stat
+import time
+import select
+import socket
+import struct
+import logging
+from typing import Mapping, NamedTuple, Tuple
+
+from claco.wire import MAX_DATAGRAM_SIZE
+
+
+logger = logging.getLogger(__name__)
+
+
+TRANSPORT_UDP = "udp"
+TRANSPORT_UNIX = "unix"
+TRANSPORT_TCP = "tcp"
+TRANSPORTS = (TRANSPORT_UDP, TRANSPORT_UNIX, TRANSPORT_TCP)
+
+# tcp で送るレコードの長さ（ビッグエンディアンの4バイト）
+RECORD_HEADER = struct.Struct("!I")
+# tcp で送る1つのレコードの最大バイト数
+MAX_RECORD_SIZE = 1 << 20
+
+
+class Endpoint(NamedTuple):
+    # 受信側のアドレス
+    # udp の場合は (ip, port)、unix の場合はソケットファイルのパス
+    transport: str
+    address: Tuple[str, int] | str
+
+    def __str__(self) -> str:
+        if self.transport == TRANSPORT_UNIX:
+            return f"unix://{self.address}"
+        ip, port = self.address
+        return f"{self.transport}://{ip}:{port}"
+
+
+def udp_endpoint(ip: str, port: int) -> Endpoint:
+    return Endpoint(TRANSPORT_UDP, (ip, int(port)))
+
+
+def tcp_endpoint(ip: str, port: int) -> Endpoint:
+    return Endpoint(TRANSPORT_TCP, (ip, int(port)))
+
+
+def unix_endpoint(path: str) -> Endpoint:
+    if not hasattr(socket, "AF_UNIX"):
+        raise ValueError("unix transport is not supported on this platform")
+    return Endpoint(TRANSPORT_UNIX, os.fspath(path))
+
+
+def endpoint_from_env(env: Mapping[str, str] | None = None) -> Endpoint:
+    """
+    環境変数からトランスポートと宛先を読み込む
+
+    Args:
+        env: 環境変数。None の場合は os.environ
+
+    Returns:
+        Endpoint
+    """
+    if env is None:
+        env = os.environ
+
+    transport = env.get("CLACO_TRANSPORT", "") or TRANSPORT_UDP
+    if transport not in TRANSPORTS:
+        raise ValueError(f"unknown CLACO_TRANSPORT: {transport!r} (expected one of {', '.join(TRANSPORTS)})")
+
+    if transport == TRANSPORT_UNIX:
+        path = env.get("CLACO_UNIX_PATH")
+        if not path:
+            raise ValueError("CLACO_UNIX_PATH is not set")
+        return unix_endpoint(path)
+
+    if transport == TRANSPORT_TCP:
+        addr = env.get("CLACO_TCP_ADDR", env.get("CLACO_UDP_ADDR"))
+        port = env.get("CLACO_TCP_PORT", env.get("CLACO_UDP_PORT"))
+        if addr is None:
+            raise ValueError("CLACO_TCP_ADDR is not set")
+        if port is None:
+            raise ValueError("CLACO_TCP_PORT is not set")
+        return tcp_endpoint(addr, int(port))
+
+    addr = env.get("CLACO_UDP_ADDR")
+    port = env.get("CLACO_UDP_PORT")
+    if addr is None:
+        raise ValueError("CLACO_UDP_ADDR is not set")
+    if port is None:
+        raise ValueError("CLACO_UDP_PORT is not set")
+    return udp_endpoint(addr, int(port))
+
+
+def is_stream(endpoint: Endpoint) -> bool:
+    # データグラムではなくストリームで送るトランスポートかどうか
+    return endpoint.transport == TRANSPORT_TCP
+
+
+def max_frame_size(endpoint: Endpoint) -> int:
+    # 1回の send で送れるヘッダを含めた最大バイト数
+    return MAX_RECORD_SIZE if is_stream(endpoint) else MAX_DATAGRAM_SIZE
+
+
+def _family(endpoint: Endpoint) -> int:
+    if endpoint.transport == TRANSPORT_UNIX:
+        return socket.AF_UNIX
+    if endpoint.transport in (TRANSPORT_UDP, TRANSPORT_TCP):
+        return socket.AF_INET
+    raise ValueError(f"unknown transport: {endpoint.transport!r}")
+
+
+def _type(endpoint: Endpoint) -> int:
+    return socket.SOCK_STREAM if is_stream(endpoint) else socket.SOCK_DGRAM
+
+
+def create_socket(endpoint: Endpoint, reuse_port: bool = False) -> socket.socket:
+    """
+    受信用のソケットを作成する（バインドはしない）
+
+    Args:
+        endpoint: 受信するアドレス
+        reuse_port: SO_REUSEPORT を指定するかどうか（udp のみ）
+    """
+    sock = socket.socket(_family(endpoint), _type(endpoint))
+
+    if endpoint.transport == TRANSPORT_TCP:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            sock.close()
+            raise ValueError(f"SO_REUSEPORT is not supported by {endpoint.transport} transport")
+    elif endpoint.transport == TRANSPORT_UDP:
+        # ソケットの再利用を有効化
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuse_port:
+            # カーネルが送信元アドレスごとにデータグラムを振り分ける
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    elif reuse_port:
+        sock.close()
+        raise ValueError(f"SO_REUSEPORT is not supported by {endpoint.transport} transport")
+
+    return sock
+
+
+def bind_socket(sock: socket.socket, endpoint: Endpoint) -> None:
+    """
+    受信用のソケットをバインドする
+    unix の場合、前回の実行で残ったソケットファイルは削除する
+    tcp の場合は接続の受け付けを開始する
+    """
+    if endpoint.transport == TRANSPORT_UNIX:
+        try:
+            if stat.S_ISSOCK(os.stat(endpoint.address).st_mode):
+                os.unlink(endpoint.address)
+        except FileNotFoundError:
+            pass
+    sock.bind(endpoint.address)
+    if is_stream(endpoint):
+        sock.listen()
+
+
+def unbind_socket(endpoint: Endpoint) -> None:
+    """
+    受信用のソケットを閉じた後の後始末をする
+    unix の場合はソケットファイルを削除する
+    """
+    if endpoint.transport == TRANSPORT_UNIX:
+        try:
+            os.unlink(endpoint.address)
+        except OSError:
+            pass
+
+
+def connect_socket(endpoint: Endpoint, timeout: float | None = None) -> socket.socket:
+    """
+    送信用のソケットを作成し、endpoint に connect する
+    connect しておくことで、送信のたびに宛先を解決しなくて済む
+
+    Args:
+        endpoint: 宛先
+        timeout: tcp の場合の接続のタイムアウト [s]
+    """
+    sock = socket.socket(_family(endpoint), _type(endpoint))
+    try:
+        if is_stream(endpoint):
+            # 小さなレコードをすぐに送る
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock.settimeout(timeout)
+        sock.connect(endpoint.address)
+        sock.settimeout(None)
+    except:
+        sock.close()
+        raise
+    return sock
+
+
+def encode_record(data: bytes) -> bytes:
+    # tcp で送るために、長さを前に付ける
+    if len(data) > MAX_RECORD_SIZE:
+        raise ValueError(f"record too large: {len(data)} > {MAX_RECORD_SIZE}")
+    return RECORD_HEADER.pack(len(data)) + data
+
+
+class RecordDecoder:
+    """
+    tcp のストリームから、長さを前に付けたレコードを切り出す
+    """
+
+    def __init__(self, max_size: int = MAX_RECORD_SIZE):
+        """
+        Args:
+            max_size: レコードの最大バイト数。超えた場合は ValueError
+        """
+        self.max_size = max_size
+        self._buf = bytearray()
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """
+        受信したデータを追加し、切り出せたレコードを返す
+        途中までしか届いていないレコードは次の feed まで保持する
+        """
+        buf = self._buf
+        buf += data
+        records = []
+        pos = 0
+        while len(buf) - pos >= RECORD_HEADER.size:
+            (n,) = RECORD_HEADER.unpack_from(buf, pos)
+            if n > self.max_size:
+                raise ValueError(f"record too large: {n} > {self.max_size}")
+            end = pos + RECORD_HEADER.size + n
+            if len(buf) < end:
+                break
+            records.append(bytes(buf[pos + RECORD_HEADER.size : end]))
+            pos = end
+        del buf[:pos]
+        return records
+
+    @property
+    def pending(self) -> int:
+        # 切り出せていないバイト数
+        return len(self._buf)
+
+
+class Connection:
+    """
+    送信側の接続
+    send が失敗した場合は接続し直して一度だけ再送する
+    接続に失敗した場合、次に接続を試みるまでの間隔を backoff から max_backoff まで倍々に延ばし、その間の send はすぐに失敗させる
+    """
+
+    def __init__(
+        self,
+        endpoint: Endpoint,
+        backoff: float = 0.05,
+        max_backoff: float = 5.0,
+        connect_timeout: float = 2.0,
+    ):
+        """
+        Args:
+            endpoint: 宛先
+            backoff: 接続に失敗した後、次に接続を試みるまでの最初の間隔 [s]
+            max_backoff: 接続を試みる間隔の最大値 [s]
+            connect_timeout: tcp の場合の接続のタイムアウト [s]
+        """
+        self.endpoint = endpoint
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.connect_timeout = connect_timeout
+        self.stream = is_stream(endpoint)
+        self.reconnects = 0
+        self._sock: socket.socket | None = None
+        self._delay = 0.0
+        self._retry_at = 0.0
+
+    def _connect(self) -> socket.socket:
+        if self._sock is not None:
+            return self._sock
+
+        now = time.monotonic()
+        if now < self._retry_at:
+            raise ConnectionRefusedError(f"waiting {self._retry_at - now:.2f}s before reconnecting to {self.endpoint}")
+
+        try:
+            self._sock = connect_socket(self.endpoint, self.connect_timeout)
+        except OSError:
+            self._delay = min(max(self._delay * 2, self.backoff), self.max_backoff)
+            self._retry_at = time.monotonic() + self._delay
+            raise
+
+        self._delay = 0.0
+        return self._sock
+
+    def _check_stream(self) -> None:
+        # 受信側は何も送ってこないので、読めるデータがある場合は受信側が接続を閉じている
+        # 閉じた接続への最初の send は成功してしまい、データが失われるので、送る前に確かめる
+        # MSG_DONTWAIT は Windows に無いので select で確かめる
+        readable, _, _ = select.select([self._sock], [], [], 0)
+        if not readable:
+            return
+        try:
+            closed = self._sock.recv(1, socket.MSG_PEEK) == b""
+        except OSError as e:
+            raise ConnectionResetError(f"connection to {self.endpoint} is broken: {e!r}") from e
+        if closed:
+            raise ConnectionResetError(f"connection to {self.endpoint} was closed by the receiver")
+
+    def _send_once(self, data: bytes) -> None:
+        sock = self._connect()
+        if self.stream:
+            self._check_stream()
+            sock.sendall(data)
+        else:
+            sock.send(data)
+
+    def send(self, data: bytes, timeout: float = 0.0) -> None:
+        """
+        データグラムを1つ送る。tcp の場合は長さを前に付けたレコードとして送る
+
+        Args:
+            data: 送るデータ
+            timeout: 接続し直しても送れなかった場合に、間隔を空けながら接続し直し続ける最大時間 [s]
+                0 の場合は一度だけ接続し直して、送れなければ例外を送出する
+
+        Raises:
+            OSError: 期限までに送れなかった
+        """
+        if self.stream:
+            data = encode_record(data)
+
+        deadline = time.monotonic() + timeout
+        retried = False
+        while True:
+            try:
+                self._send_once(data)
+                return
+            except OSError as e:
+                self.close()
+                if not retried:
+                    # connect 済みの UDP ソケットは、以前の送信で受け取った ICMP エラーを次の send で報告してくる
+                    # Unix ドメインソケットや tcp では、受信側がソケットを閉じると送信できなくなる
+                    # 受信側が起動し直している可能性があるので、すぐに接続し直して再送する
+                    # 接続のタイムアウトや経路の無いエラー（EHOSTUNREACH など）も、ネットワークが戻るまで同じように扱う
+                    # tcp で送信の途中で切れた場合、受信側は途中までのレコードを捨てるので、再送しても重複しない
+                    logger.debug(f"[{self.__class__.__name__}] send failed; reconnecting to {self.endpoint}: {e!r}")
+                    self.reconnects += 1
+                    retried = True
+                    continue
+                now = time.monotonic()
+                if now >= deadline:
+                    raise
+                # 受信側の起動を待って、次に接続を試みられる時刻まで待つ
+                # tcp の接続は1回あたり connect_timeout かかるので、期限をその分だけ超える場合がある
+                time.sleep(min(max(self._retry_at - now, self.backoff), deadline - now))
+            except:
+                self.close()
+                raise
+
+    def close(self) -> None:
+        # 次の send で接続し直す
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
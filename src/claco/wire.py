@@ -0,0 +1,446 @@
+"""
+Sink サーバとレシーバーの間でやりとりするデータの形式
+"""
+
+import os
+import struct
+from typing import NamedTuple
+
+# 受信側のデフォルトの受信バッファサイズに合わせる
+MAX_DATAGRAM_SIZE = 4096
+
+# 複数のメッセージを1つのデータグラムにまとめるときの区切り文字（ASCII RS）
+# まとめたデータグラムは区切り文字で始まるので、通常のメッセージと区別できる
+BATCH_SEPARATOR = "\x1e"
+
+
+def pack_batch(messages: list[str], max_size: int = MAX_DATAGRAM_SIZE) -> list[bytes]:
+    """
+    複数のメッセージを、なるべく少ない数のデータグラムにまとめる
+
+    Args:
+        messages: まとめるメッセージ
+        max_size: 1つのデータグラムの最大バイト数
+
+    Returns:
+        送信するデータグラムのリスト。max_size を超えるメッセージは単独のデータグラムになる
+    """
+    sep = BATCH_SEPARATOR.encode("utf-8")
+    datagrams = []
+    current = bytearray()
+
+    for message in messages:
+        item = sep + message.encode("utf-8")
+        if current and len(current) + len(item) > max_size:
+            datagrams.append(bytes(current))
+            current.clear()
+        current += item
+
+    if current:
+        datagrams.append(bytes(current))
+
+    return datagrams
+
+
+def unpack_batch(message: str) -> list[str]:
+    """
+    pack_batch でまとめたメッセージを元のメッセージのリストに戻す
+    まとめられていないメッセージはそのまま返す
+
+    Args:
+        message: 受信したメッセージ
+
+    Returns:
+        メッセージのリスト
+    """
+    if not message.startswith(BATCH_SEPARATOR):
+        return [message]
+    return message.split(BATCH_SEPARATOR)[1:]
+
+
+# フレームヘッダ
+#   magic (2 bytes) | version (1 byte) | flags (1 byte) | session (4 bytes) | epoch (4 bytes) | seq (4 bytes)
+# magic は UTF-8 として不正なバイト列なので、ヘッダの無いテキストのデータグラムと区別できる
+# epoch は送信側のプロセスごとに変わる値。同じセッションIDのまま再起動した送信側が連番 0 から送り直したことを、
+# 受信側が重複と取り違えないために付ける
+FRAME_MAGIC = b"\xcc\x1a"
+FRAME_VERSION = 2
+FRAME_HEADER = struct.Struct("!2sBBIII")
+FRAME_HEADER_SIZE = FRAME_HEADER.size
+
+# epoch の無いバージョン 1 のヘッダ。受信側は epoch 0 として扱う
+FRAME_HEADER_V1 = struct.Struct("!2sBBII")
+
+SEQ_MODULO = 1 << 32
+
+# フラグ
+# 1つのデータグラムに収まらないメッセージは、連続した連番を持つ複数のフラグメントに分けて送る
+FLAG_FRAGMENT = 0x01
+FLAG_FRAGMENT_END = 0x02
+# 最初のフラグメント。欠番の後に届いた続きのフラグメントを、新しいメッセージの始まりと取り違えないために付ける
+FLAG_FRAGMENT_START = 0x04
+
+
+class Frame(NamedTuple):
+    session: int
+    seq: int
+    flags: int
+    payload: bytes
+    epoch: int = 0
+
+
+class GapEvent(NamedTuple):
+    # session の seq から count 個のデータグラムが届かなかった
+    session: int
+    seq: int
+    count: int
+
+
+def encode_frame(session: int, seq: int, payload: bytes, flags: int = 0, epoch: int = 0) -> bytes:
+    return FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, flags, session, epoch, seq % SEQ_MODULO) + payload
+
+
+def decode_frame(data: bytes) -> Frame | None:
+    """
+    データグラムからフレームを取り出す
+
+    Args:
+        data: 受信したデータグラム。memoryview の場合、payload はコピーせずに参照する
+
+    Returns:
+        フレーム。ヘッダの無いデータグラムの場合は None
+
+    Raises:
+        ValueError: 未対応のバージョンか、ヘッダが壊れている
+    """
+    if data[: len(FRAME_MAGIC)] != FRAME_MAGIC:
+        return None
+    if len(data) < FRAME_HEADER_V1.size:
+        raise ValueError(f"truncated frame header: {len(data)} bytes")
+
+    version = data[len(FRAME_MAGIC)]
+    if version == 1:
+        _, _, flags, session, seq = FRAME_HEADER_V1.unpack_from(data)
+        return Frame(session, seq, flags, data[FRAME_HEADER_V1.size :])
+    if version != FRAME_VERSION:
+        raise ValueError(f"unsupported frame version: {version}")
+    if len(data) < FRAME_HEADER_SIZE:
+        raise ValueError(f"truncated frame header: {len(data)} bytes")
+
+    _, _, flags, session, epoch, seq = FRAME_HEADER.unpack_from(data)
+    return Frame(session, seq, flags, data[FRAME_HEADER_SIZE:], epoch)
+
+
+class FrameWriter:
+    """
+    送信側でセッションIDと連番を管理し、データグラムにヘッダを付ける
+    """
+
+    def __init__(self, session: int | None = None, epoch: int | None = None):
+        """
+        Args:
+            session: セッションID。None の場合はランダムに決める
+            epoch: 送信側のプロセスを区別する値。None の場合はランダムに決める
+        """
+        if session is None:
+            session = int.from_bytes(os.urandom(4))
+        if epoch is None:
+            epoch = int.from_bytes(os.urandom(4))
+        self.session = session % SEQ_MODULO
+        self.epoch = epoch % SEQ_MODULO
+        self.seq = 0
+
+    def frame(self, payload: bytes, flags: int = 0) -> bytes:
+        data = encode_frame(self.session, self.seq, payload, flags, self.epoch)
+        self.seq = (self.seq + 1) % SEQ_MODULO
+        return data
+
+    def frames(self, payload: bytes, max_size: int = MAX_DATAGRAM_SIZE) -> list[bytes]:
+        """
+        ヘッダを付けたデータグラムを返す
+        max_size に収まらない場合は複数のフラグメントに分ける
+
+        Args:
+            payload: 送信するデータ
+            max_size: ヘッダを含めた1つのデータグラムの最大バイト数
+
+        Returns:
+            送信するデータグラムのリスト
+        """
+        chunk_size = max_size - FRAME_HEADER_SIZE
+        if len(payload) <= chunk_size:
+            return [self.frame(payload)]
+
+        view = memoryview(payload)
+        chunks = [view[i : i + chunk_size] for i in range(0, len(payload), chunk_size)]
+        datagrams = [self.frame(chunks[0], FLAG_FRAGMENT | FLAG_FRAGMENT_START)]
+        datagrams += [self.frame(chunk, FLAG_FRAGMENT) for chunk in chunks[1:-1]]
+        datagrams.append(self.frame(chunks[-1], FLAG_FRAGMENT | FLAG_FRAGMENT_END))
+        return datagrams
+
+
+class ReorderBuffer:
+    """
+    1つのセッションのフレームを連番順に並べ直す
+    欠番があった場合は window 秒だけ待ち、それでも届かなければ欠番として飛ばす
+    FrameWriter は連番 0 から送るので、0 が届くまでは（最大で window 秒）起点を決めずに待つ
+    """
+
+    def __init__(self, session: int, window: float = 0.2, max_pending: int = 256):
+        """
+        Args:
+            session: セッションID
+            window: 欠番が届くのを待つ最大時間 [s]
+            max_pending: 並べ直しのために保持する最大フレーム数。超えた場合は待たずに欠番として飛ばす
+        """
+        self.session = session
+        self.window = window
+        self.max_pending = max_pending
+        self.expected: int | None = None
+        self.pending: dict[int, Frame] = {}
+        self.gap_since: float | None = None
+        self.duplicates = 0
+
+    def _distance(self, seq: int) -> int:
+        # expected からの距離。負なら既に処理済み（重複か遅延）
+        d = (seq - self.expected) % SEQ_MODULO
+        return d - SEQ_MODULO if d >= SEQ_MODULO // 2 else d
+
+    def push(self, frame: Frame, now: float) -> tuple[list[Frame], list[GapEvent]]:
+        """
+        フレームを追加し、順番通りに取り出せるようになったフレームを返す
+
+        Args:
+            frame: 受信したフレーム
+            now: 現在時刻（time.monotonic）
+
+        Returns:
+            (取り出せたフレーム, 検出した欠番)
+        """
+        if self.expected is None:
+            if frame.seq != 0:
+                return self._hold(frame, now)
+            # 先に届いて保持しているフレームも、ここから順番に取り出せる
+            self.expected = 0
+
+        d = self._distance(frame.seq)
+        if d < 0 or frame.seq in self.pending:
+            self.duplicates += 1
+            return [], []
+
+        if d == 0 and not self.pending:
+            # 順番通りに届いた場合は保持せずにそのまま返す
+            self.expected = (self.expected + 1) % SEQ_MODULO
+            return [frame], []
+
+        # payload が受信バッファを参照している場合があるので、保持するときはコピーする
+        self.pending[frame.seq] = frame._replace(payload=bytes(frame.payload))
+        released = self._release()
+        gaps = []
+
+        while len(self.pending) > self.max_pending:
+            gaps.append(self._skip())
+            released += self._release()
+
+        if self.pending:
+            # 欠番が埋まって先に進んだ場合は、次の欠番の待ち時間を数え直す
+            if self.gap_since is None or released:
+                self.gap_since = now
+        else:
+            self.gap_since = None
+
+        return released, gaps
+
+    def expire(self, now: float) -> tuple[list[Frame], list[GapEvent]]:
+        """
+        待ち時間を過ぎた欠番を飛ばし、取り出せるようになったフレームを返す
+
+        Args:
+            now: 現在時刻（time.monotonic）
+
+        Returns:
+            (取り出せたフレーム, 検出した欠番)
+        """
+        released: list[Frame] = []
+        gaps: list[GapEvent] = []
+
+        while self.gap_since is not None and now - self.gap_since >= self.window:
+            if self.expected is None:
+                # 0 が届かなかったので、セッションの途中から受信を始めたものとして扱う
+                self._settle()
+            else:
+                gaps.append(self._skip())
+            released += self._release()
+            self.gap_since = now if self.pending else None
+
+        return released, gaps
+
+    def flush(self) -> tuple[list[Frame], list[GapEvent]]:
+        """
+        待ち時間に関わらず欠番を飛ばし、保持しているフレームをすべて返す
+
+        Returns:
+            (取り出せたフレーム, 検出した欠番)
+        """
+        released: list[Frame] = []
+        gaps: list[GapEvent] = []
+
+        while self.pending:
+            if self.expected is None:
+                self._settle()
+            elif self.expected not in self.pending:
+                gaps.append(self._skip())
+            released += self._release()
+        self.gap_since = None
+
+        return released, gaps
+
+    def deadline(self) -> float | None:
+        # 次に expire を呼ぶべき時刻
+        if self.gap_since is None:
+            return None
+        return self.gap_since + self.window
+
+    def _hold(self, frame: Frame, now: float) -> tuple[list[Frame], list[GapEvent]]:
+        # 起点が決まる前のフレームを保持する
+        # 先頭のフレームが遅れているだけかもしれないので、0 が届くか window 秒経つまで待つ
+        if frame.seq in self.pending:
+            self.duplicates += 1
+            return [], []
+
+        self.pending[frame.seq] = frame._replace(payload=bytes(frame.payload))
+        if self.gap_since is None:
+            self.gap_since = now
+        if len(self.pending) <= self.max_pending:
+            return [], []
+
+        self._settle()
+        released = self._release()
+        self.gap_since = now if self.pending else None
+        return released, []
+
+    def _settle(self) -> None:
+        # 保持しているフレームのうち最も古いものを起点にする
+        # 連番は一周するので、最初に届いたフレームからの距離で比べる
+        self.expected = next(iter(self.pending))
+        self.expected = min(self.pending, key=self._distance)
+
+    def _release(self) -> list[Frame]:
+        released = []
+        while self.expected in self.pending:
+            released.append(self.pending.pop(self.expected))
+            self.expected = (self.expected + 1) % SEQ_MODULO
+        return released
+
+    def _skip(self) -> GapEvent:
+        # 保持しているフレームのうち最も近いものまで expected を進める
+        d = min(self._distance(seq) for seq in self.pending)
+        gap = GapEvent(self.session, self.expected, d)
+        self.expected = (self.expected + d) % SEQ_MODULO
+        return gap
+
+
+class Reassembler:
+    """
+    1つのセッションのフラグメントを元のメッセージに組み立てる
+    フレームは ReorderBuffer で順番通りに並べ直したものを渡すこと
+
+    欠番やタイムアウトで組み立て途中のメッセージを捨てた後は、FLAG_FRAGMENT_START の付いたフラグメントが届くまで
+    フラグメントを捨てる。続きのフラグメントだけで組み立てると、先頭の欠けたメッセージを渡してしまう
+    """
+
+    def __init__(self, max_size: int = 1 << 20, timeout: float = 5.0):
+        """
+        Args:
+            max_size: 組み立てるメッセージの最大バイト数。超えたメッセージは捨てる
+            timeout: 最初のフラグメントを受け取ってから組み立て終わるまでの最大時間 [s]
+        """
+        self.max_size = max_size
+        self.timeout = timeout
+        self._buf: bytearray | None = None
+        self._len = 0
+        self._started: float | None = None
+        self._discarding = False
+        # 直前のメッセージを最後まで受け取れている。FLAG_FRAGMENT_START を付けない古い Sink のフラグメントは、
+        # この場合だけ新しいメッセージの始まりとして扱う
+        self._synced = False
+        self.discarded = 0
+
+    def feed(self, frame: Frame, now: float) -> bytes | memoryview | None:
+        """
+        フレームを追加する
+
+        Args:
+            frame: 順番通りに並べたフレーム
+            now: 現在時刻（time.monotonic）
+
+        Returns:
+            組み立て終わったメッセージ。フラグメントでないフレームの場合は payload をそのまま返す
+            まだ組み立て途中の場合は None
+        """
+        if not frame.flags & FLAG_FRAGMENT:
+            if self._started is not None:
+                # 組み立て途中のメッセージの残りが届かなかった
+                self.reset()
+            self._synced = True
+            return frame.payload
+
+        if frame.flags & FLAG_FRAGMENT_START:
+            if self._started is not None:
+                self.reset()
+            self._started = now
+            self._len = 0
+        elif self._started is None:
+            self._started = now
+            self._len = 0
+            if not self._synced:
+                # 先頭のフラグメントが欠けている。最後のフラグメントまで捨てる
+                self._discarding = True
+
+        payload = frame.payload
+        n = len(payload)
+        if not self._discarding:
+            if self._len + n > self.max_size:
+                self._discarding = True
+                self._buf = None
+                self._len = 0
+            else:
+                # 必要な分だけ伸ばす。max_size 分を最初に確保すると、セッションごとに使わないメモリを抱え続ける
+                if self._buf is None:
+                    self._buf = bytearray(payload)
+                else:
+                    self._buf += payload
+                self._len += n
+
+        if not frame.flags & FLAG_FRAGMENT_END:
+            return None
+
+        discarding = self._discarding
+        data = bytes(self._buf) if not discarding and self._buf is not None else None
+        self.reset(count=discarding)
+        self._synced = True
+        return data
+
+    def reset(self, count: bool = True) -> None:
+        # 組み立て途中のメッセージを捨てる
+        if count and self._started is not None:
+            self.discarded += 1
+        self._buf = None
+        self._len = 0
+        self._started = None
+        self._discarding = False
+        self._synced = False
+
+    def deadline(self) -> float | None:
+        # 組み立て途中のメッセージを捨てる時刻
+        if self._started is None:
+            return None
+        return self._started + self.timeout
+
+    def expire(self, now: float) -> bool:
+        # タイムアウトしたメッセージを捨てる。捨てた場合は True を返す
+        deadline = self.deadline()
+        if deadline is not None and now >= deadline:
+            self.reset()
+            return True
+        return False
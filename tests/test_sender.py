@@ -0,0 +1,70 @@
+import asyncio
+import os
+import stat
+import sys
+import tempfile
+import time
+import unittest
+
+from claco.sender import Sender
+
+
+# 実行中の区間をログに書き出すだけのヘルパー
+HELPER = """\
+import sys, time
+with open(sys.argv[-1] + ".log", "a") as f:
+    f.write(f"{time.monotonic()} start\\n")
+time.sleep(0.2)
+with open(sys.argv[-1] + ".log", "a") as f:
+    f.write(f"{time.monotonic()} end\\n")
+"""
+
+
+@unittest.skipIf(os.name == "nt", "the fake helper is a shebang script")
+class AsyncTypingTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.helper = os.path.join(self.dir.name, "helper")
+        with open(self.helper, "w") as f:
+            f.write(f"#!{sys.executable}\n{HELPER}")
+        os.chmod(self.helper, os.stat(self.helper).st_mode | stat.S_IXUSR)
+        self.log = os.path.join(self.dir.name, "typing")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def _max_overlap(self) -> int:
+        with open(self.log + ".log") as f:
+            events = sorted((float(t), kind) for t, kind in (line.split() for line in f))
+        running = peak = 0
+        for _, kind in events:
+            running += 1 if kind == "start" else -1
+            peak = max(peak, running)
+        return peak
+
+    def _send_to_windows(self, **kwargs) -> list:
+        # ウィンドウごとに別の Sender から同時に送る
+        senders = [Sender(self.helper, **kwargs) for _ in range(3)]
+
+        async def main():
+            return await asyncio.gather(
+                *(s.asend("Claude", self.log, window_title=f"w{i}") for i, s in enumerate(senders))
+            )
+
+        return asyncio.run(main())
+
+    def test_windows_are_serialized_by_default(self):
+        results = self._send_to_windows()
+        self.assertEqual(results, [(True, None)] * 3)
+        self.assertEqual(self._max_overlap(), 1)
+
+    def test_parallel_windows(self):
+        t = time.monotonic()
+        results = self._send_to_windows(parallel_windows=True)
+        self.assertEqual(results, [(True, None)] * 3)
+        self.assertGreater(self._max_overlap(), 1)
+        self.assertLess(time.monotonic() - t, 0.6)
+
+
+if __name__ == "__main__":
+    unittest.main()
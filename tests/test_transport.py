@@ -0,0 +1,56 @@
+import socket
+import time
+import unittest
+from unittest import mock
+
+from claco import transport
+from claco.transport import Connection, tcp_endpoint
+
+
+class ConnectionRetryTest(unittest.TestCase):
+    def setUp(self):
+        self.server = socket.create_server(("127.0.0.1", 0))
+        self.endpoint = tcp_endpoint("127.0.0.1", self.server.getsockname()[1])
+        self.attempts = 0
+
+    def tearDown(self):
+        self.server.close()
+
+    def _timing_out(self, failures: int):
+        # 最初の failures 回の接続はタイムアウトさせる
+        connect = transport.connect_socket
+
+        def connect_socket(endpoint, timeout=None):
+            self.attempts += 1
+            if self.attempts <= failures:
+                raise TimeoutError("timed out")
+            return connect(endpoint, timeout)
+
+        return mock.patch.object(transport, "connect_socket", connect_socket)
+
+    def test_connect_timeout_is_retried_until_deadline(self):
+        conn = Connection(self.endpoint, backoff=0.01)
+        with self._timing_out(failures=3):
+            conn.send(b"hello", timeout=1.0)
+        conn.close()
+        self.assertEqual(self.attempts, 4)
+
+    def test_connect_timeout_raises_after_deadline(self):
+        conn = Connection(self.endpoint, backoff=0.01)
+        t = time.monotonic()
+        # 最後の例外は、次に接続を試みるまでの待ち時間中に送ろうとした ConnectionRefusedError の場合もある
+        with self._timing_out(failures=1000), self.assertRaises(OSError):
+            conn.send(b"hello", timeout=0.2)
+        self.assertGreaterEqual(time.monotonic() - t, 0.2)
+        self.assertGreater(self.attempts, 2)
+
+    def test_connect_timeout_without_send_timeout(self):
+        # timeout=0 の場合は待たずに失敗する。接続に失敗した直後は backoff の間は接続し直さない
+        conn = Connection(self.endpoint, backoff=0.01)
+        with self._timing_out(failures=1000), self.assertRaises(OSError):
+            conn.send(b"hello")
+        self.assertEqual(self.attempts, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
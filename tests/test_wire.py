@@ -0,0 +1,124 @@
+import time
+import unittest
+
+from claco.receiver import UDPReceiver
+from claco.wire import (
+    FLAG_FRAGMENT,
+    FLAG_FRAGMENT_START,
+    FRAME_HEADER_V1,
+    FRAME_MAGIC,
+    FrameWriter,
+    Reassembler,
+    decode_frame,
+)
+
+
+class _Collector:
+    # _dispatch に直接データグラムを渡して、届いたメッセージを集める
+
+    def __init__(self, reorder_window: float = 0.05):
+        self.receiver = UDPReceiver("127.0.0.1", 0, reorder_window=reorder_window)
+        self.messages: list[str] = []
+        self.gaps = []
+        self.receiver.register_envelope_callback(lambda envelope: self.messages.append(envelope.message))
+        self.receiver.register_gap_callback(self.gaps.append)
+
+    def feed(self, datagrams: list[bytes]) -> None:
+        for data in datagrams:
+            self.receiver._dispatch(data, ("127.0.0.1", 0))
+
+    def expire(self) -> None:
+        time.sleep(self.receiver.reorder_window * 2)
+        self.receiver._expire()
+
+
+class FragmentTest(unittest.TestCase):
+    def test_fragments_are_reassembled(self):
+        writer = FrameWriter(1)
+        payload = "x" * 10000
+        datagrams = writer.frames(payload.encode("utf-8"))
+        self.assertEqual(len(datagrams), 3)
+        self.assertTrue(decode_frame(datagrams[0]).flags & FLAG_FRAGMENT_START)
+        self.assertFalse(decode_frame(datagrams[1]).flags & FLAG_FRAGMENT_START)
+
+        c = _Collector()
+        c.feed(datagrams)
+        self.assertEqual(c.messages, [payload])
+
+    def test_first_fragment_dropped(self):
+        writer = FrameWriter(1)
+        before = writer.frames(b"before")
+        fragments = writer.frames(b"x" * 10000)
+        after = writer.frames(b"after")
+
+        c = _Collector()
+        c.feed(before + fragments[1:] + after)
+        c.expire()
+
+        # 先頭の欠けたメッセージは渡さない
+        self.assertEqual(c.messages, ["before", "after"])
+        self.assertEqual(len(c.gaps), 1)
+        self.assertEqual(c.receiver._sessions[1].reassembler.discarded, 1)
+
+    def test_first_fragment_dropped_at_session_start(self):
+        writer = FrameWriter(1)
+        fragments = writer.frames(b"x" * 10000)
+        after = writer.frames(b"after")
+
+        c = _Collector()
+        c.feed(fragments[1:] + after)
+        c.expire()
+
+        self.assertEqual(c.messages, ["after"])
+
+    def test_resync_on_start_fragment(self):
+        writer = FrameWriter(1)
+        first = [decode_frame(d) for d in writer.frames(b"a" * 10000)]
+        second = [decode_frame(d) for d in writer.frames(b"b" * 10000)]
+
+        r = Reassembler()
+        r.feed(first[0], 0.0)
+        r.reset()
+        # 欠番の後の続きのフラグメントは捨て、次の先頭のフラグメントから組み立て直す
+        results = [r.feed(frame, 0.0) for frame in first[1:] + second]
+        self.assertEqual([data for data in results if data is not None], [b"b" * 10000])
+        self.assertTrue(first[1].flags & FLAG_FRAGMENT)
+
+
+class SessionRestartTest(unittest.TestCase):
+    def test_restart_with_same_session(self):
+        c = _Collector()
+        old = FrameWriter(7)
+        late = old.frames(b"late")
+        c.feed(old.frames(b"one") + old.frames(b"two"))
+
+        # CLACO_SESSION を固定した Sink が再起動すると、同じセッションIDで連番 0 から送り直す
+        new = FrameWriter(7)
+        self.assertNotEqual(new.epoch, old.epoch)
+        c.feed(new.frames(b"three") + new.frames(b"<exit>"))
+        # 再起動する前のプロセスのフレームが遅れて届いても渡さない
+        c.feed(late)
+
+        self.assertEqual(c.messages, ["one", "two", "three", "<exit>"])
+        self.assertEqual(c.gaps, [])
+
+    def test_restart_flushes_pending_frames(self):
+        c = _Collector(reorder_window=10.0)
+        old = FrameWriter(7)
+        datagrams = old.frames(b"one") + old.frames(b"two") + old.frames(b"three")
+        # "two" が欠けたまま再起動した
+        c.feed([datagrams[0], datagrams[2]])
+        self.assertEqual(c.messages, ["one"])
+
+        c.feed(FrameWriter(7).frames(b"four"))
+        self.assertEqual(c.messages, ["one", "three", "four"])
+        self.assertEqual(len(c.gaps), 1)
+
+    def test_version1_frame(self):
+        data = FRAME_HEADER_V1.pack(FRAME_MAGIC, 1, 0, 7, 3) + b"hello"
+        frame = decode_frame(data)
+        self.assertEqual((frame.session, frame.seq, frame.epoch, bytes(frame.payload)), (7, 3, 0, b"hello"))
+
+
+if __name__ == "__main__":
+    unittest.main()